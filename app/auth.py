@@ -3,12 +3,25 @@
 from passlib.context import CryptContext
 from jose import jwt, JWTError
 from datetime import datetime, timedelta
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import os
+import threading
+import time
 
 # Carga las variables secretas del entorno
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+# Hilos dedicados a bcrypt: acotan cuántos hashes corren a la vez sin ocupar el pool de la API
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+# Caché de usuarios ya resueltos a partir del token. Cada proceso tiene la suya:
+# al revocar tokens solo se invalida la del proceso que atiende la petición, y
+# los demás workers siguen aceptando los tokens revocados hasta que caduque la
+# entrada (como mucho AUTH_USER_CACHE_TTL_SECONDS)
+AUTH_USER_CACHE_TTL_SECONDS = float(os.getenv("AUTH_USER_CACHE_TTL_SECONDS", 60))
+AUTH_USER_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_USER_CACHE_MAX_ENTRIES", 1024))
 
 # Configura el contexto de hasheo para usar Argon2
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -21,9 +34,74 @@ def get_password_hash(password):
     """Genera el hash de una contraseña en texto plano."""
     return pwd_context.hash(password)
 
+_password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+
+async def verify_password_async(plain_password, hashed_password):
+    """Como verify_password, pero en el executor de bcrypt sin bloquear el event loop."""
+    return await asyncio.get_running_loop().run_in_executor(_password_executor, verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    """Como get_password_hash, pero en el executor de bcrypt sin bloquear el event loop."""
+    return await asyncio.get_running_loop().run_in_executor(_password_executor, get_password_hash, password)
+
+def user_token_claims(user) -> dict:
+    """Datos del usuario que viajan en el token: email, id y versión de sus tokens."""
+    return {"sub": user.email, "uid": user.id, "ver": user.token_version or 0}
+
 def create_access_token(data: dict):
     """Crea un nuevo token de acceso JWT."""
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
\ No newline at end of file
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+
+# --- Caché de Usuarios Autenticados ---
+
+# Lo que los endpoints necesitan del usuario autenticado, sin sesión ni relaciones
+CachedUser = namedtuple("CachedUser", ["id", "email", "token_version"])
+
+class UserCache:
+    """
+    Caché LRU con TTL de usuarios por id. Evita consultar la tabla users en
+    cada petición; se invalida explícitamente cuando cambia el usuario (por
+    ejemplo, al revocar sus tokens) y, en el peor caso, caduca con el TTL.
+    """
+
+    def __init__(self, ttl_seconds: float = AUTH_USER_CACHE_TTL_SECONDS, max_entries: int = AUTH_USER_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return user
+
+    def set(self, user) -> CachedUser:
+        cached = CachedUser(user.id, user.email, user.token_version or 0)
+        with self._lock:
+            self._entries[cached.id] = (cached, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(cached.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return cached
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache()
@@ -0,0 +1,453 @@
+# app/autoseq.py
+
+import heapq
+import math
+import os
+
+import numpy as np
+
+from .spatial import DrillGrid
+
+PATTERNS = ("row", "echelon", "v")
+
+# Un enlace no puede medir más que esto veces el espaciamiento local (entre taladros de la
+# misma fila). Los bloques que quedan más lejos de la malla del iniciador no se secuencian y se avisa
+AUTOSEQ_MAX_LINK_FACTOR = float(os.getenv("AUTOSEQ_MAX_LINK_FACTOR", 2.5))
+
+# Taladros que se muestrean para estimar el espaciamiento típico
+_LAYOUT_SAMPLE = 400
+# Dos taladros vecinos están en la misma fila si el salto no supera esto veces el espaciamiento local...
+_ROW_STEP_FACTOR = 1.5
+# ...y su dirección se aparta menos que esto de la dirección de fila de ambos
+_ROW_ANGLE_TOL = math.radians(15)
+# Filas vecinas: algún par de taladros a menos de esto veces el espaciamiento local
+_ROW_ADJACENCY_FACTOR = 1.6
+# Resolución del histograma de direcciones (bins sobre 180 grados)
+_DIRECTION_BINS = 60
+
+
+def _angle_diff(a, b):
+    """Diferencia entre direcciones módulo pi (0 a pi/2)."""
+    return np.abs(np.mod(a - b + np.pi / 2, np.pi) - np.pi / 2)
+
+
+def _pairs_within(x: np.ndarray, y: np.ndarray, radius: float):
+    """
+    Todos los pares (i < j) a menos de 'radius', vectorizado con una grilla de
+    celdas de ese lado: cada celda solo se compara con ella misma y con la
+    mitad de sus vecinas. Devuelve (i, j, distancia).
+    """
+    n = len(x)
+    if n < 2:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+    cx = np.floor((x - x.min()) / radius).astype(np.int64) + 1
+    cy = np.floor((y - y.min()) / radius).astype(np.int64) + 1
+    height = int(cy.max()) + 2
+    keys = cx * height + cy
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    firsts, seconds = [], []
+    for dx, dy in ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1)):
+        target = (cx + dx) * height + (cy + dy)
+        lo = np.searchsorted(sorted_keys, target, "left")
+        counts = np.searchsorted(sorted_keys, target, "right") - lo
+        first = np.repeat(np.arange(n), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        second = order[np.repeat(lo, counts) + offsets]
+        if dx == 0 and dy == 0:
+            keep = first < second
+            first, second = first[keep], second[keep]
+        firsts.append(first)
+        seconds.append(second)
+    i, j = np.concatenate(firsts), np.concatenate(seconds)
+    d = np.hypot(x[j] - x[i], y[j] - y[i])
+    keep = d <= radius
+    return i[keep], j[keep], d[keep]
+
+
+def _consensus(n: int, target: np.ndarray, angles: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """
+    Para cada taladro, la dirección (módulo pi) con más apoyo entre las
+    evidencias (taladro, ángulo, peso) que le tocan: pico de un histograma
+    suavizado y media circular (con ángulo doble) de lo que cae cerca del pico.
+    NaN donde no hay evidencias.
+    """
+    bins = (np.mod(angles, np.pi) / np.pi * _DIRECTION_BINS).astype(np.int64) % _DIRECTION_BINS
+    hist = np.zeros((n, _DIRECTION_BINS))
+    np.add.at(hist, (target, bins), weights)
+    # Núcleo triangular: un pico aislado sigue siendo el máximo en su propio bin
+    smooth = sum((4 - abs(k)) * np.roll(hist, k, axis=1) for k in range(-3, 4))
+    peak = (smooth.argmax(axis=1) + 0.5) * np.pi / _DIRECTION_BINS
+    near = _angle_diff(angles, peak[target]) < math.radians(10)
+    acc = np.zeros(n, dtype=complex)
+    np.add.at(acc, target[near], weights[near] * np.exp(2j * angles[near]))
+    return np.where(np.abs(acc) > 0, np.mod(np.angle(acc) / 2, np.pi), np.nan)
+
+
+def _row_directions(ids, x, y, pi, pj, pd, local, typical):
+    """
+    Dirección de fila de cada taladro. La evidencia principal es el orden de
+    importación (los levantamientos exportan fila por fila): cada salto corto
+    entre taladros consecutivos da la dirección de su fila, con más peso cuanto
+    más larga la corrida. Cada taladro toma la dirección dominante entre sus
+    vecinos, así que distintos bloques de la malla (o filas que giran) tienen
+    su propia dirección. Donde el orden no ayuda se usa la dirección dominante
+    entre vecinos más cercanos.
+    """
+    n = len(ids)
+    by_id = np.argsort(ids, kind="stable")
+    a, b = by_id[:-1], by_id[1:]
+    step = np.hypot(x[b] - x[a], y[b] - y[a])
+    step_angle = np.arctan2(y[b] - y[a], x[b] - x[a])
+    # Un salto corto cuenta si sigue la dirección del salto anterior o del siguiente (las filas son casi rectas).
+    # El espaciamiento típico sirve de piso: junto a una línea de contorno densa el vecino más cercano no es de la fila
+    short = step <= _ROW_STEP_FACTOR * np.maximum(np.maximum(local[a], local[b]), typical)
+    turn = _angle_diff(step_angle[1:], step_angle[:-1]) < _ROW_ANGLE_TOL
+    straight = np.zeros(len(step), dtype=bool)
+    straight[1:] |= turn & short[:-1]
+    straight[:-1] |= turn & short[1:]
+    accepted = short & straight
+    run = np.concatenate([[0], np.cumsum(~accepted)])
+    run_size = np.bincount(run)[run]
+
+    acc = np.zeros(n, dtype=complex)
+    for ends in (a, b):
+        np.add.at(acc, ends[accepted], np.exp(2j * step_angle[accepted]))
+    has_run = np.abs(acc) > 0
+    own_angle = np.mod(np.angle(acc) / 2, np.pi)
+    own_weight = np.zeros(n)
+    own_weight[by_id] = np.minimum(run_size, 10)
+
+    # Evidencias: la propia y la de los vecinos, atenuada con la distancia
+    src = np.concatenate([np.arange(n), pj, pi])
+    dst = np.concatenate([np.arange(n), pi, pj])
+    dist = np.concatenate([np.zeros(n), pd, pd])
+    use = has_run[src]
+    theta = _consensus(n, dst[use], own_angle[src[use]], own_weight[src[use]] / (1.0 + dist[use] / local[dst[use]]))
+
+    missing = np.isnan(theta)
+    if missing.any():
+        short = pd <= 1.2 * np.minimum(local[pi], local[pj])
+        vec_angle = np.arctan2(y[pj] - y[pi], x[pj] - x[pi])[short]
+        fallback = _consensus(n, np.concatenate([pi[short], pj[short]]), np.concatenate([vec_angle, vec_angle]),
+                              np.ones(2 * short.sum()))
+        theta = np.where(missing, fallback, theta)
+    return np.nan_to_num(theta, nan=0.0)
+
+
+def _rows(x, y, theta, pi, pj, pd, local):
+    """
+    Filas como cadenas: cada taladro se une al vecino más cercano de cada lado
+    a lo largo de su dirección de fila, si ambos están de acuerdo en la
+    dirección y el salto no es mucho mayor que el más corto de cada uno en esa
+    dirección; solo se aceptan las uniones mutuas, de modo que cada fila es una
+    cadena ordenada (aunque gire) y filas paralelas cercanas no se mezclan.
+    Devuelve (filas en orden, fila de cada taladro, espaciamiento en la fila de
+    cada taladro, longitudes de los saltos dentro de las filas).
+    """
+    n = len(x)
+    phi = np.arctan2(y[pj] - y[pi], x[pj] - x[pi])
+    aligned = (pd > 0) & (_angle_diff(phi, theta[pi]) < _ROW_ANGLE_TOL) & (_angle_diff(phi, theta[pj]) < _ROW_ANGLE_TOL)
+    along = np.full(n, np.inf)
+    np.minimum.at(along, pi[aligned], pd[aligned])
+    np.minimum.at(along, pj[aligned], pd[aligned])
+    ok = aligned & (pd <= _ROW_STEP_FACTOR * np.minimum(along[pi], along[pj]))
+    a = np.concatenate([pi[ok], pj[ok]])
+    b = np.concatenate([pj[ok], pi[ok]])
+    d = np.concatenate([pd[ok], pd[ok]])
+    side = (np.cos(theta[a]) * (x[b] - x[a]) + np.sin(theta[a]) * (y[b] - y[a])) > 0
+    key = a * 2 + side
+    order = np.lexsort((d, key))
+    _, first = np.unique(key[order], return_index=True)
+    chosen_a, chosen_b = a[order][first], b[order][first]
+    chosen = set(zip(chosen_a.tolist(), chosen_b.tolist()))
+
+    neighbors = [[] for _ in range(n)]
+    steps = []
+    for u, v in chosen:
+        if u < v and (v, u) in chosen:
+            neighbors[u].append(v)
+            neighbors[v].append(u)
+            steps.append(math.hypot(x[v] - x[u], y[v] - y[u]))
+
+    row_of = np.full(n, -1, dtype=np.int64)
+    rows = []
+    # Primero desde los extremos (cadenas abiertas), luego lo que quede (cadenas cerradas)
+    for start in [i for i in range(n) if len(neighbors[i]) < 2] + list(range(n)):
+        if row_of[start] >= 0:
+            continue
+        chain, prev, cur = [], -1, start
+        while cur >= 0 and row_of[cur] < 0:
+            row_of[cur] = len(rows)
+            chain.append(cur)
+            nxt = [v for v in neighbors[cur] if v != prev and row_of[v] < 0]
+            prev, cur = cur, (nxt[0] if nxt else -1)
+        rows.append(np.array(chain, dtype=np.int64))
+    return rows, row_of, np.where(np.isfinite(along), along, local), np.array(steps)
+
+
+def _geodesic_owner(n, sources, pi, pj, pd, allowed):
+    """Dijkstra multi-origen sobre los pares permitidos: iniciador más cercano por la malla (-1 si no se alcanza)."""
+    graph = [[] for _ in range(n)]
+    for u, v, w in zip(pi[allowed].tolist(), pj[allowed].tolist(), pd[allowed].tolist()):
+        graph[u].append((v, w))
+        graph[v].append((u, w))
+    dist = [math.inf] * n
+    owner = [-1] * n
+    heap = []
+    for k, s in enumerate(sources):
+        dist[s], owner[s] = 0.0, k
+        heap.append((0.0, s))
+    heapq.heapify(heap)
+    while heap:
+        du, u = heapq.heappop(heap)
+        if du > dist[u]:
+            continue
+        for v, w in graph[u]:
+            if du + w < dist[v]:
+                dist[v], owner[v] = du + w, owner[u]
+                heapq.heappush(heap, (du + w, v))
+    return np.array(owner, dtype=np.int64), np.array(dist)
+
+
+def _chain_outward(chain: np.ndarray, start: int, start_time: int, delay_ms: int, parents: dict, times: np.ndarray):
+    """Encadena una fila (en orden de cadena) hacia ambos lados desde la posición 'start'."""
+    for j in range(start + 1, len(chain)):
+        parents[chain[j]] = (chain[j - 1], delay_ms)
+    for j in range(start - 1, -1, -1):
+        parents[chain[j]] = (chain[j + 1], delay_ms)
+    times[chain] = start_time + np.abs(np.arange(len(chain)) - start) * delay_ms
+
+
+def infer_layout(ids, x, y, azimuth_deg: float = None) -> dict:
+    """
+    Deduce la geometría local de la malla: dirección de fila de cada taladro,
+    filas (cadenas de taladros en orden), espaciamiento y burden. No supone
+    una única dirección para todo el proyecto: un banco con varias sub-mallas o
+    filas que siguen el contorno se resuelve por vecindarios. Con azimuth_deg
+    (grados desde el eje x) se fuerza la misma dirección para todos.
+    """
+    ids, x, y = np.asarray(ids), np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    n = len(ids)
+
+    grid = DrillGrid(ids, ids, x, y)
+    sample = np.unique(np.linspace(0, n - 1, num=min(n, _LAYOUT_SAMPLE)).astype(int))
+    nn = []
+    for i in sample:
+        nearest = grid.nearest(x[i], y[i], 1, exclude_id=int(ids[i]))
+        if nearest:
+            nn.append(math.hypot(nearest[0]["x"] - x[i], nearest[0]["y"] - y[i]))
+    nn = np.array(nn)
+    nn = nn[nn > 0]
+    # El radio de búsqueda cubre las zonas más espaciadas (percentil alto), no la mediana
+    typical = float(np.percentile(nn, 90)) if len(nn) else 1.0
+    pi, pj, pd = _pairs_within(x, y, AUTOSEQ_MAX_LINK_FACTOR * typical)
+
+    local = np.full(n, np.inf)
+    positive = pd > 0
+    np.minimum.at(local, pi[positive], pd[positive])
+    np.minimum.at(local, pj[positive], pd[positive])
+    local = np.where(np.isfinite(local), local, typical)
+
+    if azimuth_deg is not None:
+        theta = np.full(n, math.radians(azimuth_deg) % math.pi)
+    else:
+        theta = _row_directions(ids, x, y, pi, pj, pd, local, typical)
+    rows, row_of, along, steps = _rows(x, y, theta, pi, pj, pd, local)
+    # Espaciamiento local: el de la fila, acotado por el típico salvo donde la malla es más abierta
+    local = np.minimum(along, np.maximum(local, typical))
+
+    # Burden: distancia de cada taladro al más cercano de otra fila vecina
+    other_row = (row_of[pi] != row_of[pj]) & (pd <= _ROW_ADJACENCY_FACTOR * np.maximum(local[pi], local[pj]))
+    to_other = np.full(n, np.inf)
+    np.minimum.at(to_other, pi[other_row], pd[other_row])
+    np.minimum.at(to_other, pj[other_row], pd[other_row])
+    finite = np.isfinite(to_other)
+
+    return {
+        "azimuth_deg": math.degrees(float(np.angle(np.exp(2j * theta).mean()) / 2) % math.pi) if n else 0.0,
+        "spacing": float(np.median(steps)) if len(steps) else float(np.median(local)) if n else 0.0,
+        "burden": float(np.median(to_other[finite])) if finite.any() else 0.0,
+        "rows": len(rows),
+        "theta": theta,
+        "local": local,
+        "row_list": rows,
+        "row": row_of,
+        "pairs": (pi, pj, pd),
+    }
+
+
+def build_sequence(ids, x, y, initiators: dict, pattern: str, inter_hole_ms: int, inter_row_ms: int,
+                   azimuth_deg: float = None):
+    """
+    Genera la secuencia completa de un patrón a partir de uno o más iniciadores
+    ({drill_id: retardo}). Cada iniciador se encarga de los taladros más
+    cercanos a él recorriendo la malla; desde su fila se avanza de fila en fila
+    vecina, siempre amarrando a la fila ya secuenciada más cercana.
+
+    - row: cada fila se amarra a la anterior en el punto más cercano al origen
+      del frente y se encadena hacia los lados con el retardo entre taladros.
+    - echelon: cada taladro se amarra en diagonal al de la fila anterior, hacia
+      el lado más largo de la fila; del otro lado, en la misma columna.
+    - v: cada taladro se amarra en diagonal hacia la columna del iniciador.
+
+    Ningún enlace supera AUTOSEQ_MAX_LINK_FACTOR veces el espaciamiento local:
+    los taladros que no se alcanzan así quedan sin secuenciar y se informan.
+
+    Devuelve (enlaces [(from_id, to_id, delay)], {drill_id: tiempo}, layout);
+    layout incluye 'warnings', 'unsequenced' y estadísticas de los enlaces.
+    """
+    if pattern not in PATTERNS:
+        raise ValueError(f"Patrón desconocido '{pattern}'. Opciones: {', '.join(PATTERNS)}")
+    ids = np.asarray(ids, dtype=np.int64)
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    position = {int(drill_id): i for i, drill_id in enumerate(ids)}
+    missing = [drill_id for drill_id in initiators if drill_id not in position]
+    if missing:
+        raise ValueError(f"Iniciadores que no pertenecen al proyecto: {missing}")
+
+    layout = infer_layout(ids, x, y, azimuth_deg)
+    n = len(ids)
+    local, rows = layout["local"], layout["row_list"]
+    pi, pj, pd = layout["pairs"]
+    reach = np.maximum(local[pi], local[pj])
+    init_pos = [position[drill_id] for drill_id in initiators]
+    init_delay = list(initiators.values())
+
+    owner, _ = _geodesic_owner(n, init_pos, pi, pj, pd, pd <= AUTOSEQ_MAX_LINK_FACTOR * reach)
+
+    # Tramos de fila: partes contiguas de una fila con el mismo iniciador
+    pieces, piece_of = [], np.full(n, -1, dtype=np.int64)
+    for chain in rows:
+        chain_owner = owner[chain]
+        cuts = np.nonzero(np.diff(chain_owner))[0] + 1
+        for part in np.split(chain, cuts):
+            if owner[part[0]] >= 0:
+                piece_of[part] = len(pieces)
+                pieces.append(part)
+
+    # Pares entre tramos vecinos del mismo iniciador, agrupados por (tramo, tramo)
+    near = (piece_of[pi] >= 0) & (piece_of[pj] >= 0) & (piece_of[pi] != piece_of[pj]) \
+        & (owner[pi] == owner[pj]) & (pd <= _ROW_ADJACENCY_FACTOR * reach)
+    between = {}
+    for u, v, w in zip(np.concatenate([pi[near], pj[near]]).tolist(), np.concatenate([pj[near], pi[near]]).tolist(),
+                       np.concatenate([pd[near], pd[near]]).tolist()):
+        between.setdefault((int(piece_of[u]), int(piece_of[v])), []).append((u, v, w))
+    adjacent = {}
+    for pa, pb in between:
+        adjacent.setdefault(pa, set()).add(pb)
+
+    parents = {}
+    times = np.zeros(n, dtype=np.int64)
+    timed = np.zeros(n, dtype=bool)
+
+    def attach_row(piece, pairs):
+        """Amarra un tramo a la fila ya secuenciada por el par más corto que quede más cerca del origen del frente."""
+        d_min = min(w for _, _, w in pairs)
+        to_pos, from_pos, _ = min((p for p in pairs if p[2] <= 1.25 * d_min), key=lambda p: (times[p[1]], p[2]))
+        start = int(np.nonzero(piece == to_pos)[0][0])
+        parents[to_pos] = (from_pos, inter_row_ms)
+        _chain_outward(piece, start, int(times[from_pos]) + inter_row_ms, inter_hole_ms, parents, times)
+        return start
+
+    def attach_diagonal(piece, pairs):
+        center = attach_row(piece, pairs) if pattern == "echelon" else None
+        by_hole = {}
+        for to_pos, from_pos, w in pairs:
+            by_hole.setdefault(to_pos, []).append((from_pos, w))
+        long_side = 1 if center is not None and len(piece) - 1 - center >= center else -1
+        assigned = np.zeros(len(piece), dtype=bool)
+        for k, to_pos in enumerate(piece.tolist()):
+            candidates = by_hole.get(to_pos)
+            if not candidates:
+                continue
+            diagonal = center is None or (k - center) * long_side > 0
+            key = (lambda c: (times[c[0]], c[1])) if diagonal else (lambda c: (c[1], times[c[0]]))
+            from_pos, _ = min(candidates, key=key)
+            parents[to_pos] = (from_pos, inter_row_ms)
+            times[to_pos] = times[from_pos] + inter_row_ms
+            assigned[k] = True
+        # Los taladros sin fila anterior al frente se encadenan por su propia fila
+        for k in range(1, len(piece)):
+            if not assigned[k] and assigned[k - 1]:
+                parents[piece[k]] = (piece[k - 1], inter_hole_ms)
+                times[piece[k]] = times[piece[k - 1]] + inter_hole_ms
+                assigned[k] = True
+        for k in range(len(piece) - 2, -1, -1):
+            if not assigned[k] and assigned[k + 1]:
+                parents[piece[k]] = (piece[k + 1], inter_hole_ms)
+                times[piece[k]] = times[piece[k + 1]] + inter_hole_ms
+                assigned[k] = True
+
+    for k, (start, start_time) in enumerate(zip(init_pos, init_delay)):
+        first = int(piece_of[start])
+        front = pieces[first]
+        _chain_outward(front, int(np.nonzero(front == start)[0][0]), start_time, inter_hole_ms, parents, times)
+        timed[front] = True
+        hops = {first: 0}
+        heap = [(1, 0, pb) for pb in adjacent.get(first, ())]
+        heapq.heapify(heap)
+        done = {first}
+        mine = {p for p in range(len(pieces)) if owner[pieces[p][0]] == k}
+
+        while True:
+            while heap:
+                hop, _, piece_id = heapq.heappop(heap)
+                if piece_id in done:
+                    continue
+                # La fila ya secuenciada más cercana al iniciador (en saltos) entre las vecinas
+                parent = min((pa for pa in adjacent.get(piece_id, ()) if pa in done),
+                             key=lambda pa: (hops[pa], min(w for _, _, w in between[(piece_id, pa)])))
+                piece = pieces[piece_id]
+                pairs = between[(piece_id, parent)]
+                if pattern == "row":
+                    attach_row(piece, pairs)
+                else:
+                    attach_diagonal(piece, pairs)
+                timed[piece] = True
+                hops[piece_id] = hops[parent] + 1
+                done.add(piece_id)
+                for pb in adjacent.get(piece_id, ()):
+                    if pb not in done:
+                        heapq.heappush(heap, (hops[piece_id] + 1, len(done), pb))
+
+            # Bloques del mismo iniciador sin fila vecina secuenciada: un puente por el par más corto
+            pending = mine - done
+            if not pending:
+                break
+            pending_mask = np.isin(piece_of, list(pending))
+            bridge = ((pending_mask[pi] & timed[pj]) | (pending_mask[pj] & timed[pi])) \
+                & (pd <= AUTOSEQ_MAX_LINK_FACTOR * reach)
+            if not bridge.any():
+                break
+            best = int(np.nonzero(bridge)[0][pd[bridge].argmin()])
+            to_pos, from_pos = (int(pi[best]), int(pj[best])) if pending_mask[pi[best]] else (int(pj[best]), int(pi[best]))
+            piece_id = int(piece_of[to_pos])
+            attach_row(pieces[piece_id], [(to_pos, from_pos, float(pd[best]))])
+            timed[pieces[piece_id]] = True
+            hops[piece_id] = 0
+            done.add(piece_id)
+            for pb in adjacent.get(piece_id, ()):
+                if pb not in done:
+                    heapq.heappush(heap, (1, len(done), pb))
+
+    links = [(int(ids[f]), int(ids[t]), int(d)) for t, (f, d) in parents.items()]
+    unsequenced = [int(drill_id) for drill_id in ids[~timed]]
+    lengths = np.array([math.hypot(x[t] - x[f], y[t] - y[f]) for t, (f, _) in parents.items()])
+    limit = np.array([AUTOSEQ_MAX_LINK_FACTOR * max(local[t], local[f]) for t, (f, _) in parents.items()])
+    warnings = []
+    if unsequenced:
+        warnings.append(f"{len(unsequenced)} taladros quedaron sin secuenciar: están a más de "
+                        f"{AUTOSEQ_MAX_LINK_FACTOR:g} espaciamientos de la malla de cualquier iniciador. "
+                        "Agrega un iniciador en esos bloques.")
+    if len(lengths) and (lengths > limit).any():
+        warnings.append(f"{int((lengths > limit).sum())} enlaces superan {AUTOSEQ_MAX_LINK_FACTOR:g} veces el espaciamiento local.")
+    fired = times[timed]
+    layout.update({
+        "warnings": warnings,
+        "unsequenced": unsequenced,
+        "max_link_m": float(lengths.max()) if len(lengths) else 0.0,
+        "max_simultaneous_holes": int(np.unique(fired, return_counts=True)[1].max()) if len(fired) else 0,
+    })
+    return links, {int(drill_id): int(t) for drill_id, t in zip(ids, times)}, layout
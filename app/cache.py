@@ -0,0 +1,133 @@
+# app/cache.py
+
+import os
+import threading
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:  # El backend compartido es opcional
+    redis = None
+
+# Límites de la caché local de análisis (por proceso)
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", 256))
+ANALYSIS_CACHE_MAX_BYTES = int(os.getenv("ANALYSIS_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# Backend compartido entre workers (opcional) y vida de sus entradas
+ANALYSIS_CACHE_REDIS_URL = os.getenv("ANALYSIS_CACHE_REDIS_URL")
+ANALYSIS_CACHE_TTL_SECONDS = int(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", 3600))
+
+
+def make_key(analysis: str, project_id: int, revision: int, params) -> str:
+    """Clave de un resultado: análisis, proyecto, revisión y parámetros ordenados."""
+    items = sorted((str(k), str(v)) for k, v in dict(params).items())
+    return f"{analysis}:{project_id}:{revision}:" + "&".join(f"{k}={v}" for k, v in items)
+
+
+class RedisBackend:
+    """Backend compartido: guarda los resultados serializados en Redis con TTL."""
+
+    def __init__(self, url: str, ttl_seconds: int = ANALYSIS_CACHE_TTL_SECONDS, prefix: str = "analysis:"):
+        if redis is None:
+            raise RuntimeError("ANALYSIS_CACHE_REDIS_URL requiere el paquete 'redis'.")
+        self.client = redis.Redis.from_url(url)
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+
+    def get(self, key: str):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key: str, value: bytes):
+        self.client.set(self.prefix + key, value, ex=self.ttl_seconds)
+
+
+class AnalysisCache:
+    """
+    Caché LRU en memoria de resultados de análisis ya serializados (bytes),
+    acotada por número de entradas y por bytes. Opcionalmente consulta un
+    backend compartido (con get/set) antes de recalcular. Como la clave lleva
+    la revisión del proyecto, una mutación nunca sirve resultados viejos;
+    invalidate_project solo libera la memoria de las revisiones anteriores.
+    """
+
+    def __init__(self, max_entries: int = ANALYSIS_CACHE_MAX_ENTRIES, max_bytes: int = ANALYSIS_CACHE_MAX_BYTES, shared=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self._entries = OrderedDict()
+        self._by_project = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str, project_id: int):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+        if self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                with self._lock:
+                    self.shared_hits += 1
+                self._store(key, project_id, value)
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key: str, project_id: int, value: bytes):
+        self._store(key, project_id, value)
+        if self.shared is not None:
+            self.shared.set(key, value)
+
+    def _store(self, key: str, project_id: int, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = value
+            self._by_project.setdefault(project_id, set()).add(key)
+            self._bytes += len(value)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key: str):
+        value = self._entries.pop(key)
+        self._bytes -= len(value)
+        project_id = int(key.split(":", 2)[1])
+        keys = self._by_project.get(project_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_project[project_id]
+
+    def invalidate_project(self, project_id: int):
+        with self._lock:
+            for key in list(self._by_project.get(project_id, ())):
+                self._drop(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_ratio": round((self.hits + self.shared_hits) / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "shared_backend": type(self.shared).__name__ if self.shared is not None else None,
+            }
+
+
+analysis_cache = AnalysisCache(shared=RedisBackend(ANALYSIS_CACHE_REDIS_URL) if ANALYSIS_CACHE_REDIS_URL else None)
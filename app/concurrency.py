@@ -0,0 +1,65 @@
+# app/concurrency.py
+
+import functools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import anyio.to_thread
+from anyio import CapacityLimiter
+
+# Hilos del pool por defecto, donde FastAPI ejecuta los endpoints y dependencias síncronos
+API_THREADPOOL_SIZE = int(os.getenv("API_THREADPOOL_SIZE", 40))
+# Trabajos pesados (cargas de CSV, análisis grandes) que pueden correr a la vez
+HEAVY_WORK_CONCURRENCY = int(os.getenv("HEAVY_WORK_CONCURRENCY", 2))
+# Hilos que atienden la cola de trabajos en segundo plano (app.jobs). Es bajo a propósito: los
+# workers compiten por CPU y conexiones con las peticiones interactivas
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+# Procesos para cálculos numéricos que no liberan el GIL lo suficiente (mapas de vibración)
+ANALYSIS_PROCESS_WORKERS = int(os.getenv("ANALYSIS_PROCESS_WORKERS", os.cpu_count() or 1))
+
+_heavy_limiter = None
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def configure_threadpools():
+    """Fija el tamaño del pool por defecto. Debe llamarse dentro del event loop (al arrancar)."""
+    anyio.to_thread.current_default_thread_limiter().total_tokens = API_THREADPOOL_SIZE
+
+
+async def run_heavy(func, *args, **kwargs):
+    """
+    Ejecuta trabajo síncrono pesado fuera del event loop, en un grupo de hilos
+    aparte y acotado por HEAVY_WORK_CONCURRENCY. Así una carga grande no
+    bloquea el loop ni ocupa todos los hilos (y conexiones) que usan las
+    peticiones ligeras; los trabajos que sobran esperan su turno.
+    """
+    global _heavy_limiter
+    if _heavy_limiter is None:
+        _heavy_limiter = CapacityLimiter(HEAVY_WORK_CONCURRENCY)
+    return await anyio.to_thread.run_sync(functools.partial(func, *args, **kwargs), limiter=_heavy_limiter)
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Pool de procesos compartido, creado la primera vez que se usa. Se usa
+    'spawn' para que los hijos no hereden los hilos ni las conexiones a la base
+    de datos del servidor; las funciones que se envían deben ser de módulos
+    que no toquen la base de datos.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=ANALYSIS_PROCESS_WORKERS,
+                                                mp_context=multiprocessing.get_context("spawn"))
+        return _process_pool
+
+
+def shutdown_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=True, cancel_futures=True)
+            _process_pool = None
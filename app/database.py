@@ -1,13 +1,73 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
 
+from .concurrency import API_THREADPOOL_SIZE, HEAVY_WORK_CONCURRENCY, JOB_WORKERS
+
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+
+# Tamaño del pool de conexiones. Cada hilo de la API, de trabajo pesado o de
+# la cola de trabajos usa a lo más una conexión; DB_POOL_RESERVE cubre las
+# exportaciones en streaming (abren su propia sesión) y las peticiones que
+# esperan turno en run_heavy con su sesión abierta. Por defecto
+# pool_size + max_overflow suma todo eso, pero nunca más que la parte de
+# DB_CONNECTION_BUDGET que le toca a este proceso; si no alcanza, las
+# peticiones esperan conexión hasta DB_POOL_TIMEOUT segundos.
+DB_POOL_RESERVE = int(os.getenv("DB_POOL_RESERVE", 10))
+# Conexiones que pueden abrir entre todos los procesos de la API (max_connections
+# de PostgreSQL es 100 por defecto: se dejan libres las de administración y otros
+# clientes) y procesos que se las reparten. WEB_CONCURRENCY es la misma variable
+# con la que uvicorn decide cuántos workers arrancar
+DB_CONNECTION_BUDGET = int(os.getenv("DB_CONNECTION_BUDGET", 80))
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", 1)))
+DB_PROCESS_CONNECTIONS = max(1, DB_CONNECTION_BUDGET // WEB_CONCURRENCY)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", min(10, DB_PROCESS_CONNECTIONS)))
+DB_MAX_OVERFLOW = int(os.getenv(
+    "DB_MAX_OVERFLOW",
+    max(0, min(API_THREADPOOL_SIZE + HEAVY_WORK_CONCURRENCY + JOB_WORKERS + DB_POOL_RESERVE, DB_PROCESS_CONNECTIONS) - DB_POOL_SIZE),
+))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+
+def engine_options(url: str) -> dict:
+    """SQLite usa su propio pool (un archivo local), el resto usa QueuePool con los límites configurados."""
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+def add_missing_columns(metadata, bind=engine):
+    """
+    create_all no modifica tablas que ya existen: añade con ALTER TABLE las
+    columnas nuevas de los modelos que todavía no estén en la base de datos,
+    y crea los índices que falten.
+    """
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for table in metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=bind.dialect)}"
+                if column.server_default is not None:
+                    ddl += f" DEFAULT {column.server_default.arg}"
+                conn.execute(text(ddl))
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+
 def get_db():
     db = SessionLocal()
     try:
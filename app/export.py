@@ -0,0 +1,73 @@
+# app/export.py
+
+import csv
+import io
+import json
+import os
+
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
+
+from . import models
+from .ingest import HEADERLESS_LAYOUT
+
+EXPORT_FORMATS = ("csv", "jsonl")
+# Filas que se traen del cursor del servidor (y que se escriben) por bloque
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 2000))
+
+# Las primeras columnas son las de la importación (label,x,y,z): con o sin encabezado, el archivo se vuelve a cargar con el mapeo por defecto
+CSV_COLUMNS = HEADERLESS_LAYOUT[:4] + ["tiempo", "is_initiator", "from_label", "delay_ms"]
+
+
+def _drill_rows_query(project_id: int):
+    drill, link = models.Drill, models.SequenceLink
+    parent = aliased(models.Drill)
+    return (
+        select(drill.id, drill.label, drill.x, drill.y, drill.z, drill.tiempo, drill.is_initiator,
+               link.from_drill_id, parent.label, link.delay_ms)
+        .outerjoin(link, link.to_drill_id == drill.id)
+        .outerjoin(parent, parent.id == link.from_drill_id)
+        .where(drill.project_id == project_id)
+        .order_by(drill.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+
+
+def _iter_batches(session_factory, project_id: int):
+    """
+    Recorre los taladros con un cursor del servidor (yield_per), por bloques.
+    Abre su propia sesión: la respuesta se sigue enviando después de que el
+    endpoint devolvió y cerró la sesión de la petición.
+    """
+    with session_factory() as db:
+        result = db.execute(_drill_rows_query(project_id))
+        for batch in result.partitions():
+            yield batch
+
+
+def iter_csv(session_factory, project_id: int, header: bool = False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if header:
+        writer.writerow(CSV_COLUMNS)
+        yield buffer.getvalue()
+    for batch in _iter_batches(session_factory, project_id):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(
+            (label, x, y, z, tiempo, int(bool(is_initiator)), from_label or "", "" if delay is None else delay)
+            for _, label, x, y, z, tiempo, is_initiator, _, from_label, delay in batch
+        )
+        yield buffer.getvalue()
+
+
+def iter_jsonl(session_factory, project_id: int):
+    for batch in _iter_batches(session_factory, project_id):
+        yield "".join(
+            json.dumps({
+                "id": drill_id, "label": label, "x": x, "y": y, "z": z, "tiempo": tiempo,
+                "is_initiator": bool(is_initiator),
+                "inbound": None if from_id is None else {"from_drill_id": from_id, "from_label": from_label, "delay_ms": delay},
+            }, ensure_ascii=False) + "\n"
+            for drill_id, label, x, y, z, tiempo, is_initiator, from_id, from_label, delay in batch
+        )
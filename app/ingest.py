@@ -0,0 +1,187 @@
+# app/ingest.py
+
+import csv
+import io
+import os
+import time
+
+import pandas as pd
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from . import models
+
+# Tamaño de bloque (filas) con el que se lee y se inserta el CSV
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", 5000))
+
+# Layout de los archivos sin encabezado (como los TD_*.csv): label,x,y,z,tipo
+HEADERLESS_LAYOUT = ["label", "x", "y", "z", "type"]
+
+DRILL_COLUMNS = ["label", "x", "y", "z", "tiempo", "is_initiator", "project_id", "revision"]
+
+
+def _is_number(value) -> bool:
+    try:
+        float(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def read_first_row(fileobj) -> list:
+    """Lee la primera fila del archivo y vuelve a dejar el puntero al inicio."""
+    fileobj.seek(0)
+    first_line = fileobj.readline()
+    fileobj.seek(0)
+    if isinstance(first_line, bytes):
+        first_line = first_line.decode("utf-8-sig", errors="replace")
+    rows = list(csv.reader([first_line]))
+    return [cell.strip() for cell in rows[0]] if rows else []
+
+
+def detect_header(first_row: list, column_mapping: dict) -> bool:
+    """
+    Decide si la primera fila es un encabezado. Si las columnas mapeadas para
+    'x' e 'y' son numéricas, el usuario mapeó valores de datos y el archivo no
+    tiene encabezado.
+    """
+    candidates = [column_mapping.get("x"), column_mapping.get("y")]
+    if not any(candidates):
+        candidates = first_row[1:3]
+    return not all(_is_number(value) for value in candidates if value)
+
+
+def resolve_usecols(first_row: list, column_mapping: dict, has_header: bool) -> dict:
+    """
+    Devuelve {campo: columna} para pandas. Con encabezado las columnas son
+    nombres; sin encabezado son posiciones, deducidas de los valores de la
+    primera fila que eligió el usuario o del layout por defecto. Con
+    encabezado y sin mapeo se usan las columnas llamadas label, x, y, z (así
+    se vuelve a cargar una exportación con encabezado).
+    """
+    filtered_mapping = {k: v for k, v in column_mapping.items() if v}
+
+    if has_header and not filtered_mapping:
+        named = {cell.lower(): cell for cell in reversed(first_row)}
+        return {field: named[field] for field in ("label", "x", "y", "z") if field in named}
+
+    if has_header:
+        return {field: column for field, column in filtered_mapping.items() if field in ("label", "x", "y", "z")}
+
+    if not filtered_mapping:
+        return {field: pos for pos, field in enumerate(HEADERLESS_LAYOUT[:4]) if pos < len(first_row)}
+
+    positions = {}
+    used = set()
+    for field in ("label", "x", "y", "z"):
+        value = filtered_mapping.get(field)
+        if value is None:
+            continue
+        value = str(value).strip()
+        for pos, cell in enumerate(first_row):
+            if cell == value and pos not in used:
+                positions[field] = pos
+                used.add(pos)
+                break
+        else:
+            if value.isdigit() and int(value) < len(first_row):
+                positions[field] = int(value)
+                used.add(int(value))
+    return positions
+
+
+def iter_drill_chunks(fileobj, column_mapping: dict, has_header=None, chunksize: int = INGEST_CHUNK_SIZE):
+    """
+    Lee el CSV por bloques y produce DataFrames con las columnas
+    label, x, y, z ya normalizadas. La memoria depende del tamaño del bloque,
+    no del tamaño del archivo.
+    """
+    first_row = read_first_row(fileobj)
+    if not first_row:
+        raise ValueError("El archivo está vacío.")
+    if has_header is None:
+        has_header = detect_header(first_row, column_mapping)
+
+    usecols = resolve_usecols(first_row, column_mapping, has_header)
+    for col in ("label", "x", "y"):
+        if col not in usecols:
+            raise ValueError(f"La columna mapeada para '{col}' no se encontró en el archivo.")
+
+    rename_dict = {column: field for field, column in usecols.items()}
+    reader = pd.read_csv(
+        fileobj,
+        header=0 if has_header else None,
+        usecols=list(usecols.values()),
+        dtype={usecols["label"]: str},
+        encoding="utf-8-sig",
+        chunksize=chunksize,
+    )
+    with reader:
+        for chunk in reader:
+            chunk = chunk.rename(columns=rename_dict)
+            if "z" not in chunk.columns:
+                chunk["z"] = 0.0
+            for col in ("x", "y", "z"):
+                chunk[col] = pd.to_numeric(chunk[col]).astype(float)
+            chunk["label"] = chunk["label"].astype(str).str.strip()
+            yield chunk[["label", "x", "y", "z"]]
+
+
+def _copy_chunk(db: Session, project_id: int, chunk: pd.DataFrame, revision: int):
+    """Inserta un bloque con COPY (solo PostgreSQL) sobre la conexión de la sesión."""
+    buffer = io.StringIO()
+    out = chunk.assign(tiempo=0, is_initiator=False, project_id=project_id, revision=revision)[DRILL_COLUMNS]
+    out.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY drills ({', '.join(DRILL_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+
+
+def _executemany_chunk(db: Session, project_id: int, chunk: pd.DataFrame, revision: int):
+    """Inserta un bloque con un único INSERT ejecutado en modo executemany."""
+    records = [
+        {"label": label, "x": x, "y": y, "z": z, "tiempo": 0, "is_initiator": False,
+         "project_id": project_id, "revision": revision}
+        for label, x, y, z in zip(chunk["label"], chunk["x"].tolist(), chunk["y"].tolist(), chunk["z"].tolist())
+    ]
+    db.execute(insert(models.Drill.__table__), records)
+
+
+def bulk_load_drills(db: Session, project_id: int, chunks, revision: int = 0, replace: bool = True) -> dict:
+    """
+    Reemplaza los taladros del proyecto con los bloques recibidos en una sola
+    transacción, marcándolos con la revisión indicada (con replace=False los
+    agrega a los existentes). Hace commit al final; ante cualquier error hace
+    rollback y relanza la excepción.
+    """
+    start = time.perf_counter()
+    use_copy = db.get_bind().dialect.name == "postgresql"
+    write_chunk = _copy_chunk if use_copy else _executemany_chunk
+    rows = 0
+    try:
+        if replace:
+            project_drill_ids = db.query(models.Drill.id).filter(models.Drill.project_id == project_id)
+            db.query(models.SequenceLink).filter(
+                models.SequenceLink.from_drill_id.in_(project_drill_ids.scalar_subquery())
+            ).delete(synchronize_session=False)
+            db.query(models.Drill).filter(models.Drill.project_id == project_id).delete(synchronize_session=False)
+
+        for chunk in chunks:
+            if chunk.empty:
+                continue
+            write_chunk(db, project_id, chunk, revision)
+            rows += len(chunk)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    seconds = time.perf_counter() - start
+    return {
+        "rows": rows,
+        "seconds": round(seconds, 4),
+        "rows_per_second": round(rows / seconds, 1) if seconds > 0 else float(rows),
+    }
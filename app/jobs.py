@@ -0,0 +1,291 @@
+# app/jobs.py
+
+import datetime
+import logging
+import os
+import socket
+import threading
+import time
+
+from . import models
+from .concurrency import JOB_WORKERS
+from .database import SessionLocal, engine
+
+# Cada cuánto mira la cola un worker desocupado (al encolar se le avisa antes)
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", 2.0))
+# Cada cuánto un trabajo guarda su progreso y mira si se pidió cancelarlo
+JOB_PROGRESS_INTERVAL = float(os.getenv("JOB_PROGRESS_INTERVAL", 1.0))
+# Al apagar, cuánto se espera a los trabajos en curso antes de interrumpirlos (vuelven a la cola)
+JOB_SHUTDOWN_SECONDS = float(os.getenv("JOB_SHUTDOWN_SECONDS", 30.0))
+# Un trabajo 'running' sin latido desde hace más que esto se da por huérfano y vuelve a la cola
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", 600.0))
+
+FINISHED_STATUSES = ("succeeded", "failed", "cancelled")
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}
+_running = {}
+_running_lock = threading.Lock()
+_threads = []
+_stopping = threading.Event()
+_wakeup = threading.Condition()
+
+
+class JobCancelled(Exception):
+    """Se pidió cancelar el trabajo, o el servidor se está apagando."""
+
+
+def register(kind: str, handler):
+    """
+    Registra el ejecutor de un tipo de trabajo: handler(db, job, ctx) devuelve
+    el resultado ya serializado en JSON. Corre en un hilo worker con su propia
+    sesión; si falla se hace rollback y el mensaje queda en el trabajo.
+    """
+    _handlers[kind] = handler
+
+
+def kinds() -> list:
+    return sorted(_handlers)
+
+
+def _worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _now():
+    return datetime.datetime.utcnow()
+
+
+class JobContext:
+    """Lo que ve el ejecutor de un trabajo: reportar progreso y enterarse de una cancelación."""
+
+    def __init__(self, job_id: int):
+        self.job_id = job_id
+        self.progress_value = 0.0
+        self.message = None
+        self.cancelled = threading.Event()
+        self.cancel_requested = False # Lo pidió el usuario
+        self.shutdown = False # Lo interrumpe el apagado del servidor
+        self._last_sync = time.monotonic()
+        # SQLite admite un solo escritor y el trabajo suele tener su transacción abierta:
+        # ahí el progreso y la cancelación solo viven en memoria (un único proceso)
+        self._shared = engine.dialect.name != "sqlite"
+
+    def progress(self, fraction: float, message: str = None):
+        """Avance entre 0 y 1. También es el punto donde se interrumpe un trabajo cancelado."""
+        self.progress_value = min(max(float(fraction), 0.0), 1.0)
+        if message is not None:
+            self.message = message
+        self.check()
+
+    def check(self):
+        now = time.monotonic()
+        if self._shared and now - self._last_sync >= JOB_PROGRESS_INTERVAL:
+            self._last_sync = now
+            self._sync()
+        if self.cancelled.is_set():
+            raise JobCancelled("Trabajo cancelado." if self.cancel_requested else "El servidor se está apagando.")
+
+    def interrupt(self, shutdown: bool = False):
+        if shutdown:
+            self.shutdown = True
+        else:
+            self.cancel_requested = True
+        self.cancelled.set()
+
+    def _sync(self):
+        """Guarda progreso y latido, y lee la marca de cancelación (puede venir de otro proceso)."""
+        with SessionLocal() as db:
+            db.query(models.Job).filter(models.Job.id == self.job_id)\
+                .update({models.Job.progress: self.progress_value, models.Job.message: self.message,
+                         models.Job.heartbeat_at: _now()}, synchronize_session=False)
+            db.commit()
+            if db.query(models.Job.cancel_requested).filter(models.Job.id == self.job_id).scalar():
+                self.interrupt()
+
+
+def live_context(job_id: int):
+    """Contexto del trabajo si corre en este proceso (progreso más reciente que el de la base de datos)."""
+    with _running_lock:
+        return _running.get(job_id)
+
+
+# --- Cola ---
+
+def submit(db, owner_id: int, project_id: int, kind: str, params: str = "{}", payload: bytes = None) -> models.Job:
+    """Encola un trabajo (hace commit) y despierta a un worker."""
+    if kind not in _handlers:
+        raise ValueError(f"Tipo de trabajo desconocido '{kind}'. Opciones: {', '.join(kinds())}")
+    job = models.Job(owner_id=owner_id, project_id=project_id, kind=kind, params=params, payload=payload,
+                     status="queued", progress=0.0)
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    logger.info("job_submitted", extra={"job_id": job.id, "kind": kind, "project_id": project_id})
+    with _wakeup:
+        _wakeup.notify()
+    return job
+
+
+def cancel(db, job: models.Job) -> models.Job:
+    """
+    Un trabajo en cola se cancela en el acto. Uno en curso se marca y se
+    detiene en su siguiente reporte de progreso, deshaciendo lo que llevaba.
+    """
+    if job.status in FINISHED_STATUSES:
+        return job
+    # Primero en memoria: si corre en este proceso se detiene sin esperar a la base de datos
+    ctx = live_context(job.id)
+    if ctx is not None:
+        ctx.interrupt()
+    now = _now()
+    cancelled_in_queue = db.query(models.Job).filter(models.Job.id == job.id, models.Job.status == "queued")\
+        .update({models.Job.status: "cancelled", models.Job.cancel_requested: True, models.Job.finished_at: now,
+                 models.Job.payload: None}, synchronize_session=False)
+    if not cancelled_in_queue:
+        db.query(models.Job).filter(models.Job.id == job.id).update({models.Job.cancel_requested: True}, synchronize_session=False)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def _claim(db):
+    """Toma el trabajo más antiguo en cola. El UPDATE condicional evita que dos workers (o procesos) tomen el mismo."""
+    candidates = db.query(models.Job.id).filter(models.Job.status == "queued", models.Job.kind.in_(list(_handlers)))\
+        .order_by(models.Job.id).limit(JOB_WORKERS + 1).all()
+    for (job_id,) in candidates:
+        now = _now()
+        claimed = db.query(models.Job).filter(models.Job.id == job_id, models.Job.status == "queued")\
+            .update({models.Job.status: "running", models.Job.worker: _worker_id(),
+                     models.Job.started_at: now, models.Job.heartbeat_at: now}, synchronize_session=False)
+        db.commit()
+        if claimed:
+            return job_id
+    return None
+
+
+def _run(job_id: int):
+    ctx = JobContext(job_id)
+    with _running_lock:
+        _running[job_id] = ctx
+    started = time.monotonic()
+    try:
+        with SessionLocal() as db:
+            job = db.get(models.Job, job_id)
+            kind = job.kind
+            requeue = False
+            try:
+                if job.cancel_requested:
+                    raise JobCancelled("Trabajo cancelado.")
+                result = _handlers[kind](db, job, ctx)
+                values = {models.Job.status: "succeeded", models.Job.result: result, models.Job.progress: 1.0, models.Job.message: None}
+            except JobCancelled:
+                db.rollback()
+                requeue = ctx.shutdown and not ctx.cancel_requested
+                values = {models.Job.status: "cancelled", models.Job.message: None}
+            except Exception as e:
+                db.rollback()
+                logger.warning("job_failed", extra={"job_id": job_id, "kind": kind, "error": str(e)})
+                values = {models.Job.status: "failed", models.Job.error: str(getattr(e, "detail", None) or e)}
+
+            if requeue:
+                values = {models.Job.status: "queued", models.Job.worker: None, models.Job.started_at: None,
+                          models.Job.progress: 0.0, models.Job.message: None}
+            else:
+                values.update({models.Job.finished_at: _now(), models.Job.payload: None})
+            db.query(models.Job).filter(models.Job.id == job_id).update(values, synchronize_session=False)
+            db.commit()
+            logger.info("job_finished", extra={"job_id": job_id, "kind": kind, "status": values[models.Job.status],
+                                               "seconds": round(time.monotonic() - started, 3)})
+    finally:
+        with _running_lock:
+            _running.pop(job_id, None)
+
+
+def _worker_loop():
+    while not _stopping.is_set():
+        try:
+            with SessionLocal() as db:
+                job_id = _claim(db)
+        except Exception:
+            logger.exception("job_claim_failed")
+            job_id = None
+        if job_id is None:
+            with _wakeup:
+                if not _stopping.is_set():
+                    _wakeup.wait(JOB_POLL_SECONDS)
+            continue
+        try:
+            _run(job_id)
+        except Exception:
+            logger.exception("job_runner_failed", extra={"job_id": job_id})
+
+
+# --- Ciclo de vida de los workers ---
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def requeue_orphans(db) -> int:
+    """
+    Devuelve a la cola los trabajos 'running' cuyo worker ya no existe: un
+    proceso muerto de esta máquina o un latido más viejo que JOB_STALE_SECONDS.
+    """
+    stale_before = _now() - datetime.timedelta(seconds=JOB_STALE_SECONDS)
+    host = socket.gethostname()
+    orphans = []
+    for job_id, worker, heartbeat in db.query(models.Job.id, models.Job.worker, models.Job.heartbeat_at)\
+            .filter(models.Job.status == "running"):
+        worker_host, _, pid = (worker or "").rpartition(":")
+        dead_here = worker_host == host and pid.isdigit() and not _pid_alive(int(pid))
+        if dead_here or heartbeat is None or heartbeat < stale_before:
+            orphans.append(job_id)
+    if orphans:
+        db.query(models.Job).filter(models.Job.id.in_(orphans), models.Job.status == "running")\
+            .update({models.Job.status: "queued", models.Job.worker: None, models.Job.started_at: None,
+                     models.Job.progress: 0.0, models.Job.message: None}, synchronize_session=False)
+        db.commit()
+        logger.info("jobs_requeued", extra={"count": len(orphans)})
+    return len(orphans)
+
+
+def start_workers():
+    """Arranca JOB_WORKERS hilos que atienden la cola (una vez por proceso)."""
+    if _threads or JOB_WORKERS <= 0:
+        return
+    _stopping.clear()
+    with SessionLocal() as db:
+        requeue_orphans(db)
+    for i in range(JOB_WORKERS):
+        thread = threading.Thread(target=_worker_loop, name=f"job-worker-{i}", daemon=True)
+        thread.start()
+        _threads.append(thread)
+
+
+def stop_workers(timeout: float = JOB_SHUTDOWN_SECONDS):
+    """
+    Apagado ordenado: no se toman trabajos nuevos y se espera a los que están
+    en curso. Los que no terminan a tiempo se interrumpen en su siguiente
+    reporte de progreso y vuelven a la cola para el próximo arranque.
+    """
+    _stopping.set()
+    with _wakeup:
+        _wakeup.notify_all()
+    deadline = time.monotonic() + timeout
+    for thread in _threads:
+        thread.join(max(0.0, deadline - time.monotonic()))
+    if any(thread.is_alive() for thread in _threads):
+        with _running_lock:
+            for ctx in _running.values():
+                ctx.interrupt(shutdown=True)
+        for thread in _threads:
+            thread.join(max(1.0, JOB_PROGRESS_INTERVAL * 2))
+    _threads.clear()
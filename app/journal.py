@@ -0,0 +1,211 @@
+# app/journal.py
+
+import json
+import os
+
+from sqlalchemy import bindparam, insert, update
+from sqlalchemy.orm import Session, aliased
+
+from . import models
+
+# Cada cuántas operaciones de una rama se guarda una foto completa de la secuencia
+JOURNAL_SNAPSHOT_INTERVAL = int(os.getenv("JOURNAL_SNAPSHOT_INTERVAL", 50))
+
+# El estado de la secuencia es lo que el usuario edita; los tiempos de los demás
+# taladros se derivan de él. Se guarda por taladro en dos aspectos:
+#   initiators: {drill_id: tiempo del iniciador, o None si no es iniciador}
+#   links:      {to_drill_id: [from_drill_id, delay_ms], o None si no recibe flecha}
+ASPECTS = ("initiators", "links")
+
+
+class JournalEmpty(LookupError):
+    """No hay operación que deshacer o rehacer."""
+
+
+def capture(db: Session, project_id: int, drill_ids=None) -> dict:
+    """
+    Estado de la secuencia. Con drill_ids, solo de esos taladros (con None
+    donde no hay iniciador o flecha); sin ellos, el del proyecto completo y
+    solo con los valores presentes.
+    """
+    drill, link = models.Drill, models.SequenceLink
+    initiator_query = db.query(drill.id, drill.tiempo).filter(drill.project_id == project_id, drill.is_initiator == True)
+    source = aliased(models.Drill)
+    link_query = db.query(link.to_drill_id, link.from_drill_id, link.delay_ms)\
+        .join(source, link.from_drill_id == source.id).filter(source.project_id == project_id)
+    if drill_ids is None:
+        return {
+            "initiators": {drill_id: tiempo for drill_id, tiempo in initiator_query},
+            "links": {to_id: [from_id, delay] for to_id, from_id, delay in link_query},
+        }
+    drill_ids = list(set(drill_ids))
+    state = {"initiators": dict.fromkeys(drill_ids), "links": dict.fromkeys(drill_ids)}
+    if drill_ids:
+        state["initiators"].update(dict(initiator_query.filter(drill.id.in_(drill_ids)).all()))
+        state["links"].update({to_id: [from_id, delay] for to_id, from_id, delay in link_query.filter(link.to_drill_id.in_(drill_ids))})
+    return state
+
+
+def diff(before: dict, after: dict) -> dict:
+    """Cambios {aspecto: {drill_id: [antes, después]}} entre dos estados; solo lo que difiere."""
+    changes = {}
+    for aspect in ASPECTS:
+        keys = set(before[aspect]) | set(after[aspect])
+        changed = {k: [before[aspect].get(k), after[aspect].get(k)] for k in keys
+                   if before[aspect].get(k) != after[aspect].get(k)}
+        if changed:
+            changes[aspect] = changed
+    return changes
+
+
+def _load(text: str) -> dict:
+    """JSON guardado -> estado/cambios con claves enteras (JSON solo tiene claves de texto)."""
+    data = json.loads(text) if text else {}
+    return {aspect: {int(k): v for k, v in data.get(aspect, {}).items()} for aspect in ASPECTS}
+
+
+def _dump(data: dict) -> str:
+    return json.dumps(data, separators=(",", ":"))
+
+
+def _side(changes: dict, index: int) -> dict:
+    """Estado 'antes' (0) o 'después' (1) de los taladros que toca una entrada."""
+    return {aspect: {k: pair[index] for k, pair in changes.get(aspect, {}).items()} for aspect in ASPECTS}
+
+
+def affected_drills(state: dict) -> set:
+    return set(state["initiators"]) | set(state["links"])
+
+
+def record(db: Session, project_id: int, op: str, before: dict, after: dict):
+    """
+    Agrega una entrada al diario como hija de la operación actual y la deja
+    como actual. Las entradas no se modifican nunca: al editar después de
+    deshacer se abre una rama nueva. Cada JOURNAL_SNAPSHOT_INTERVAL niveles
+    se guarda además el estado completo, para que ir a cualquier punto del
+    historial reproduzca como mucho ese número de entradas.
+    No hace commit. Devuelve la entrada o None si no hubo cambios.
+    """
+    changes = diff(before, after)
+    if not changes:
+        return None
+    project = db.query(models.Project).filter(models.Project.id == project_id).one()
+    parent = db.get(models.SequenceJournal, project.journal_head) if project.journal_head else None
+    depth = parent.depth + 1 if parent else 1
+    entry = models.SequenceJournal(
+        project_id=project_id,
+        parent_id=parent.id if parent else None,
+        depth=depth,
+        op=op,
+        changes=_dump(changes),
+    )
+    if depth % JOURNAL_SNAPSHOT_INTERVAL == 1 or JOURNAL_SNAPSHOT_INTERVAL == 1:
+        db.flush()
+        entry.snapshot = _dump(capture(db, project_id))
+    db.add(entry)
+    db.flush()
+    project.journal_head = entry.id
+    return entry
+
+
+def reset(db: Session, project_id: int):
+    """Borra el diario (los taladros se reemplazaron y sus ids ya no existen). No hace commit."""
+    db.query(models.Project).filter(models.Project.id == project_id).update({models.Project.journal_head: None}, synchronize_session=False)
+    db.query(models.SequenceJournal).filter(models.SequenceJournal.project_id == project_id).delete(synchronize_session=False)
+
+
+def apply_state(db: Session, project_id: int, state: dict, full: bool = False):
+    """
+    Escribe un estado de la secuencia con operaciones masivas. Con full, el
+    estado es el del proyecto completo: los taladros que no aparecen dejan de
+    ser iniciadores y pierden su flecha. No recalcula tiempos ni hace commit.
+    """
+    drills_table, links_table = models.Drill.__table__, models.SequenceLink.__table__
+    if full:
+        project_drill_ids = db.query(models.Drill.id).filter(models.Drill.project_id == project_id).scalar_subquery()
+        db.query(models.SequenceLink).filter(models.SequenceLink.from_drill_id.in_(project_drill_ids)).delete(synchronize_session=False)
+        db.query(models.Drill).filter(models.Drill.project_id == project_id, models.Drill.is_initiator == True)\
+            .update({models.Drill.is_initiator: False}, synchronize_session=False)
+    else:
+        cleared = [{"b_id": drill_id} for drill_id, tiempo in state["initiators"].items() if tiempo is None]
+        if cleared:
+            db.execute(update(drills_table).where(drills_table.c.id == bindparam("b_id")).values(is_initiator=False), cleared)
+        if state["links"]:
+            db.query(models.SequenceLink).filter(models.SequenceLink.to_drill_id.in_(list(state["links"])))\
+                .delete(synchronize_session=False)
+
+    initiators = [{"b_id": drill_id, "b_tiempo": tiempo} for drill_id, tiempo in state["initiators"].items() if tiempo is not None]
+    if initiators:
+        db.execute(
+            update(drills_table).where(drills_table.c.id == bindparam("b_id")).values(is_initiator=True, tiempo=bindparam("b_tiempo")),
+            initiators,
+        )
+    links = [{"from_drill_id": value[0], "to_drill_id": to_id, "delay_ms": value[1]}
+             for to_id, value in state["links"].items() if value is not None]
+    if links:
+        db.execute(insert(links_table), links)
+
+
+def _step(db: Session, project_id: int, redo: bool):
+    project = db.query(models.Project).filter(models.Project.id == project_id).one()
+    journal = models.SequenceJournal
+    if redo:
+        # Se rehace la rama más reciente que sale de la operación actual
+        entry = db.query(journal).filter(journal.project_id == project_id, journal.parent_id == project.journal_head)\
+            .order_by(journal.id.desc()).first()
+    else:
+        entry = db.get(journal, project.journal_head) if project.journal_head else None
+    if entry is None:
+        raise JournalEmpty("No hay operaciones que rehacer." if redo else "No hay operaciones que deshacer.")
+
+    state = _side(_load(entry.changes), 1 if redo else 0)
+    apply_state(db, project_id, state)
+    project.journal_head = entry.id if redo else entry.parent_id
+    return entry, affected_drills(state)
+
+
+def undo(db: Session, project_id: int):
+    """Aplica la inversa de la operación actual (una sola). No recalcula ni hace commit. Devuelve (entrada, taladros)."""
+    return _step(db, project_id, redo=False)
+
+
+def redo(db: Session, project_id: int):
+    """Vuelve a aplicar la operación deshecha más reciente. No recalcula ni hace commit. Devuelve (entrada, taladros)."""
+    return _step(db, project_id, redo=True)
+
+
+def checkout(db: Session, project_id: int, entry_id: int) -> set:
+    """
+    Lleva la secuencia al estado posterior a una entrada cualquiera del
+    historial: parte de la foto más cercana entre sus ancestros y reproduce las
+    entradas siguientes hasta ella. No recalcula ni hace commit. Devuelve los
+    taladros cuyo estado cambió.
+    """
+    journal = models.SequenceJournal
+    target = db.query(journal).filter(journal.id == entry_id, journal.project_id == project_id).first()
+    if target is None:
+        raise JournalEmpty("La operación no existe en el historial de este proyecto.")
+    path = [target]
+    while path[-1].snapshot is None:
+        path.append(db.get(journal, path[-1].parent_id))
+
+    state = _load(path[-1].snapshot)
+    for entry in reversed(path[:-1]):
+        for aspect, values in _side(_load(entry.changes), 1).items():
+            for drill_id, value in values.items():
+                if value is None:
+                    state[aspect].pop(drill_id, None)
+                else:
+                    state[aspect][drill_id] = value
+
+    changes = diff(capture(db, project_id), state)
+    changed = {drill_id for aspect in ASPECTS for drill_id in changes.get(aspect, {})}
+    apply_state(db, project_id, state, full=True)
+    db.query(models.Project).filter(models.Project.id == project_id).update({models.Project.journal_head: target.id}, synchronize_session=False)
+    return changed
+
+
+def history(db: Session, project_id: int, limit: int = 100) -> list:
+    journal = models.SequenceJournal
+    return db.query(journal.id, journal.parent_id, journal.depth, journal.op, journal.created_at, journal.snapshot.isnot(None))\
+        .filter(journal.project_id == project_id).order_by(journal.id.desc()).limit(limit).all()
@@ -1,25 +1,51 @@
 # app/main.py
 
-from fastapi import FastAPI, Depends, HTTPException, File, UploadFile, Form
+from fastapi import FastAPI, Depends, HTTPException, File, UploadFile, Form, Response, Query, Request, Body
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session, joinedload
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import exists, func, insert, update, bindparam
+from sqlalchemy.orm import Session, joinedload, selectinload
 from jose import jwt, JWTError
+from pydantic import ValidationError
 import pandas as pd
 import io
 import re
 import numpy as np
-import math
 import json
+import logging
+from typing import List, Optional
 
-from . import models, schemas, auth
-from .database import engine, get_db
+from . import models, schemas, auth, ingest, timing, sequence_graph, spatial, autoseq, payloads, revisions, relief, concurrency, metrics, vibration, journal, patterns, export, jobs
+from .cache import analysis_cache, make_key as analysis_cache_key
+from .database import engine, get_db, SessionLocal, add_missing_columns
+from .logging_config import configure_logging
+
+configure_logging()
+logger = logging.getLogger(__name__)
+metrics.instrument_engine(engine)
 
 # Esta línea crea las tablas en la base de datos si no existen
 models.Base.metadata.create_all(bind=engine)
+# ...y estas añaden las columnas nuevas a tablas que ya existían
+add_missing_columns(models.Base.metadata)
+with SessionLocal() as startup_db:
+    sequence_graph.backfill_link_delays(startup_db)
 
 app = FastAPI(title="Cloud Blasting API")
 
+@app.on_event("startup")
+async def configure_threadpools():
+    concurrency.configure_threadpools()
+    jobs.start_workers()
+
+@app.on_event("shutdown")
+def shutdown_workers():
+    # Primero los trabajos en segundo plano, que pueden estar usando el pool de procesos
+    jobs.stop_workers()
+    concurrency.shutdown_process_pool()
+
 # Configuración de CORS para permitir la comunicación con el frontend
 origins = ["http://localhost:3000", "http://localhost", "http://127.0.0.1", "null"]
 app.add_middleware(
@@ -28,13 +54,26 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Sin esto el navegador oculta las cabeceras propias de las respuestas al frontend
+    expose_headers=["X-Next-Cursor", "X-Project-Revision", "ETag", "X-Ingest-Rows", "X-Ingest-Rows-Per-Second", "Content-Disposition"],
 )
+# Latencia, peticiones en curso y sentencias SQL por ruta, expuestas en /metrics
+app.add_middleware(metrics.MetricsMiddleware)
 
 # --- Dependencia de Autenticación ---
 # Línea Corregida
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/login")
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> auth.CachedUser:
+    """
+    Resuelve el usuario del token. Los tokens llevan id y versión: el usuario
+    sale de la caché sin consultar la base de datos, y un token cuya versión
+    ya no coincide (tokens revocados) se rechaza. Los tokens antiguos, que solo
+    traen el email, se resuelven con una consulta y cuentan como versión 0:
+    dejan de valer en cuanto el usuario revoca sus tokens.
+    Devuelve un auth.CachedUser (id, email, token_version), no un objeto del
+    ORM: para relaciones u otras columnas hay que consultar por su id.
+    """
     credentials_exception = HTTPException(
         status_code=401,
         detail="No se pudieron validar las credenciales",
@@ -43,37 +82,127 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     try:
         payload = jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
         email: str = payload.get("sub")
+        user_id: Optional[int] = payload.get("uid")
         if email is None:
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    
-    user = db.query(models.User).filter(models.User.email == email).first()
-    if user is None:
+
+    if user_id is None:
+        db_user = db.query(models.User).filter(models.User.email == email).first()
+        if db_user is None:
+            raise credentials_exception
+        user = auth.user_cache.set(db_user)
+    else:
+        user = auth.user_cache.get(user_id)
+        if user is None:
+            db_user = db.query(models.User).filter(models.User.id == user_id).first()
+            if db_user is None:
+                raise credentials_exception
+            user = auth.user_cache.set(db_user)
+    if user.token_version != payload.get("ver", 0):
         raise credentials_exception
     return user
 
 
 # --- ¡NUEVA FUNCIÓN DE AYUDA! ---
-def clean_orphan_drills(project_id: int, db: Session):
+def clean_orphan_drills(project_id: int, db: Session, revision: int):
     """
-    Encuentra y resetea el tiempo de todos los taladros 'huérfanos'
-    (que no son iniciadores y no reciben ninguna conexión).
+    Resetea el tiempo de todos los taladros 'huérfanos' (que no son iniciadores
+    y no reciben ninguna conexión) con un único UPDATE en SQL. No hace commit:
+    se aplica dentro de la transacción del endpoint que la llama.
     """
-    print("--- [DEBUG] Ejecutando limpieza de huérfanos ---")
-    all_drills_in_project = db.query(models.Drill).filter(models.Drill.project_id == project_id).all()
-    
-    # Obtenemos los IDs de todos los taladros que SÍ reciben una conexión
-    links_in_project = db.query(models.SequenceLink).join(models.Drill, models.SequenceLink.from_drill_id == models.Drill.id).filter(models.Drill.project_id == project_id)
-    connected_drill_ids = {link.to_drill_id for link in links_in_project}
-
-    for drill in all_drills_in_project:
-        if not drill.is_initiator and drill.id not in connected_drill_ids:
-            if drill.tiempo != 0: # Solo modificamos si es necesario
-                print(f"--- [DEBUG] Reseteando taladro huérfano: {drill.label} (ID: {drill.id}) ---")
-                drill.tiempo = 0
-    
-    db.commit()
+    has_inbound_link = exists().where(models.SequenceLink.to_drill_id == models.Drill.id)
+    db.query(models.Drill).filter(
+        models.Drill.project_id == project_id,
+        models.Drill.is_initiator.is_not(True),
+        models.Drill.tiempo != 0,
+        ~has_inbound_link,
+    ).update({models.Drill.tiempo: 0, models.Drill.revision: revision}, synchronize_session=False)
+
+
+# --- Revisiones y Peticiones Condicionales ---
+
+def project_etag(project_id: int, request: Request, response: Response, db: Session = Depends(get_db), current_user: auth.CachedUser = Depends(get_current_user)):
+    """
+    ETag del recurso pedido según la revisión del proyecto y los parámetros de
+    la consulta. Si coincide con If-None-Match se responde 304 sin hacer el
+    trabajo del endpoint; si el proyecto no es del usuario, 404.
+    """
+    revision = db.query(models.Project.revision).filter(models.Project.id == project_id, models.Project.owner_id == current_user.id).scalar()
+    if revision is None:
+        raise HTTPException(status_code=404, detail="Proyecto no encontrado")
+    request.state.project_revision = revision
+    etag = revisions.revision_etag(project_id, revision, f"{request.url.path}?{request.url.query}|{request.headers.get('accept', '')}")
+    if revisions.etag_matches(request.headers.get("if-none-match"), etag):
+        raise HTTPException(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return etag
+
+def cached_analysis(name: str, project_id: int, request: Request, response: Response, response_model, compute):
+    """
+    Devuelve el resultado de un análisis desde la caché (clave: proyecto,
+    revisión y parámetros) o lo calcula, lo valida y lo guarda ya serializado.
+    Requiere que el endpoint dependa de project_etag, que fija la revisión
+    (y responde 404 antes de llegar aquí si el proyecto no es del usuario).
+    """
+    revision = getattr(request.state, "project_revision", None)
+    if revision is None:
+        raise HTTPException(status_code=404, detail="Proyecto no encontrado")
+    key = analysis_cache_key(name, project_id, revision, request.query_params)
+    body = analysis_cache.get(key, project_id)
+    if body is None:
+        body = response_model.model_validate(compute()).model_dump_json().encode()
+        analysis_cache.set(key, project_id, body)
+    return _with_headers(Response(body, media_type="application/json"), response, {"ETag": response.headers.get("etag")})
+
+def _with_headers(result, response: Response, headers: dict):
+    """Añade cabeceras tanto si el endpoint devuelve datos como si devuelve una Response propia."""
+    target = result if isinstance(result, Response) else response
+    target.headers.update({k: v for k, v in headers.items() if v is not None})
+    return result
+
+
+# --- Representación del Proyecto en las Respuestas ---
+
+def project_view(
+    request: Request,
+    format: Optional[str] = Query(None, description="'columnar' para recibir arrays paralelos"),
+    min_x: Optional[float] = None,
+    min_y: Optional[float] = None,
+    max_x: Optional[float] = None,
+    max_y: Optional[float] = None,
+    since_revision: Optional[int] = Query(None, ge=0, description="Devuelve solo lo que cambió después de esta revisión"),
+):
+    """
+    Cómo quiere el cliente el proyecto: anidado (por defecto), columnar
+    (opcionalmente recortado a un bbox) o como delta desde una revisión.
+    El bbox va completo (min_x, min_y, max_x, max_y) o no va.
+    """
+    bbox = (min_x, min_y, max_x, max_y)
+    if None in bbox and any(bound is not None for bound in bbox):
+        raise HTTPException(status_code=400, detail="El bbox necesita los cuatro límites: min_x, min_y, max_x y max_y.")
+    return {
+        "columnar": payloads.wants_columnar(format, request.headers.get("accept")),
+        "bbox": bbox if None not in bbox else None,
+        "since_revision": since_revision,
+    }
+
+def project_response(project: models.Project, view: dict, db: Session):
+    headers = {"X-Project-Revision": str(project.revision)}
+    if view["since_revision"] is not None:
+        return JSONResponse(payloads.delta_project(db, project, view["since_revision"]), headers=headers)
+    if view["columnar"]:
+        return JSONResponse(payloads.columnar_project(db, project, view["bbox"]), media_type=payloads.COLUMNAR_MEDIA_TYPE, headers=headers)
+    # selectinload evita el producto cartesiano de joinedload sobre taladros y enlaces
+    return db.query(models.Project).options(selectinload(models.Project.drills).selectinload(models.Drill.sequences_from))\
+        .filter(models.Project.id == project.id).first()
+
+def _sequenced_project_response(project_id: int, view: dict, db: Session, response: Response):
+    project = db.query(models.Project).filter(models.Project.id == project_id).first()
+    if not project:
+        raise HTTPException(status_code=404, detail="Proyecto no encontrado")
+    return _with_headers(project_response(project, view, db), response, {"X-Project-Revision": str(project.revision)})
 
 
 # ===================================================================
@@ -87,25 +216,44 @@ def read_root():
 # --- Endpoints de Usuarios ---
 
 @app.post("/api/users/", response_model=schemas.UserInDB)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(models.User.email == user.email).first()
-    if db_user:
+async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+    def find_user():
+        return db.query(models.User).filter(models.User.email == user.email).first()
+
+    def save_user(hashed_password: str):
+        new_user = models.User(email=user.email, hashed_password=hashed_password)
+        db.add(new_user)
+        db.commit()
+        db.refresh(new_user)
+        return new_user
+
+    if await run_in_threadpool(find_user):
         raise HTTPException(status_code=400, detail="El correo electrónico ya está registrado")
-    hashed_password = auth.get_password_hash(user.password)
-    new_user = models.User(email=user.email, hashed_password=hashed_password)
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-    return new_user
+    hashed_password = await auth.get_password_hash_async(user.password)
+    return await run_in_threadpool(save_user, hashed_password)
 
 @app.post("/api/login", response_model=schemas.Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.email == form_data.username).first()
-    if not user or not auth.verify_password(form_data.password, user.hashed_password):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    # bcrypt corre en su propio executor acotado; la consulta, en el pool de la API
+    user = await run_in_threadpool(lambda: db.query(models.User).filter(models.User.email == form_data.username).first())
+    if not user or not await auth.verify_password_async(form_data.password, user.hashed_password):
         raise HTTPException(status_code=401, detail="Email o contraseña incorrectos", headers={"WWW-Authenticate": "Bearer"})
-    access_token = auth.create_access_token(data={"sub": user.email})
+    access_token = auth.create_access_token(data=auth.user_token_claims(user))
     return {"access_token": access_token, "token_type": "bearer"}
 
+@app.post("/api/users/me/revoke-tokens", status_code=204)
+def revoke_user_tokens(db: Session = Depends(get_db), current_user: auth.CachedUser = Depends(get_current_user)):
+    """
+    Invalida todos los tokens emitidos hasta ahora para el usuario (cerrar
+    sesión en todos lados). En este proceso es inmediato; en los demás workers,
+    tras a lo más auth.AUTH_USER_CACHE_TTL_SECONDS.
+    """
+    db.query(models.User).filter(models.User.id == current_user.id)\
+        .update({models.User.token_version: models.User.token_version + 1}, synchronize_session=False)
+    db.commit()
+    auth.user_cache.invalidate(current_user.id)
+    return Response(status_code=204)
+
 @app.get("/api/users/", response_model=list[schemas.User])
 def read_users(db: Session = Depends(get_db)):
     return db.query(models.User).all()
@@ -113,219 +261,605 @@ def read_users(db: Session = Depends(get_db)):
 # --- Endpoints de Proyectos ---
 
 @app.post("/api/projects/", response_model=schemas.Project)
-def create_project(project: schemas.ProjectCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def create_project(project: schemas.ProjectCreate, db: Session = Depends(get_db), current_user: auth.CachedUser = Depends(get_current_user)):
     new_project = models.Project(name=project.name, owner_id=current_user.id)
     db.add(new_project)
     db.commit()
     db.refresh(new_project)
     return new_project
 
-@app.get("/api/projects/", response_model=list[schemas.Project])
-def read_projects(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    return db.query(models.Project).filter(models.Project.owner_id == current_user.id).all()
+@app.get("/api/projects/", response_model=list[schemas.ProjectSummary])
+def read_projects(
+    response: Response,
+    sort: str = Query("id", description="id, name, created_at, hole_count, link_count o initiator_count; '-' delante para descendente"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Tamaño de página; sin él se devuelven todos"),
+    cursor: Optional[str] = Query(None, description="Valor de X-Next-Cursor de la página anterior"),
+    db: Session = Depends(get_db),
+    current_user: auth.CachedUser = Depends(get_current_user)
+):
+    """
+    Proyectos del usuario con sus agregados calculados en SQL (una consulta,
+    sin cargar taladros). Si hay más páginas, el cursor de la siguiente va en
+    la cabecera X-Next-Cursor.
+    """
+    try:
+        rows, next_cursor = payloads.project_summaries(db, current_user.id, sort, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return rows
 
 @app.get("/api/projects/{project_id}", response_model=schemas.Project)
-def read_project(project_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    project = db.query(models.Project).options(joinedload(models.Project.drills).joinedload(models.Drill.sequences_from)).filter(
+def read_project(project_id: int, response: Response, view: dict = Depends(project_view), etag: Optional[str] = Depends(project_etag), db: Session = Depends(get_db), current_user: auth.CachedUser = Depends(get_current_user)):
+    project = db.query(models.Project).filter(
         models.Project.id == project_id, 
         models.Project.owner_id == current_user.id
     ).first()
     if not project:
         raise HTTPException(status_code=404, detail="Proyecto no encontrado")
-    return project
+    return _with_headers(project_response(project, view, db), response, {"ETag": etag, "X-Project-Revision": str(project.revision)})
+
+def _load_drills(project_id: int, chunks, db: Session, replace: bool = True) -> dict:
+    """Carga bloques de taladros con inserciones masivas bajo una nueva revisión del proyecto."""
+    revision = revisions.bump_revision(db, project_id)
+    changed = {models.Project.positions_revision: revision}
+    if replace:
+        changed[models.Project.drills_replaced_revision] = revision
+    db.query(models.Project).filter(models.Project.id == project_id).update(changed, synchronize_session=False)
+    if replace:
+        # Los ids de taladros cambian: el historial de secuencia anterior ya no aplica
+        journal.reset(db, project_id)
+    report = ingest.bulk_load_drills(db, project_id, chunks, revision=revision, replace=replace)
+    return {**report, "revision": revision}
+
+def _each_chunk(chunks, callback):
+    for chunk in chunks:
+        callback()
+        yield chunk
+
+def _ingest_upload(project_id: int, fileobj, mapping: str, has_header: Optional[bool], db: Session, on_chunk=None):
+    """
+    Valida el mapeo y carga el CSV por bloques con inserciones masivas.
+    on_chunk se llama antes de cargar cada bloque (progreso de los trabajos).
+    """
+    try:
+        column_mapping = json.loads(mapping) if mapping else {}
+        chunks = ingest.iter_drill_chunks(fileobj, column_mapping, has_header=has_header)
+        if on_chunk is not None:
+            chunks = _each_chunk(chunks, on_chunk)
+        report = _load_drills(project_id, chunks, db)
+        logger.info("csv_ingested", extra={"project_id": project_id, **report})
+        return report
+    except jobs.JobCancelled:
+        raise
+    except Exception as e:
+        logger.warning("csv_ingest_failed", extra={"project_id": project_id, "error": str(e)})
+        raise HTTPException(status_code=400, detail=f"Error procesando el archivo o el mapeo: {e}")
+    finally:
+        spatial.invalidate(project_id)
+        analysis_cache.invalidate_project(project_id)
 
 @app.post("/api/projects/{project_id}/upload-csv/", response_model=schemas.Project)
 async def upload_csv_for_project(
     project_id: int, 
+    response: Response,
     file: UploadFile = File(...), 
-    mapping: str = Form(...),
+    mapping: str = Form("{}"),
+    has_header: Optional[bool] = Form(None),
+    view: dict = Depends(project_view),
     db: Session = Depends(get_db), 
-    current_user: models.User = Depends(get_current_user)
+    current_user: auth.CachedUser = Depends(get_current_user)
 ):
-    project = db.query(models.Project).filter(models.Project.id == project_id, models.Project.owner_id == current_user.id).first()
+    # El parseo, la carga y la serialización son síncronos: se ejecutan en el pool de trabajo pesado
+    def run():
+        project = db.query(models.Project).filter(models.Project.id == project_id, models.Project.owner_id == current_user.id).first()
+        if not project:
+            raise HTTPException(status_code=404, detail="Proyecto no encontrado")
+
+        report = _ingest_upload(project_id, file.file, mapping, has_header, db)
+
+        db.refresh(project)
+        result = project_response(project, view, db)
+        if not isinstance(result, Response):
+            result = Response(schemas.Project.model_validate(result).model_dump_json(), media_type="application/json")
+        return _with_headers(result, response, {
+            "X-Ingest-Rows": str(report["rows"]),
+            "X-Ingest-Rows-Per-Second": str(report["rows_per_second"]),
+            "X-Project-Revision": str(project.revision),
+        })
+
+    return await concurrency.run_heavy(run)
+
+@app.post("/api/projects/{project_id}/import-drills/", response_model=schemas.IngestReport)
+async def import_drills_for_project(
+    project_id: int,
+    file: UploadFile = File(...),
+    mapping: str = Form("{}"),
+    has_header: Optional[bool] = Form(None),
+    db: Session = Depends(get_db),
+    current_user: auth.CachedUser = Depends(get_current_user)
+):
+    """Igual que upload-csv pero solo devuelve el reporte de carga, sin serializar el proyecto."""
+    def run():
+        project = db.query(models.Project).filter(models.Project.id == project_id, models.Project.owner_id == current_user.id).first()
+        if not project:
+            raise HTTPException(status_code=404, detail="Proyecto no encontrado")
+        return _ingest_upload(project_id, file.file, mapping, has_header, db)
+
+    return await concurrency.run_heavy(run)
+
+@app.post("/api/projects/{project_id}/generate-pattern", response_model=schemas.PatternResult)
+def generate_pattern(project_id: int, request: schemas.PatternRequest, db: Session = Depends(get_db), current_user: auth.CachedUser = Depends(get_current_user)):
+    """
+    Genera una malla (línea, rectangular o escalonada, o la que cubre el
+    polígono del banco) y la inserta de una vez, como una carga de CSV.
+    """
+    project = db.query(models.Project.id).filter(models.Project.id == project_id, models.Project.owner_id == current_user.id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Proyecto no encontrado")
-    
-    db.query(models.Drill).filter(models.Drill.project_id == project_id).delete()
-    
     try:
-        column_mapping = json.loads(mapping)
-        
-        # --- ¡CAMBIO CLAVE! ---
-        # 1. Filtramos el mapeo para quitar las claves que el usuario dejó vacías (como 'z')
-        filtered_mapping = {k: v for k, v in column_mapping.items() if v}
-
-        # 2. Creamos el diccionario para renombrar, solo con las columnas que el usuario sí mapeó
-        rename_dict = {v: k for k, v in filtered_mapping.items()}
-        
-        contents = await file.read()
-        # Leemos el CSV, asumiendo que la primera fila son los encabezados
-        df = pd.read_csv(io.StringIO(contents.decode('utf-8')))
-
-        # 3. Renombramos las columnas
-        df = df.rename(columns=rename_dict)
-
-        # 4. Verificamos que las columnas requeridas existan después de renombrar
-        required_cols = ['label', 'x', 'y']
-        for col in required_cols:
-            if col not in df.columns:
-                raise ValueError(f"La columna mapeada para '{col}' no se encontró en el archivo.")
-
-        # 5. Si la columna 'z' no existe después del mapeo, la creamos con un valor por defecto
-        if 'z' not in df.columns:
-            df['z'] = 0.0
-
-        # 6. Seleccionamos solo las columnas que nos interesan para evitar datos extra
-        final_df = df[['label', 'x', 'y', 'z']]
+        pattern = patterns.generate_pattern(
+            request.burden, request.spacing, request.azimuth_deg, request.stagger,
+            origin=request.origin, rows=request.rows, holes_per_row=request.holes_per_row, polygon=request.polygon,
+            z=request.z, label_scheme=request.label_scheme, label_prefix=request.label_prefix, label_start=request.label_start,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if pattern.empty:
+        raise HTTPException(status_code=400, detail="La malla no tiene taladros dentro del polígono.")
 
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error procesando el archivo o el mapeo: {e}")
+    try:
+        chunks = (pattern.iloc[start:start + ingest.INGEST_CHUNK_SIZE] for start in range(0, len(pattern), ingest.INGEST_CHUNK_SIZE))
+        report = _load_drills(project_id, chunks, db, replace=request.replace)
+    finally:
+        spatial.invalidate(project_id)
+        analysis_cache.invalidate_project(project_id)
+    logger.info("pattern_generated", extra={"project_id": project_id, **report})
+    return report
 
-    for index, row in final_df.iterrows():
-        drill_data = models.Drill(
-            label=str(row['label']), x=row['x'], y=row['y'], z=row['z'],
-            tiempo=0, is_initiator=False, project_id=project.id
-        )
-        db.add(drill_data)
-        
-    db.commit()
-    db.refresh(project)
-    return project
+# --- Endpoints de Búsqueda Espacial ---
+
+def _project_index(project_id: int, db: Session, current_user: auth.CachedUser) -> spatial.DrillGrid:
+    project = db.query(models.Project.id).filter(models.Project.id == project_id, models.Project.owner_id == current_user.id).first()
+    if not project:
+        raise HTTPException(status_code=404, detail="Proyecto no encontrado")
+    return spatial.get_index(db, project_id)
+
+@app.get("/api/projects/{project_id}/drills/nearest", response_model=schemas.NearbyDrillsResponse, dependencies=[Depends(project_etag)])
+def get_nearest_drills(
+    project_id: int,
+    x: Optional[float] = None,
+    y: Optional[float] = None,
+    drill_id: Optional[int] = None,
+    k: int = Query(1, ge=1, le=1000),
+    db: Session = Depends(get_db),
+    current_user: auth.CachedUser = Depends(get_current_user)
+):
+    """Los k taladros más cercanos a un punto o a otro taladro (que se excluye del resultado)."""
+    index = _project_index(project_id, db, current_user)
+    if drill_id is not None:
+        drill = db.query(models.Drill.x, models.Drill.y).filter(models.Drill.id == drill_id, models.Drill.project_id == project_id).first()
+        if not drill:
+            raise HTTPException(status_code=404, detail="Taladro no encontrado")
+        x, y = drill.x, drill.y
+    elif x is None or y is None:
+        raise HTTPException(status_code=400, detail="Indica 'x' e 'y' o un 'drill_id'.")
+    return {"data": index.nearest(x, y, k, exclude_id=drill_id)}
+
+@app.get("/api/projects/{project_id}/drills/within", response_model=schemas.NearbyDrillsResponse, dependencies=[Depends(project_etag)])
+def get_drills_within_radius(
+    project_id: int,
+    x: float,
+    y: float,
+    radius: float = Query(..., gt=0),
+    db: Session = Depends(get_db),
+    current_user: auth.CachedUser = Depends(get_current_user)
+):
+    return {"data": _project_index(project_id, db, current_user).within(x, y, radius)}
+
+@app.get("/api/projects/{project_id}/drills/in-box", response_model=schemas.NearbyDrillsResponse, dependencies=[Depends(project_etag)])
+def get_drills_in_box(
+    project_id: int,
+    min_x: float,
+    min_y: float,
+    max_x: float,
+    max_y: float,
+    db: Session = Depends(get_db),
+    current_user: auth.CachedUser = Depends(get_current_user)
+):
+    return {"data": _project_index(project_id, db, current_user).in_box(min_x, min_y, max_x, max_y)}
 
 # --- Endpoints de Secuenciación ---
 
+def _inbound_link(db: Session, drill_id: int):
+    return db.query(models.SequenceLink).filter(models.SequenceLink.to_drill_id == drill_id).first()
+
+def _recompute_and_commit(project_id: int, drill_ids, db: Session, journal_op: Optional[str] = None, before: Optional[dict] = None) -> dict:
+    """
+    Propaga los tiempos desde los taladros modificados, limpia los huérfanos y
+    confirma todo en una sola transacción bajo una nueva revisión del proyecto.
+    Con journal_op, registra en el diario el cambio de estado respecto de
+    'before' (capturado con journal.capture antes de modificar).
+    """
+    try:
+        db.flush()
+        if journal_op:
+            journal.record(db, project_id, journal_op, before, journal.capture(db, project_id, journal.affected_drills(before)))
+        revision = revisions.bump_revision(db, project_id)
+        changed = sequence_graph.recompute(db, drill_ids, revision)
+    except sequence_graph.SequenceCycleError as e:
+        db.rollback()
+        logger.info("sequence_cycle_rejected", extra={"project_id": project_id, "error": str(e)})
+        raise HTTPException(status_code=400, detail=str(e))
+    clean_orphan_drills(project_id, db, revision)
+    db.commit()
+    analysis_cache.invalidate_project(project_id)
+    logger.debug("sequence_recomputed", extra={"project_id": project_id, "revision": revision, "changed_drills": len(changed)})
+    return changed
+
 @app.post("/api/projects/{project_id}/set-initiator/{drill_id}", response_model=schemas.Project)
-def set_initiator(project_id: int, drill_id: int, timing: schemas.TimingApplication, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def set_initiator(project_id: int, drill_id: int, timing: schemas.TimingApplication, response: Response, view: dict = Depends(project_view), db: Session = Depends(get_db), current_user: auth.CachedUser = Depends(get_current_user)):
+    _owned_project(project_id, db, current_user)
     drill = db.query(models.Drill).filter(models.Drill.id == drill_id, models.Drill.project_id == project_id).first()
     if not drill:
         raise HTTPException(status_code=404, detail="Taladro no encontrado")
     
+    before = journal.capture(db, project_id, [drill.id])
     if timing.delay_ms >= 0:
         drill.is_initiator = True
         drill.tiempo = timing.delay_ms
     else:
         drill.is_initiator = False
-        drill.tiempo = 0 
-    
-    db.commit()
 
-    # ¡Llamamos a nuestra función de limpieza y listo!
-    clean_orphan_drills(project_id, db)
+    # El nuevo tiempo se propaga solo al subárbol que cuelga de este taladro
+    _recompute_and_commit(project_id, [drill.id], db, journal_op="set_initiator", before=before)
     
-    return db.query(models.Project).options(joinedload(models.Project.drills).joinedload(models.Drill.sequences_from)).filter(models.Project.id == project_id).first()
+    return _sequenced_project_response(project_id, view, db, response)
 
 @app.post("/api/projects/{project_id}/apply-sequence/{from_id}/{to_id}", response_model=schemas.Project)
-def apply_sequence(project_id: int, from_id: int, to_id: int, timing_data: schemas.TimingApplication, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def apply_sequence(project_id: int, from_id: int, to_id: int, timing_data: schemas.TimingApplication, response: Response, view: dict = Depends(project_view), db: Session = Depends(get_db), current_user: auth.CachedUser = Depends(get_current_user)):
+    _owned_project(project_id, db, current_user)
     from_drill = db.query(models.Drill).get(from_id)
     to_drill = db.query(models.Drill).get(to_id)
 
     if not from_drill or not to_drill or from_drill.project_id != project_id or to_drill.project_id != project_id:
         raise HTTPException(status_code=404, detail="Taladro no encontrado en este proyecto")
 
-    existing_link = db.query(models.SequenceLink).filter(models.SequenceLink.to_drill_id == to_id).first()
+    existing_link = _inbound_link(db, to_id)
     if existing_link:
         raise HTTPException(status_code=400, detail=f"El taladro {to_drill.label} ya recibe una conexión.")
 
-    new_link = models.SequenceLink(from_drill_id=from_id, to_drill_id=to_id)
+    try:
+        sequence_graph.check_new_link(db, from_id, to_id)
+    except sequence_graph.SequenceCycleError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    before = journal.capture(db, project_id, [to_id])
+    new_link = models.SequenceLink(from_drill_id=from_id, to_drill_id=to_id, delay_ms=timing_data.delay_ms)
     db.add(new_link)
-    to_drill.tiempo = from_drill.tiempo + timing_data.delay_ms
+    _recompute_and_commit(project_id, [to_id], db, journal_op="apply_sequence", before=before)
     
-    db.commit()
+    return _sequenced_project_response(project_id, view, db, response)
 
-    # ¡Llamamos a nuestra función de limpieza y listo!
-    clean_orphan_drills(project_id, db)
-    
-    return db.query(models.Project).options(joinedload(models.Project.drills).joinedload(models.Drill.sequences_from)).filter(models.Project.id == project_id).first()
+@app.post("/api/projects/{project_id}/set-link-delay/{to_id}", response_model=schemas.Project)
+def set_link_delay(project_id: int, to_id: int, timing_data: schemas.TimingApplication, response: Response, view: dict = Depends(project_view), db: Session = Depends(get_db), current_user: auth.CachedUser = Depends(get_current_user)):
+    _owned_project(project_id, db, current_user)
+    to_drill = db.query(models.Drill).filter(models.Drill.id == to_id, models.Drill.project_id == project_id).first()
+    link = _inbound_link(db, to_id) if to_drill else None
+    if not link:
+        raise HTTPException(status_code=404, detail="Conexión no encontrada en este proyecto")
+
+    before = journal.capture(db, project_id, [to_id])
+    link.delay_ms = timing_data.delay_ms
+    _recompute_and_commit(project_id, [to_id], db, journal_op="set_link_delay", before=before)
+
+    return _sequenced_project_response(project_id, view, db, response)
+
+@app.post("/api/projects/{project_id}/sequence-batch", response_model=schemas.SequenceBatchResult)
+def apply_sequence_batch(project_id: int, batch: schemas.SequenceBatch, db: Session = Depends(get_db), current_user: auth.CachedUser = Depends(get_current_user)):
+    """
+    Aplica muchas asignaciones de iniciador y enlaces a la vez: se validan en
+    conjunto y se escriben en una sola transacción con operaciones masivas.
+    """
+    project = db.query(models.Project.id).filter(models.Project.id == project_id, models.Project.owner_id == current_user.id).first()
+    if not project:
+        raise HTTPException(status_code=404, detail="Proyecto no encontrado")
+
+    initiators = {a.drill_id: a.delay_ms for a in batch.initiators}
+    new_parents = {}
+    for link in batch.links:
+        if link.from_drill_id == link.to_drill_id:
+            raise HTTPException(status_code=400, detail=f"El taladro {link.to_drill_id} no puede conectarse consigo mismo.")
+        if link.to_drill_id in new_parents:
+            raise HTTPException(status_code=400, detail=f"El taladro {link.to_drill_id} recibe más de una conexión en el lote.")
+        new_parents[link.to_drill_id] = link
+
+    referenced = set(initiators) | set(new_parents) | {link.from_drill_id for link in new_parents.values()}
+    found = {drill_id for (drill_id,) in db.query(models.Drill.id).filter(models.Drill.project_id == project_id, models.Drill.id.in_(referenced))}
+    missing = sorted(referenced - found)
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Taladros no encontrados en este proyecto: {missing}")
+
+    parents = dict(db.query(models.SequenceLink.to_drill_id, models.SequenceLink.from_drill_id)
+                   .join(models.Drill, models.SequenceLink.from_drill_id == models.Drill.id)
+                   .filter(models.Drill.project_id == project_id).all())
+    taken = sorted(to_id for to_id in new_parents if to_id in parents)
+    if taken:
+        raise HTTPException(status_code=400, detail=f"Estos taladros ya reciben una conexión: {taken}")
+    parents.update({to_id: link.from_drill_id for to_id, link in new_parents.items()})
+    cycle_at = sequence_graph.find_cycle(parents)
+    if cycle_at is not None:
+        raise HTTPException(status_code=400, detail=f"El lote crearía un ciclo en la secuencia en el taladro {cycle_at}.")
+
+    before = journal.capture(db, project_id, set(initiators) | set(new_parents))
+    drills_table = models.Drill.__table__
+    if initiators:
+        db.execute(
+            update(drills_table).where(drills_table.c.id == bindparam("b_id"))
+            .values(is_initiator=bindparam("b_initiator"), tiempo=bindparam("b_tiempo")),
+            [{"b_id": drill_id, "b_initiator": delay >= 0, "b_tiempo": max(delay, 0)} for drill_id, delay in initiators.items()],
+        )
+    if new_parents:
+        db.execute(
+            insert(models.SequenceLink.__table__),
+            [{"from_drill_id": link.from_drill_id, "to_drill_id": to_id, "delay_ms": link.delay_ms} for to_id, link in new_parents.items()],
+        )
+
+    changed = _recompute_and_commit(project_id, set(initiators) | set(new_parents), db, journal_op="sequence_batch", before=before)
+    changed.update({drill_id: delay for drill_id, delay in initiators.items() if delay >= 0 and drill_id not in changed})
+    return {
+        "initiators": len(initiators),
+        "links": len(new_parents),
+        "drills": [{"id": drill_id, "tiempo": tiempo} for drill_id, tiempo in changed.items()],
+    }
+
+@app.post("/api/projects/{project_id}/auto-sequence", response_model=schemas.AutoSequenceResult)
+async def auto_sequence(project_id: int, request: schemas.AutoSequenceRequest, db: Session = Depends(get_db), current_user: auth.CachedUser = Depends(get_current_user)):
+    """
+    Secuencia todo el proyecto con un patrón (row, echelon o v) a partir de
+    sus iniciadores. Reemplaza los enlaces existentes en una sola escritura
+    masiva; con dry_run solo devuelve la propuesta sin guardarla. Los bloques
+    que ningún iniciador alcanza sin un enlace demasiado largo quedan sin
+    secuenciar y se informan en warnings.
+    """
+    # La geometría y la escritura masiva son síncronas: corren en el pool de trabajo pesado
+    def run():
+        project = db.query(models.Project.id).filter(models.Project.id == project_id, models.Project.owner_id == current_user.id).first()
+        if not project:
+            raise HTTPException(status_code=404, detail="Proyecto no encontrado")
+        if not request.initiators:
+            raise HTTPException(status_code=400, detail="Indica al menos un iniciador.")
+
+        rows = db.query(models.Drill.id, models.Drill.x, models.Drill.y).filter(models.Drill.project_id == project_id).all()
+        if not rows:
+            raise HTTPException(status_code=400, detail="El proyecto no tiene taladros.")
+        ids, xs, ys = zip(*rows)
+        initiators = {a.drill_id: max(a.delay_ms, 0) for a in request.initiators}
+        try:
+            links, times, layout = autoseq.build_sequence(
+                ids, xs, ys, initiators, request.pattern, request.inter_hole_ms, request.inter_row_ms, request.row_azimuth_deg
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        if not request.dry_run:
+            before = journal.capture(db, project_id)
+            drills_table = models.Drill.__table__
+            project_drill_ids = db.query(models.Drill.id).filter(models.Drill.project_id == project_id).scalar_subquery()
+            db.query(models.SequenceLink).filter(models.SequenceLink.from_drill_id.in_(project_drill_ids)).delete(synchronize_session=False)
+            revision = revisions.bump_revision(db, project_id)
+            db.query(models.Drill).filter(models.Drill.project_id == project_id)\
+                .update({models.Drill.is_initiator: False, models.Drill.tiempo: 0, models.Drill.revision: revision}, synchronize_session=False)
+            db.execute(
+                update(drills_table).where(drills_table.c.id == bindparam("b_id"))
+                .values(is_initiator=bindparam("b_initiator"), tiempo=bindparam("b_tiempo")),
+                [{"b_id": drill_id, "b_initiator": drill_id in initiators, "b_tiempo": tiempo}
+                 for drill_id, tiempo in times.items() if tiempo or drill_id in initiators],
+            )
+            if links:
+                db.execute(
+                    insert(models.SequenceLink.__table__),
+                    [{"from_drill_id": f, "to_drill_id": t, "delay_ms": d} for f, t, d in links],
+                )
+            db.flush()
+            journal.record(db, project_id, "auto_sequence", before, journal.capture(db, project_id))
+            db.commit()
+            analysis_cache.invalidate_project(project_id)
+            logger.info("auto_sequence_saved", extra={"project_id": project_id, "pattern": request.pattern, "links": len(links),
+                                                      "unsequenced": len(layout["unsequenced"])})
+
+        return {
+            "pattern": request.pattern,
+            "row_azimuth_deg": layout["azimuth_deg"],
+            "spacing": layout["spacing"],
+            "burden": layout["burden"],
+            "rows": layout["rows"],
+            "saved": not request.dry_run,
+            "max_link_m": layout["max_link_m"],
+            "max_simultaneous_holes": layout["max_simultaneous_holes"],
+            "unsequenced_drill_ids": layout["unsequenced"],
+            "warnings": layout["warnings"],
+            "links": [{"from_drill_id": f, "to_drill_id": t, "delay_ms": d} for f, t, d in links],
+            "drills": [{"id": drill_id, "tiempo": tiempo} for drill_id, tiempo in times.items()],
+        }
+
+    return await concurrency.run_heavy(run)
 
 
 @app.post("/api/projects/{project_id}/undo-last-sequence", response_model=schemas.Project)
-def undo_last_sequence(project_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def undo_last_sequence(project_id: int, response: Response, view: dict = Depends(project_view), db: Session = Depends(get_db), current_user: auth.CachedUser = Depends(get_current_user)):
+    """Deshace la última operación del historial y devuelve el proyecto (usa /history/undo para recibir solo lo que cambió)."""
+    project = _owned_project(project_id, db, current_user)
+    if project.journal_head:
+        _history_step(project_id, db, journal.undo)
+        return _sequenced_project_response(project_id, view, db, response)
+
+    # Proyectos sin historial (secuenciados antes del diario): se quita el último enlace creado
     last_link = db.query(models.SequenceLink).join(models.Drill, models.SequenceLink.from_drill_id == models.Drill.id)\
         .filter(models.Drill.project_id == project_id).order_by(models.SequenceLink.id.desc()).first()
 
     if not last_link:
         raise HTTPException(status_code=400, detail="No hay secuencias que deshacer.")
 
+    to_id = last_link.to_drill_id
+    before = journal.capture(db, project_id, [to_id])
     db.delete(last_link)
-    db.commit()
+    # El taladro que pierde su flecha (y todo lo que cuelga de él) se recalcula
+    _recompute_and_commit(project_id, [to_id], db, journal_op="remove_link", before=before)
 
-    # ¡Llamamos a nuestra función de limpieza y listo!
-    clean_orphan_drills(project_id, db)
+    return _sequenced_project_response(project_id, view, db, response)
 
-    return db.query(models.Project).options(joinedload(models.Project.drills).joinedload(models.Drill.sequences_from)).filter(models.Project.id == project_id).first()
+# --- Historial de Secuencia (Deshacer / Rehacer) ---
 
+def _owned_project(project_id: int, db: Session, current_user: auth.CachedUser) -> models.Project:
+    project = db.query(models.Project).filter(models.Project.id == project_id, models.Project.owner_id == current_user.id).first()
+    if not project:
+        raise HTTPException(status_code=404, detail="Proyecto no encontrado")
+    return project
 
+def _history_step(project_id: int, db: Session, step) -> dict:
+    """Aplica un paso del historial, recalcula solo los taladros afectados y devuelve las filas que cambiaron."""
+    try:
+        result = step(db, project_id)
+    except journal.JournalEmpty as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    entry, drill_ids = result if isinstance(result, tuple) else (None, result)
+    _recompute_and_commit(project_id, drill_ids, db)
+    project = db.query(models.Project).filter(models.Project.id == project_id).one()
+    delta = payloads.delta_project(db, project, project.revision - 1)
+    return {
+        "entry_id": entry.id if entry else project.journal_head,
+        "op": entry.op if entry else None,
+        "head": project.journal_head,
+        "revision": project.revision,
+        "drills": delta["drills"],
+    }
 
-@app.get("/api/projects/{project_id}/timing-analysis", response_model=schemas.TimingAnalysisResponse)
-def get_timing_analysis(project_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    project = db.query(models.Project).options(joinedload(models.Project.drills)).filter(models.Project.id == project_id, models.Project.owner_id == current_user.id).first()
-    if not project or not project.drills:
-        return {"data": []}
-    drill_times = [d.tiempo for d in project.drills]
+@app.get("/api/projects/{project_id}/history", response_model=List[schemas.HistoryEntry])
+def read_history(project_id: int, limit: int = Query(100, ge=1, le=1000), db: Session = Depends(get_db), current_user: auth.CachedUser = Depends(get_current_user)):
+    """Operaciones más recientes del historial; 'is_head' marca el estado actual."""
+    project = _owned_project(project_id, db, current_user)
+    return [
+        {"id": entry_id, "parent_id": parent_id, "depth": depth, "op": op, "created_at": created_at,
+         "has_snapshot": bool(has_snapshot), "is_head": entry_id == project.journal_head}
+        for entry_id, parent_id, depth, op, created_at, has_snapshot in journal.history(db, project_id, limit)
+    ]
+
+@app.post("/api/projects/{project_id}/history/undo", response_model=schemas.HistoryStepResult)
+def undo_history(project_id: int, db: Session = Depends(get_db), current_user: auth.CachedUser = Depends(get_current_user)):
+    """Aplica la inversa de la última operación y devuelve solo los taladros afectados."""
+    _owned_project(project_id, db, current_user)
+    return _history_step(project_id, db, journal.undo)
+
+@app.post("/api/projects/{project_id}/history/redo", response_model=schemas.HistoryStepResult)
+def redo_history(project_id: int, db: Session = Depends(get_db), current_user: auth.CachedUser = Depends(get_current_user)):
+    """Vuelve a aplicar la última operación deshecha y devuelve solo los taladros afectados."""
+    _owned_project(project_id, db, current_user)
+    return _history_step(project_id, db, journal.redo)
+
+@app.post("/api/projects/{project_id}/history/{entry_id}/checkout", response_model=schemas.HistoryStepResult)
+def checkout_history(project_id: int, entry_id: int, db: Session = Depends(get_db), current_user: auth.CachedUser = Depends(get_current_user)):
+    """Lleva la secuencia al estado posterior a cualquier operación del historial."""
+    _owned_project(project_id, db, current_user)
+    return _history_step(project_id, db, lambda db, project_id: journal.checkout(db, project_id, entry_id))
+
+
+# --- Análisis ---
+# Cada análisis es una función del proyecto y sus parámetros: la usan los
+# endpoints GET (con caché) y los trabajos en segundo plano.
+
+def _analysis_project(db: Session, project_id: int, owner_id: int) -> None:
+    """Todo análisis empieza aquí: 404 si el proyecto no existe o no es de owner_id."""
+    if not db.query(exists().where(models.Project.id == project_id, models.Project.owner_id == owner_id)).scalar():
+        raise HTTPException(status_code=404, detail="Proyecto no encontrado")
+
+def timing_analysis(db: Session, project_id: int, owner_id: int, samples: int = 500, std_dev: float = 5.0,
+                    charge_per_hole: float = 1.0, resolution_ms: Optional[float] = None, method: str = "exact",
+                    on_progress=None) -> dict:
+    _analysis_project(db, project_id, owner_id)
+    drill_times = [t for (t,) in db.query(models.Drill.tiempo).join(models.Project)
+                   .filter(models.Project.id == project_id, models.Project.owner_id == owner_id)]
     if not drill_times:
         return {"data": []}
-    max_time = max(drill_times) if drill_times else 0
-    time_axis = np.linspace(0, max_time + 50, num=500)
-    total_energy = np.zeros_like(time_axis)
-    std_dev = 5.0
-    amplitude = 1.0
-    for t in drill_times:
-        energy_curve = amplitude * np.exp(-0.5 * ((time_axis - t) / std_dev) ** 2)
-        total_energy += energy_curve
-    response_data = [{"time": t, "energy": e} for t, e in zip(time_axis, total_energy)]
+    try:
+        time_axis, total_energy = timing.energy_curve(
+            drill_times, std_dev=std_dev, samples=samples, weights=charge_per_hole,
+            method=method, resolution_ms=resolution_ms, on_progress=on_progress,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    response_data = [{"time": t, "energy": e} for t, e in zip(time_axis.tolist(), total_energy.tolist())]
     return {"data": response_data}
 
-@app.get("/api/projects/{project_id}/relief-analysis", response_model=schemas.ReliefAnalysisResponse)
-def get_relief_analysis(
-    project_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
-):
-    print("\n--- [DEBUG] Iniciando get_relief_analysis ---")
-    links = db.query(models.SequenceLink).join(models.Drill, models.SequenceLink.from_drill_id == models.Drill.id)\
-        .filter(models.Drill.project_id == project_id)\
-        .options(joinedload(models.SequenceLink.from_drill), joinedload(models.SequenceLink.to_drill))\
-        .all()
-
-    if not links:
-        print("[DEBUG] No se encontraron enlaces. Devolviendo datos vacíos.")
-        return {"data": []}
+def relief_analysis(db: Session, project_id: int, owner_id: int, include_z: bool = False) -> dict:
+    _analysis_project(db, project_id, owner_id)
+    mid_x, mid_y, velocity = relief.relief_points(relief.load_links(db, project_id, owner_id), include_z=include_z)
+    return {"data": [{"x": x, "y": y, "relief_velocity": v}
+                     for x, y, v in zip(mid_x.tolist(), mid_y.tolist(), velocity.tolist())]}
+
+def relief_grid_analysis(db: Session, project_id: int, owner_id: int, resolution: float = 1.0, power: float = 2.0,
+                         max_distance: Optional[float] = None, include_z: bool = False, on_progress=None) -> dict:
+    _analysis_project(db, project_id, owner_id)
+    mid_x, mid_y, velocity = relief.relief_points(relief.load_links(db, project_id, owner_id), include_z=include_z)
+    if not len(velocity):
+        return {"min_x": 0.0, "min_y": 0.0, "resolution": resolution, "nx": 0, "ny": 0, "values": []}
+    try:
+        min_x, min_y, nx, ny, grid = relief.relief_grid(mid_x, mid_y, velocity, resolution, power, max_distance, on_progress)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    values = np.where(np.isnan(grid), None, grid).tolist()
+    return {"min_x": min_x, "min_y": min_y, "resolution": resolution, "nx": nx, "ny": ny, "values": values}
 
-    print(f"[DEBUG] Se encontraron {len(links)} enlaces.")
-    relief_data = []
-    for i, link in enumerate(links):
-        print(f"\n[DEBUG] Procesando enlace #{i+1}: from_id={link.from_drill_id}, to_id={link.to_drill_id}")
-        
-        from_drill = link.from_drill
-        to_drill = link.to_drill
-
-        if not from_drill or not to_drill:
-            print(f"[ERROR] ¡Taladro de origen o destino es Nulo! From: {from_drill}, To: {to_drill}")
-            continue
-
-        print(f"[DEBUG] From: {from_drill.label} (tiempo={from_drill.tiempo}), To: {to_drill.label} (tiempo={to_drill.tiempo})")
-        
-        time_delay = to_drill.tiempo - from_drill.tiempo
-        print(f"[DEBUG] Retardo de tiempo calculado: {time_delay}")
-
-        if time_delay > 0:
-            distance = math.sqrt((to_drill.x - from_drill.x)**2 + (to_drill.y - from_drill.y)**2)
-            velocity = distance / time_delay
-            
-            mid_x = (from_drill.x + to_drill.x) / 2
-            mid_y = (from_drill.y + to_drill.y) / 2
-            
-            relief_data.append({"x": mid_x, "y": mid_y, "relief_velocity": velocity})
-            print(f"[DEBUG] Punto de relief añadido. Velocidad: {velocity}")
-        else:
-            print(f"[WARN] Retardo de tiempo es cero o negativo. Omitiendo enlace.")
-
-    print("--- [DEBUG] Finalizando get_relief_analysis ---\n")
-    return {"data": relief_data}
-
-@app.get("/api/projects/{project_id}/timing-histogram", response_model=schemas.TimingHistogramResponse)
-def get_timing_histogram(project_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    project = db.query(models.Project).options(joinedload(models.Project.drills)).filter(models.Project.id == project_id, models.Project.owner_id == current_user.id).first()
+def vibration_analysis(db: Session, project_id: int, owner_id: int, charge_per_hole: float, k: float = vibration.DEFAULT_SITE_K,
+                       beta: float = vibration.DEFAULT_SITE_BETA, window_ms: float = 8.0, nx: int = 200, ny: int = 200,
+                       margin: float = 100.0, min_distance: float = 1.0, ppv_limit: Optional[float] = None,
+                       on_progress=None) -> dict:
+    _analysis_project(db, project_id, owner_id)
+    rows = db.query(models.Drill.x, models.Drill.y, models.Drill.tiempo).join(models.Project)\
+        .filter(models.Project.id == project_id, models.Project.owner_id == owner_id).all()
+    if not rows:
+        raise HTTPException(status_code=400, detail="El proyecto no tiene taladros.")
+    xs, ys, times = (np.array(column, dtype=float) for column in zip(*rows))
+    grid_x = np.linspace(xs.min() - margin, xs.max() + margin, nx)
+    grid_y = np.linspace(ys.min() - margin, ys.max() + margin, ny)
+    pool = concurrency.get_process_pool() if concurrency.ANALYSIS_PROCESS_WORKERS > 1 else None
+    ppv, max_charge = vibration.ppv_map(xs, ys, times, charge_per_hole, grid_x, grid_y, window_ms=window_ms,
+                                        k=k, beta=beta, min_distance=min_distance, pool=pool,
+                                        on_progress=on_progress)
+    return {
+        "min_x": grid_x[0], "min_y": grid_y[0], "max_x": grid_x[-1], "max_y": grid_y[-1], "nx": nx, "ny": ny,
+        "window_ms": window_ms,
+        "max_charge_per_window": max_charge,
+        "max_ppv": float(ppv.max()),
+        "ppv_limit": ppv_limit,
+        "cells_over_limit": int((ppv > ppv_limit).sum()) if ppv_limit else None,
+        "values": ppv.tolist(),
+    }
+
+def charge_window_analysis(db: Session, project_id: int, owner_id: int, window_ms: float = 8.0, charge_per_hole: float = 1.0) -> dict:
+    _analysis_project(db, project_id, owner_id)
+    rows = db.query(models.Drill.id, models.Drill.tiempo).join(models.Project)\
+        .filter(models.Project.id == project_id, models.Project.owner_id == owner_id).all()
+    if not rows:
+        return {"window_ms": window_ms, "max_holes": 0, "max_charge": 0.0, "offending_drill_ids": [], "data": []}
+    ids, times = (np.array(column) for column in zip(*rows))
+    order, starts, lo, hi, charges, counts = timing.sliding_windows(times, charge_per_hole, window_ms)
+    worst = int(charges.argmax())
+    series = [{"start": s, "end": s + window_ms, "holes": n, "charge": q}
+              for s, n, q in zip(starts.tolist(), counts.tolist(), charges.tolist())]
+    return {
+        "window_ms": window_ms,
+        "max_holes": int(counts.max()),
+        "max_charge": float(charges[worst]),
+        "worst_window": series[worst],
+        "offending_drill_ids": ids[order[lo[worst]:hi[worst]]].tolist(),
+        "data": series,
+    }
+
+def histogram_analysis(db: Session, project_id: int, owner_id: int) -> dict:
+    _analysis_project(db, project_id, owner_id)
+    project = db.query(models.Project).options(joinedload(models.Project.drills)).filter(models.Project.id == project_id, models.Project.owner_id == owner_id).first()
     if not project or not project.drills:
         return {"data": []}
     df = pd.DataFrame([{"tiempo": d.tiempo, "label": d.label} for d in project.drills])
@@ -334,3 +868,270 @@ def get_timing_histogram(project_id: int, db: Session = Depends(get_db), current
     histogram_data = df.groupby('tiempo').agg(frequency=('label', 'count'), drill_labels=('label', list)).reset_index()
     response_data = histogram_data.apply(lambda row: {"time": row['tiempo'], "frequency": row['frequency'], "drill_labels": row['drill_labels']}, axis=1).tolist()
     return {"data": response_data}
+
+# Análisis que se pueden pedir como trabajo: (parámetros, respuesta, función)
+ANALYSES = {
+    "timing": (schemas.TimingAnalysisParams, schemas.TimingAnalysisResponse, timing_analysis),
+    "relief": (schemas.ReliefAnalysisParams, schemas.ReliefAnalysisResponse, relief_analysis),
+    "relief-grid": (schemas.ReliefGridParams, schemas.ReliefGridResponse, relief_grid_analysis),
+    "vibration": (schemas.VibrationMapParams, schemas.VibrationMapResponse, vibration_analysis),
+    "charge-window": (schemas.ChargeWindowParams, schemas.ChargeWindowResponse, charge_window_analysis),
+    "histogram": (schemas.HistogramParams, schemas.TimingHistogramResponse, histogram_analysis),
+}
+# Análisis largos que reportan progreso por trozos: un trabajo cancelado se detiene a mitad del cálculo
+PROGRESS_ANALYSES = {"timing", "relief-grid", "vibration"}
+
+@app.get("/api/projects/{project_id}/timing-analysis", response_model=schemas.TimingAnalysisResponse, dependencies=[Depends(project_etag)])
+def get_timing_analysis(
+    project_id: int,
+    request: Request,
+    response: Response,
+    samples: int = Query(500, ge=2, le=timing.MAX_SAMPLES),
+    std_dev: float = Query(5.0, gt=0),
+    charge_per_hole: float = Query(1.0, gt=0),
+    resolution_ms: Optional[float] = Query(None, gt=0),
+    method: str = Query("exact"),
+    db: Session = Depends(get_db),
+    current_user: auth.CachedUser = Depends(get_current_user)
+):
+    if method not in timing.TIMING_METHODS:
+        raise HTTPException(status_code=400, detail=f"Método desconocido '{method}'. Opciones: {', '.join(timing.TIMING_METHODS)}")
+
+    def compute():
+        return timing_analysis(db, project_id, current_user.id, samples, std_dev, charge_per_hole, resolution_ms, method)
+
+    return cached_analysis("timing", project_id, request, response, schemas.TimingAnalysisResponse, compute)
+
+@app.get("/api/projects/{project_id}/relief-analysis", response_model=schemas.ReliefAnalysisResponse, dependencies=[Depends(project_etag)])
+def get_relief_analysis(
+    project_id: int,
+    request: Request,
+    response: Response,
+    include_z: bool = False,
+    db: Session = Depends(get_db),
+    current_user: auth.CachedUser = Depends(get_current_user)
+):
+    def compute():
+        return relief_analysis(db, project_id, current_user.id, include_z)
+
+    return cached_analysis("relief", project_id, request, response, schemas.ReliefAnalysisResponse, compute)
+
+@app.get("/api/projects/{project_id}/relief-grid", response_model=schemas.ReliefGridResponse, dependencies=[Depends(project_etag)])
+async def get_relief_grid(
+    project_id: int,
+    request: Request,
+    response: Response,
+    resolution: float = Query(1.0, gt=0, description="Tamaño de celda en metros"),
+    power: float = Query(2.0, gt=0),
+    max_distance: Optional[float] = Query(None, gt=0),
+    include_z: bool = False,
+    db: Session = Depends(get_db),
+    current_user: auth.CachedUser = Depends(get_current_user)
+):
+    """
+    Velocidad de alivio interpolada sobre una grilla regular, para curvas de
+    nivel. Con max_distance cada celda solo usa los enlaces a esa distancia.
+    """
+    def compute():
+        return relief_grid_analysis(db, project_id, current_user.id, resolution, power, max_distance, include_z)
+
+    # La interpolación es CPU pura: corre en el pool de trabajo pesado
+    return await concurrency.run_heavy(cached_analysis, "relief-grid", project_id, request, response, schemas.ReliefGridResponse, compute)
+
+@app.get("/api/projects/{project_id}/vibration-map", response_model=schemas.VibrationMapResponse, dependencies=[Depends(project_etag)])
+async def get_vibration_map(
+    project_id: int,
+    request: Request,
+    response: Response,
+    charge_per_hole: float = Query(..., gt=0, description="Carga por taladro en kg"),
+    k: float = Query(vibration.DEFAULT_SITE_K, gt=0, description="Constante de sitio K"),
+    beta: float = Query(vibration.DEFAULT_SITE_BETA, gt=0, description="Exponente de atenuación"),
+    window_ms: float = Query(8.0, gt=0),
+    nx: int = Query(200, ge=2, le=2000),
+    ny: int = Query(200, ge=2, le=2000),
+    margin: float = Query(100.0, ge=0, description="Metros alrededor de la malla que cubre la grilla"),
+    min_distance: float = Query(1.0, gt=0),
+    ppv_limit: Optional[float] = Query(None, gt=0, description="Límite de PPV (mm/s) para contar celdas excedidas"),
+    db: Session = Depends(get_db),
+    current_user: auth.CachedUser = Depends(get_current_user)
+):
+    """
+    Mapa de PPV por distancia escalada: para cada punto de la grilla, el peor
+    caso entre las cargas que detonan dentro de una misma ventana de tiempo.
+    """
+    def compute():
+        return vibration_analysis(db, project_id, current_user.id, charge_per_hole, k, beta, window_ms, nx, ny,
+                                  margin, min_distance, ppv_limit)
+
+    return await concurrency.run_heavy(cached_analysis, "vibration", project_id, request, response, schemas.VibrationMapResponse, compute)
+
+@app.get("/api/projects/{project_id}/charge-per-window", response_model=schemas.ChargeWindowResponse, dependencies=[Depends(project_etag)])
+def get_charge_per_window(
+    project_id: int,
+    request: Request,
+    response: Response,
+    window_ms: float = Query(8.0, gt=0),
+    charge_per_hole: float = Query(1.0, gt=0, description="Carga por taladro en kg"),
+    db: Session = Depends(get_db),
+    current_user: auth.CachedUser = Depends(get_current_user)
+):
+    """
+    Taladros y carga que detonan dentro de una ventana deslizante de window_ms
+    (8 ms por defecto), con la peor ventana y sus taladros.
+    """
+    def compute():
+        return charge_window_analysis(db, project_id, current_user.id, window_ms, charge_per_hole)
+
+    return cached_analysis("charge-window", project_id, request, response, schemas.ChargeWindowResponse, compute)
+
+@app.get("/api/projects/{project_id}/timing-histogram", response_model=schemas.TimingHistogramResponse, dependencies=[Depends(project_etag)])
+def get_timing_histogram(project_id: int, request: Request, response: Response, db: Session = Depends(get_db), current_user: auth.CachedUser = Depends(get_current_user)):
+    def compute():
+        return histogram_analysis(db, project_id, current_user.id)
+
+    return cached_analysis("histogram", project_id, request, response, schemas.TimingHistogramResponse, compute)
+
+@app.get("/api/projects/{project_id}/export")
+def export_project(
+    project_id: int,
+    format: str = Query("csv", description="csv (formato de importación más tiempos y flechas) o jsonl"),
+    header: bool = Query(False, description="Solo para csv: incluir la fila de encabezados (label,x,y,z,...; la importación la reconoce sin mapeo)"),
+    db: Session = Depends(get_db),
+    current_user: auth.CachedUser = Depends(get_current_user),
+):
+    """
+    Exporta los taladros con su tiempo final, si son iniciadores y la flecha
+    que reciben. Se envía en streaming desde un cursor del servidor: la memoria
+    no crece con el tamaño del proyecto y los primeros bytes salen enseguida.
+    """
+    if format not in export.EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Formato desconocido '{format}'. Opciones: {', '.join(export.EXPORT_FORMATS)}")
+    project = _owned_project(project_id, db, current_user)
+    filename = re.sub(r"[^\w.-]+", "_", project.name, flags=re.ASCII).strip("_") or f"proyecto_{project_id}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}.{format}"'}
+    if format == "csv":
+        body, media_type = export.iter_csv(SessionLocal, project_id, header), "text/csv; charset=utf-8"
+    else:
+        body, media_type = export.iter_jsonl(SessionLocal, project_id), "application/x-ndjson"
+    return StreamingResponse(body, media_type=media_type, headers=headers)
+
+# --- Trabajos en Segundo Plano ---
+# Cargas y análisis largos se encolan en la tabla jobs y los ejecutan los
+# workers de este proceso (jobs.JOB_WORKERS); el cliente consulta el estado.
+
+def _import_csv_job(db: Session, job: models.Job, ctx: jobs.JobContext) -> str:
+    params = json.loads(job.params)
+    data = job.payload or b""
+    buffer = io.BytesIO(data)
+    ctx.progress(0.0, "Cargando taladros")
+    report = _ingest_upload(job.project_id, buffer, params.get("mapping", "{}"), params.get("has_header"), db,
+                            on_chunk=lambda: ctx.progress(buffer.tell() / max(len(data), 1)))
+    return json.dumps(report)
+
+def _analysis_job(name: str):
+    params_model, response_model, compute = ANALYSES[name]
+
+    def run(db: Session, job: models.Job, ctx: jobs.JobContext) -> str:
+        params = params_model.model_validate_json(job.params)
+        ctx.progress(0.0, "Calculando")
+        extra = {"on_progress": ctx.progress} if name in PROGRESS_ANALYSES else {}
+        result = response_model.model_validate(compute(db, job.project_id, job.owner_id, **params.model_dump(), **extra))
+        ctx.check()
+        return result.model_dump_json()
+    return run
+
+jobs.register("import-csv", _import_csv_job)
+for analysis_name in ANALYSES:
+    jobs.register(analysis_name, _analysis_job(analysis_name))
+
+def _owned_job(job_id: int, db: Session, current_user: auth.CachedUser) -> models.Job:
+    job = db.query(models.Job).filter(models.Job.id == job_id, models.Job.owner_id == current_user.id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job
+
+def _job_response(job: models.Job) -> dict:
+    """Estado del trabajo; si corre en este proceso, con el progreso en memoria (más reciente que el guardado)."""
+    data = schemas.Job.model_validate(job).model_dump()
+    ctx = jobs.live_context(job.id)
+    if ctx is not None and job.status == "running":
+        data.update(progress=ctx.progress_value, message=ctx.message)
+    return data
+
+@app.post("/api/projects/{project_id}/jobs/import-csv", response_model=schemas.Job, status_code=202)
+async def submit_import_job(
+    project_id: int,
+    file: UploadFile = File(...),
+    mapping: str = Form("{}"),
+    has_header: Optional[bool] = Form(None),
+    db: Session = Depends(get_db),
+    current_user: auth.CachedUser = Depends(get_current_user)
+):
+    """Encola la carga de un CSV (mismos campos que upload-csv) y responde enseguida con el trabajo."""
+    try:
+        json.loads(mapping or "{}")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="El mapeo no es un JSON válido.")
+    payload = await file.read()
+
+    def submit():
+        _owned_project(project_id, db, current_user)
+        params = json.dumps({"mapping": mapping, "has_header": has_header})
+        return _job_response(jobs.submit(db, current_user.id, project_id, "import-csv", params, payload))
+
+    return await run_in_threadpool(submit)
+
+@app.post("/api/projects/{project_id}/jobs/analysis/{name}", response_model=schemas.Job, status_code=202)
+def submit_analysis_job(project_id: int, name: str, params: dict = Body({}), db: Session = Depends(get_db), current_user: auth.CachedUser = Depends(get_current_user)):
+    """Encola un análisis; 'params' lleva los mismos parámetros que su endpoint GET."""
+    if name not in ANALYSES:
+        raise HTTPException(status_code=404, detail=f"Análisis desconocido '{name}'. Opciones: {', '.join(ANALYSES)}")
+    _owned_project(project_id, db, current_user)
+    try:
+        validated = ANALYSES[name][0].model_validate(params)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=json.loads(e.json()))
+    if name == "timing" and validated.resolution_ms:
+        # El número de puntos depende de la duración de la voladura: se comprueba antes de encolar
+        min_time, max_time = db.query(func.min(models.Drill.tiempo), func.max(models.Drill.tiempo))\
+            .filter(models.Drill.project_id == project_id).one()
+        try:
+            timing.sample_count(max_time or 0, resolution_ms=validated.resolution_ms, min_time=min_time or 0)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    return _job_response(jobs.submit(db, current_user.id, project_id, name, validated.model_dump_json()))
+
+@app.get("/api/projects/{project_id}/jobs", response_model=List[schemas.Job])
+def read_project_jobs(project_id: int, limit: int = Query(50, ge=1, le=500), db: Session = Depends(get_db), current_user: auth.CachedUser = Depends(get_current_user)):
+    _owned_project(project_id, db, current_user)
+    project_jobs = db.query(models.Job).filter(models.Job.project_id == project_id).order_by(models.Job.id.desc()).limit(limit).all()
+    return [_job_response(job) for job in project_jobs]
+
+@app.get("/api/jobs/{job_id}", response_model=schemas.Job)
+def read_job(job_id: int, db: Session = Depends(get_db), current_user: auth.CachedUser = Depends(get_current_user)):
+    return _job_response(_owned_job(job_id, db, current_user))
+
+@app.get("/api/jobs/{job_id}/result")
+def read_job_result(job_id: int, db: Session = Depends(get_db), current_user: auth.CachedUser = Depends(get_current_user)):
+    """Resultado de un trabajo terminado: el reporte de carga o la misma respuesta que el endpoint del análisis."""
+    job = _owned_job(job_id, db, current_user)
+    if job.status == "succeeded":
+        return Response(job.result, media_type="application/json")
+    if job.status == "failed":
+        raise HTTPException(status_code=409, detail=f"El trabajo falló: {job.error}")
+    raise HTTPException(status_code=409, detail=f"El trabajo no tiene resultado (estado: {job.status}).")
+
+@app.post("/api/jobs/{job_id}/cancel", response_model=schemas.Job)
+def cancel_job(job_id: int, db: Session = Depends(get_db), current_user: auth.CachedUser = Depends(get_current_user)):
+    """Cancela un trabajo en cola o en curso; uno en curso se detiene y deshace en su siguiente reporte de progreso."""
+    return _job_response(jobs.cancel(db, _owned_job(job_id, db, current_user)))
+
+@app.get("/api/analysis-cache/stats", response_model=schemas.AnalysisCacheStats)
+def get_analysis_cache_stats(current_user: auth.CachedUser = Depends(get_current_user)):
+    """Contadores de la caché de análisis de este proceso, para dimensionarla."""
+    return analysis_cache.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def get_metrics():
+    """Métricas del proceso en formato de texto de Prometheus."""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,216 @@
+# app/metrics.py
+
+import contextvars
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import event
+
+logger = logging.getLogger("app.requests")
+
+# Límites de latencia (segundos) de los histogramas de peticiones
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Límites del número de sentencias SQL por petición
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500, 1000)
+# Peticiones más lentas que esto, o con más sentencias SQL, se registran como WARNING
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", 1.0))
+SLOW_REQUEST_STATEMENTS = int(os.getenv("SLOW_REQUEST_STATEMENTS", 50))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Gauge:
+    """Gauge con valor propio o calculado al exportar (callback)."""
+
+    def __init__(self, name: str, help: str, callback=None):
+        self.name, self.help, self.callback = name, help, callback
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+    def render(self) -> list:
+        value = self.callback() if self.callback else self._value
+        if value is None:
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {float(value)}"]
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ("le",)
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_labels(names, label_values + (bound,))} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_labels(names, label_values + ('+Inf',))} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, label_values)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labels, label_values)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+request_latency = registry.register(Histogram(
+    "http_request_duration_seconds", "Latencia de las peticiones HTTP por ruta.", ("method", "route")))
+requests_total = registry.register(Counter(
+    "http_requests_total", "Peticiones HTTP atendidas por ruta y código de estado.", ("method", "route", "status")))
+requests_in_flight = registry.register(Gauge(
+    "http_requests_in_flight", "Peticiones HTTP en curso."))
+request_statements = registry.register(Histogram(
+    "db_statements_per_request", "Sentencias SQL ejecutadas por petición.", ("method", "route"), STATEMENT_BUCKETS))
+request_statement_seconds = registry.register(Histogram(
+    "db_statement_seconds_per_request", "Tiempo total en SQL por petición.", ("method", "route")))
+
+
+# --- Sentencias SQL por Petición ---
+
+class _RequestStats:
+    __slots__ = ("statements", "seconds")
+
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+
+# El objeto se comparte con los hilos a los que se delega trabajo (anyio copia el contexto)
+_request_stats = contextvars.ContextVar("request_stats", default=None)
+
+
+def instrument_engine(engine):
+    """Cuenta las sentencias SQL y su duración, y registra el uso del pool de conexiones."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.statements += 1
+            stats.seconds += elapsed
+
+    pool = engine.pool
+    for name, help, attribute in (
+        ("db_pool_checked_out", "Conexiones del pool en uso.", "checkedout"),
+        ("db_pool_size", "Tamaño configurado del pool de conexiones.", "size"),
+        ("db_pool_overflow", "Conexiones abiertas por encima del tamaño del pool.", "overflow"),
+    ):
+        getter = getattr(pool, attribute, None)
+        if getter is not None:
+            registry.register(Gauge(name, help, callback=getter))
+
+
+# --- Middleware ---
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI: mide latencia, peticiones en curso y sentencias SQL por
+    ruta (la plantilla de la ruta, no la URL, para no disparar la cardinalidad).
+    Las peticiones lentas o con demasiadas sentencias se registran como WARNING.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        stats = _RequestStats()
+        token = _request_stats.set(stats)
+        requests_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            requests_in_flight.dec()
+            _request_stats.reset(token)
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope["method"]
+            request_latency.observe(elapsed, method, route)
+            requests_total.inc(method, route, str(status["code"]))
+            request_statements.observe(stats.statements, method, route)
+            request_statement_seconds.observe(stats.seconds, method, route)
+
+            level = logging.WARNING if elapsed > SLOW_REQUEST_SECONDS or stats.statements > SLOW_REQUEST_STATEMENTS else logging.DEBUG
+            logger.log(level, "request", extra={
+                "method": method, "route": route, "status": status["code"],
+                "duration_ms": round(elapsed * 1000, 2), "sql_statements": stats.statements,
+                "sql_ms": round(stats.seconds * 1000, 2),
+            })
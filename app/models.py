@@ -1,7 +1,7 @@
 # app/models.py
 
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean, UniqueConstraint
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean, UniqueConstraint, Index, Text, LargeBinary
+from sqlalchemy.orm import relationship, deferred
 from .database import Base
 import datetime
 
@@ -10,6 +10,8 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     email = Column(String, unique=True, index=True, nullable=False)
     hashed_password = Column(String, nullable=False)
+    # Al incrementarla se invalidan todos los tokens emitidos antes
+    token_version = Column(Integer, default=0, server_default="0", nullable=False)
     projects = relationship("Project", back_populates="owner")
 
 class Project(Base):
@@ -18,6 +20,14 @@ class Project(Base):
     name = Column(String, index=True, nullable=False)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     owner_id = Column(Integer, ForeignKey("users.id"))
+    # Revisión monótona: cada mutación la incrementa; los taladros guardan la última en que cambiaron
+    revision = Column(Integer, default=0, server_default="0", nullable=False)
+    # Revisión en la que se reemplazó el conjunto de taladros (carga de CSV)
+    drills_replaced_revision = Column(Integer, default=0, server_default="0", nullable=False)
+    # Revisión en la que cambiaron por última vez las posiciones de los taladros (cargas, mallas generadas)
+    positions_revision = Column(Integer, default=0, server_default="0", nullable=False)
+    # Entrada del diario de secuencia que refleja el estado actual (None: ninguna)
+    journal_head = Column(Integer, nullable=True)
     owner = relationship("User", back_populates="projects")
     drills = relationship("Drill", back_populates="project", cascade="all, delete-orphan")
 
@@ -31,6 +41,7 @@ class Drill(Base):
     tiempo = Column(Integer, default=0)
     is_initiator = Column(Boolean, default=False)
     project_id = Column(Integer, ForeignKey("projects.id"))
+    revision = Column(Integer, default=0, server_default="0", nullable=False)
     
     project = relationship("Project", back_populates="drills")
     
@@ -40,12 +51,55 @@ class Drill(Base):
     # Un taladro solo puede ser el destino de UNA secuencia (flecha de entrada)
     sequence_to = relationship("SequenceLink", foreign_keys="[SequenceLink.to_drill_id]", back_populates="to_drill", uselist=False)
 
+    __table_args__ = (Index("ix_drills_project_revision", "project_id", "revision"),)
+
 class SequenceLink(Base):
     __tablename__ = "sequence_links"
     id = Column(Integer, primary_key=True)
-    from_drill_id = Column(Integer, ForeignKey("drills.id"))
+    from_drill_id = Column(Integer, ForeignKey("drills.id"), index=True)
     to_drill_id = Column(Integer, ForeignKey("drills.id"), unique=True) # Regla: solo una flecha de entrada
+    delay_ms = Column(Integer, default=0) # Retardo del enlace: tiempo(to) = tiempo(from) + delay_ms
     
     # Relaciones bidireccionales para una navegación de datos perfecta
     from_drill = relationship("Drill", back_populates="sequences_from", foreign_keys=[from_drill_id])
-    to_drill = relationship("Drill", back_populates="sequence_to", foreign_keys=[to_drill_id])
\ No newline at end of file
+    to_drill = relationship("Drill", back_populates="sequence_to", foreign_keys=[to_drill_id])
+
+class SequenceJournal(Base):
+    """Diario de operaciones de secuencia de un proyecto, en forma de árbol (deshacer/rehacer/ramas)."""
+    __tablename__ = "sequence_journal"
+    id = Column(Integer, primary_key=True)
+    project_id = Column(Integer, ForeignKey("projects.id"), nullable=False)
+    parent_id = Column(Integer, nullable=True) # Entrada que era la actual cuando se creó esta
+    depth = Column(Integer, nullable=False) # Distancia a la raíz del historial
+    op = Column(String, nullable=False)
+    changes = Column(Text, nullable=False) # JSON {aspecto: {drill_id: [antes, después]}}
+    snapshot = Column(Text, nullable=True) # JSON con el estado completo después de esta entrada (periódico)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (Index("ix_sequence_journal_project_parent", "project_id", "parent_id"),)
+
+class Job(Base):
+    """Trabajo en segundo plano (carga de CSV o análisis) que ejecutan los workers locales."""
+    __tablename__ = "jobs"
+    id = Column(Integer, primary_key=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    project_id = Column(Integer, ForeignKey("projects.id"), nullable=False)
+    kind = Column(String, nullable=False)
+    params = Column(Text, nullable=False, default="{}") # JSON con los parámetros del trabajo
+    payload = deferred(Column(LargeBinary, nullable=True)) # Archivo subido; se borra al terminar
+    status = Column(String, nullable=False, default="queued") # queued, running, succeeded, failed, cancelled
+    progress = Column(Float, nullable=False, default=0.0)
+    message = Column(String, nullable=True)
+    cancel_requested = Column(Boolean, nullable=False, default=False, server_default="0")
+    result = deferred(Column(Text, nullable=True)) # JSON del resultado
+    error = Column(Text, nullable=True)
+    worker = Column(String, nullable=True) # host:pid del worker que lo ejecuta
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_jobs_status_id", "status", "id"),
+        Index("ix_jobs_project_id", "project_id", "id"),
+    )
@@ -0,0 +1,124 @@
+# app/patterns.py
+
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+LABEL_SCHEMES = ("numeric", "row_letter")
+# Límite de taladros de una malla generada para proteger al servidor
+PATTERN_MAX_HOLES = int(os.getenv("PATTERN_MAX_HOLES", 200_000))
+
+
+def row_letters(rows: np.ndarray) -> np.ndarray:
+    """Letra de fila como en las hojas de cálculo: A..Z, AA, AB..."""
+    letters = []
+    for row in rows.tolist():
+        name = ""
+        row += 1
+        while row:
+            row, rem = divmod(row - 1, 26)
+            name = chr(ord("A") + rem) + name
+        letters.append(name)
+    return np.array(letters, dtype=object)
+
+
+def make_labels(row: np.ndarray, col: np.ndarray, scheme: str = "numeric", prefix: str = "", start: int = 1) -> np.ndarray:
+    """
+    - numeric: correlativo en el orden de generación (fila por fila), como el TOPO.
+    - row_letter: letra de la fila y número dentro de ella (A1, A2, ... B1), como los TD_*.
+    """
+    if scheme not in LABEL_SCHEMES:
+        raise ValueError(f"Esquema de etiquetas desconocido '{scheme}'. Opciones: {', '.join(LABEL_SCHEMES)}")
+    if scheme == "numeric":
+        numbers = (np.arange(len(row)) + start).astype(str).astype(object)
+    else:
+        unique_rows, row_index = np.unique(row, return_inverse=True)
+        numbers = row_letters(np.arange(len(unique_rows)))[row_index] + (col + start).astype(str).astype(object)
+    return prefix + numbers
+
+
+def points_in_polygon(x: np.ndarray, y: np.ndarray, polygon: np.ndarray) -> np.ndarray:
+    """Prueba de paridad (ray casting), vectorizada sobre los puntos y recorriendo las aristas."""
+    inside = np.zeros(len(x), dtype=bool)
+    px, py = polygon[:, 0], polygon[:, 1]
+    qx, qy = np.roll(px, -1), np.roll(py, -1)
+    for ax, ay, bx, by in zip(px.tolist(), py.tolist(), qx.tolist(), qy.tolist()):
+        if ay == by:
+            continue
+        crosses = (ay > y) != (by > y)
+        x_cross = ax + (y - ay) * (bx - ax) / (by - ay)
+        inside ^= crosses & (x < x_cross)
+    return inside
+
+
+def generate_pattern(burden: float, spacing: float, azimuth_deg: float = 0.0, stagger: float = 0.0,
+                     origin=None, rows: int = None, holes_per_row: int = None, polygon=None, z: float = 0.0,
+                     label_scheme: str = "numeric", label_prefix: str = "", label_start: int = 1) -> pd.DataFrame:
+    """
+    Genera una malla de taladros. Las filas corren en la dirección azimuth_deg
+    (grados desde el eje x) separadas por 'burden'; dentro de una fila los
+    taladros están a 'spacing'. 'stagger' desplaza las filas impares esa
+    fracción del espaciamiento (0.5 es tresbolillo).
+
+    - Con origin, rows y holes_per_row: una malla rectangular desde el origen
+      (una línea si rows = 1).
+    - Con polygon: la malla que cubre el polígono del banco, alineada a su
+      primer vértice, conservando solo los taladros interiores.
+
+    Devuelve un DataFrame con label, x, y, z, listo para ingest.bulk_load_drills.
+    """
+    if not (math.isfinite(burden) and math.isfinite(spacing)) or burden <= 0 or spacing <= 0:
+        raise ValueError("El burden y el espaciamiento deben ser positivos.")
+    angle = math.radians(azimuth_deg)
+    cos_a, sin_a = math.cos(angle), math.sin(angle)
+    offset = (stagger % 1.0) * spacing
+
+    if polygon is not None:
+        polygon = np.asarray(polygon, dtype=float)
+        if polygon.ndim != 2 or polygon.shape[0] < 3 or polygon.shape[1] != 2 or not np.isfinite(polygon).all():
+            raise ValueError("El polígono necesita al menos 3 vértices [x, y].")
+        ox, oy = polygon[0]
+        # Extensión del polígono en el sistema de la malla (u a lo largo de las filas, v entre filas)
+        u = (polygon[:, 0] - ox) * cos_a + (polygon[:, 1] - oy) * sin_a
+        v = -(polygon[:, 0] - ox) * sin_a + (polygon[:, 1] - oy) * cos_a
+        # Con un burden diminuto los índices de fila ni siquiera caben en un entero: se acota antes de redondear
+        if not float(v.max() - v.min()) / burden * float(u.max() - u.min()) / spacing <= PATTERN_MAX_HOLES * 4:
+            raise ValueError(f"La malla supera el máximo de {PATTERN_MAX_HOLES} taladros.")
+        first_row, first_col = math.floor(v.min() / burden), math.floor((u.min() - offset) / spacing)
+        n_rows = math.ceil(v.max() / burden) + 1 - first_row
+        n_cols = math.ceil(u.max() / spacing) + 1 - first_col
+    else:
+        if origin is None or not rows or not holes_per_row or rows < 1 or holes_per_row < 1:
+            raise ValueError("Indica un polígono o un origen con filas y taladros por fila.")
+        ox, oy = origin
+        first_row, first_col, n_rows, n_cols = 0, 0, rows, holes_per_row
+
+    # Se valida el tamaño antes de reservar memoria: con un burden diminuto la grilla no cabría
+    if n_rows * n_cols > PATTERN_MAX_HOLES * (4 if polygon is not None else 1):
+        raise ValueError(f"La malla supera el máximo de {PATTERN_MAX_HOLES} taladros.")
+    row_range, col_range = np.arange(first_row, first_row + n_rows), np.arange(first_col, first_col + n_cols)
+
+    row, col = np.repeat(row_range, len(col_range)), np.tile(col_range, len(row_range))
+    u = col * spacing + np.where(row % 2 != 0, offset, 0.0)
+    v = row * burden
+    x = ox + u * cos_a - v * sin_a
+    y = oy + u * sin_a + v * cos_a
+
+    if polygon is not None:
+        keep = points_in_polygon(x, y, polygon)
+        row, col, x, y = row[keep], col[keep], x[keep], y[keep]
+        if len(x) > PATTERN_MAX_HOLES:
+            raise ValueError(f"La malla supera el máximo de {PATTERN_MAX_HOLES} taladros.")
+        if len(x):
+            # Numeración dentro de cada fila desde el primer taladro interior
+            first = pd.Series(col).groupby(row).transform("min").to_numpy()
+            col = col - first
+
+    return pd.DataFrame({
+        "label": make_labels(row, col, label_scheme, label_prefix, label_start),
+        "x": np.round(x, 3),
+        "y": np.round(y, 3),
+        "z": np.full(len(x), float(z)),
+    })
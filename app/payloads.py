@@ -0,0 +1,185 @@
+# app/payloads.py
+
+import base64
+import datetime
+import json
+
+from sqlalchemy import and_, case, func, or_, select
+from sqlalchemy.orm import Session, aliased
+
+from . import models
+
+# Tipo de contenido con el que el cliente puede pedir la representación columnar
+COLUMNAR_MEDIA_TYPE = "application/vnd.blasting.columnar+json"
+# Columnas por las que se puede ordenar el listado de proyectos ('-' delante para descendente)
+SUMMARY_SORTS = ("id", "name", "created_at", "hole_count", "link_count", "initiator_count")
+
+
+def wants_columnar(format: str = None, accept: str = None) -> bool:
+    """El cliente pide columnas con ?format=columnar o con la cabecera Accept."""
+    if format:
+        return format == "columnar"
+    return bool(accept) and COLUMNAR_MEDIA_TYPE in accept
+
+
+def _bbox_filter(drill, bbox):
+    min_x, min_y, max_x, max_y = bbox
+    return [drill.x >= min_x, drill.x <= max_x, drill.y >= min_y, drill.y <= max_y]
+
+
+def columnar_project(db: Session, project: models.Project, bbox=None) -> dict:
+    """
+    Proyecto como arrays paralelos (un array por columna) en lugar de una lista
+    de objetos anidados. Se consulta solo lo necesario, sin pasar por el ORM
+    ni por Pydantic. Con bbox (min_x, min_y, max_x, max_y) solo se incluyen los
+    taladros visibles y los enlaces que tocan alguno de ellos.
+    """
+    drill = models.Drill
+    drill_query = select(drill.id, drill.label, drill.x, drill.y, drill.z, drill.tiempo, drill.is_initiator)\
+        .where(drill.project_id == project.id).order_by(drill.id)
+    if bbox:
+        drill_query = drill_query.where(*_bbox_filter(drill, bbox))
+    drill_rows = db.execute(drill_query).all()
+    ids, labels, xs, ys, zs, tiempos, initiators = (list(column) for column in zip(*drill_rows)) if drill_rows \
+        else ([], [], [], [], [], [], [])
+
+    link = models.SequenceLink
+    from_drill = aliased(models.Drill)
+    link_query = select(link.from_drill_id, link.to_drill_id, link.delay_ms)\
+        .join(from_drill, link.from_drill_id == from_drill.id)\
+        .where(from_drill.project_id == project.id).order_by(link.id)
+    if bbox:
+        visible = select(drill.id).where(drill.project_id == project.id, *_bbox_filter(drill, bbox))
+        link_query = link_query.where(or_(link.from_drill_id.in_(visible), link.to_drill_id.in_(visible)))
+    link_rows = db.execute(link_query).all()
+    link_from, link_to, link_delay = (list(column) for column in zip(*link_rows)) if link_rows else ([], [], [])
+
+    return {
+        "id": project.id,
+        "name": project.name,
+        "owner_id": project.owner_id,
+        "created_at": project.created_at.isoformat() if project.created_at else None,
+        "drills": {
+            "id": ids,
+            "label": labels,
+            "x": xs,
+            "y": ys,
+            "z": zs,
+            "tiempo": tiempos,
+            "is_initiator": [bool(flag) for flag in initiators],
+        },
+        "links": {
+            "from_drill_id": link_from,
+            "to_drill_id": link_to,
+            "delay_ms": link_delay,
+        },
+    }
+
+
+def delta_project(db: Session, project: models.Project, since_revision: int) -> dict:
+    """
+    Taladros que cambiaron después de 'since_revision', cada uno con su flecha
+    de entrada actual (o None). Los enlaces se identifican por su taladro de
+    destino, así que un enlace borrado aparece como un taladro sin flecha.
+    Si el conjunto de taladros se reemplazó después de esa revisión, el delta
+    no sirve y se pide recargar el proyecto completo.
+    """
+    base = {"id": project.id, "revision": project.revision, "since_revision": since_revision}
+    if since_revision < (project.drills_replaced_revision or 0):
+        return {**base, "full_reload": True, "drills": []}
+
+    drill, link = models.Drill, models.SequenceLink
+    rows = db.execute(
+        select(drill.id, drill.label, drill.x, drill.y, drill.z, drill.tiempo, drill.is_initiator,
+               link.from_drill_id, link.delay_ms)
+        .outerjoin(link, link.to_drill_id == drill.id)
+        .where(drill.project_id == project.id, drill.revision > since_revision)
+        .order_by(drill.id)
+    ).all()
+    return {
+        **base,
+        "full_reload": False,
+        "drills": [
+            {"id": r[0], "label": r[1], "x": r[2], "y": r[3], "z": r[4], "tiempo": r[5], "is_initiator": bool(r[6]),
+             "inbound": None if r[7] is None else {"from_drill_id": r[7], "delay_ms": r[8]}}
+            for r in rows
+        ],
+    }
+
+
+def _summary_subquery(owner_id: int):
+    """
+    Una fila por proyecto con sus agregados, en una sola consulta. Cada
+    taladro recibe como mucho una flecha, así que el LEFT JOIN con los enlaces
+    no repite taladros y los conteos no necesitan DISTINCT.
+    """
+    project, drill, link = models.Project, models.Drill, models.SequenceLink
+    return (
+        select(
+            project.id.label("id"),
+            project.name.label("name"),
+            project.created_at.label("created_at"),
+            func.count(drill.id).label("hole_count"),
+            func.count(link.id).label("link_count"),
+            func.coalesce(func.sum(case((drill.is_initiator == True, 1), else_=0)), 0).label("initiator_count"),
+            func.min(drill.tiempo).label("min_time"),
+            func.max(drill.tiempo).label("max_time"),
+        )
+        .select_from(project)
+        .outerjoin(drill, drill.project_id == project.id)
+        .outerjoin(link, link.to_drill_id == drill.id)
+        .where(project.owner_id == owner_id)
+        .group_by(project.id, project.name, project.created_at)
+        .subquery()
+    )
+
+
+def _encode_cursor(sort: str, value, last_id: int) -> str:
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([sort, value, last_id]).encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str, sort: str):
+    try:
+        cursor_sort, value, last_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError("Cursor inválido.")
+    if cursor_sort != sort:
+        raise ValueError("El cursor corresponde a otro orden; pide la primera página de nuevo.")
+    if sort.lstrip("-") == "created_at" and value is not None:
+        value = datetime.datetime.fromisoformat(value)
+    return value, last_id
+
+
+def project_summaries(db: Session, owner_id: int, sort: str = "id", limit: int = None, cursor: str = None):
+    """
+    Resumen de los proyectos del usuario (conteos de taladros, enlaces e
+    iniciadores y rango de tiempos) sin cargar ninguna fila hija en Python.
+    Paginación por cursor (keyset): el cursor guarda el valor de orden y el id
+    de la última fila, así que las páginas no se desplazan si se crean
+    proyectos mientras tanto. Devuelve (filas, cursor siguiente o None).
+    """
+    field = sort.lstrip("-")
+    if field not in SUMMARY_SORTS:
+        raise ValueError(f"Orden desconocido '{sort}'. Opciones: {', '.join(SUMMARY_SORTS)} (con '-' para descendente)")
+    descending = sort.startswith("-")
+    summary = _summary_subquery(owner_id)
+    key, row_id = summary.c[field], summary.c.id
+
+    query = select(summary).order_by(key.desc() if descending else key.asc(), row_id.desc() if descending else row_id.asc())
+    if cursor:
+        value, last_id = _decode_cursor(cursor, sort)
+        if descending:
+            query = query.where(or_(key < value, and_(key == value, row_id < last_id)))
+        else:
+            query = query.where(or_(key > value, and_(key == value, row_id > last_id)))
+    if limit:
+        query = query.limit(limit + 1)
+
+    rows = [dict(row) for row in db.execute(query).mappings()]
+    next_cursor = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(sort, rows[-1][field], rows[-1]["id"])
+    return rows, next_cursor
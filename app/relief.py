@@ -0,0 +1,113 @@
+# app/relief.py
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session, aliased
+
+from . import models
+
+# Máximo de elementos (celdas x puntos) que se evalúan a la vez al interpolar la grilla
+RELIEF_GRID_CHUNK_ELEMENTS = 4_000_000
+# Límite de celdas de una grilla para proteger al servidor
+RELIEF_GRID_MAX_CELLS = 4_000_000
+# Lado mínimo (en celdas) de los bloques de grilla que comparten la búsqueda de puntos cercanos
+RELIEF_GRID_BLOCK_CELLS = 64
+
+
+def load_links(db: Session, project_id: int, owner_id: int) -> np.ndarray:
+    """
+    Coordenadas y tiempos de origen y destino de todos los enlaces del
+    proyecto en una sola consulta, sin cargar objetos del ORM. Solo devuelve
+    enlaces si el proyecto pertenece a owner_id.
+    """
+    link = models.SequenceLink
+    src, dst = aliased(models.Drill), aliased(models.Drill)
+    rows = db.execute(
+        select(src.x, src.y, src.z, src.tiempo, dst.x, dst.y, dst.z, dst.tiempo)
+        .select_from(link)
+        .join(src, link.from_drill_id == src.id)
+        .join(dst, link.to_drill_id == dst.id)
+        .join(models.Project, src.project_id == models.Project.id)
+        .where(models.Project.id == project_id, models.Project.owner_id == owner_id)
+        .order_by(link.id)
+    ).all()
+    return np.array(rows, dtype=float).reshape(-1, 8)
+
+
+def relief_points(links: np.ndarray, include_z: bool = False):
+    """
+    Velocidad de alivio de todos los enlaces a la vez. 'links' tiene una fila
+    por enlace con las columnas: x, y, z, tiempo del origen y x, y, z, tiempo
+    del destino. Se omiten los enlaces con retardo cero o negativo.
+    Devuelve (mid_x, mid_y, velocidad) como arrays.
+    """
+    links = np.asarray(links, dtype=float).reshape(-1, 8)
+    fx, fy, fz, ft, tx, ty, tz, tt = links.T
+    delay = tt - ft
+    keep = delay > 0
+    dx, dy = tx[keep] - fx[keep], ty[keep] - fy[keep]
+    if include_z:
+        distance = np.sqrt(dx ** 2 + dy ** 2 + np.nan_to_num(tz[keep] - fz[keep]) ** 2)
+    else:
+        distance = np.sqrt(dx ** 2 + dy ** 2)
+    velocity = distance / delay[keep]
+    return (fx[keep] + tx[keep]) / 2, (fy[keep] + ty[keep]) / 2, velocity
+
+
+def relief_grid(x, y, values, resolution: float, power: float = 2.0, max_distance: float = None, on_progress=None):
+    """
+    Interpola la velocidad de alivio sobre una grilla regular por distancia
+    inversa (IDW). La grilla cubre la extensión de los puntos con celdas de
+    'resolution' metros y se calcula por bloques de celdas, de modo que la
+    memoria queda acotada por RELIEF_GRID_CHUNK_ELEMENTS aunque una sola fila
+    de la grilla sea muy ancha. Con max_distance cada celda solo usa los
+    puntos a menos de esa distancia (y queda en NaN si no hay ninguno): la
+    grilla se recorre por bloques y cada bloque solo mira los puntos cercanos.
+    on_progress(fracción) se llama tras cada trozo de celdas (puede lanzar
+    una excepción para interrumpir el cálculo).
+    Devuelve (min_x, min_y, nx, ny, matriz ny x nx).
+    """
+    x, y, values = (np.asarray(a, dtype=float) for a in (x, y, values))
+    min_x, min_y = float(x.min()), float(y.min())
+    nx = int(np.floor((x.max() - min_x) / resolution)) + 1
+    ny = int(np.floor((y.max() - min_y) / resolution)) + 1
+    if nx * ny > RELIEF_GRID_MAX_CELLS:
+        raise ValueError(f"La grilla tendría {nx * ny} celdas (máximo {RELIEF_GRID_MAX_CELLS}); aumenta la resolución.")
+
+    grid = np.full(ny * nx, np.nan)
+    if max_distance is None:
+        blocks = [(0, ny, 0, nx)]
+    else:
+        side = max(RELIEF_GRID_BLOCK_CELLS, int(max_distance / resolution))
+        blocks = [(r, min(ny, r + side), c, min(nx, c + side)) for r in range(0, ny, side) for c in range(0, nx, side)]
+
+    done = 0
+    for row_lo, row_hi, col_lo, col_hi in blocks:
+        px, py, pv = x, y, values
+        if max_distance is not None:
+            near = (x >= min_x + col_lo * resolution - max_distance) & (x <= min_x + (col_hi - 1) * resolution + max_distance) \
+                & (y >= min_y + row_lo * resolution - max_distance) & (y <= min_y + (row_hi - 1) * resolution + max_distance)
+            if not near.any():
+                done += (row_hi - row_lo) * (col_hi - col_lo)
+                continue
+            px, py, pv = x[near], y[near], values[near]
+        width = col_hi - col_lo
+        cells = (row_hi - row_lo) * width
+        step = max(1, RELIEF_GRID_CHUNK_ELEMENTS // len(px))
+        for start in range(0, cells, step):
+            index = np.arange(start, min(cells, start + step))
+            row, col = row_lo + index // width, col_lo + index % width
+            dist2 = (min_x + col[:, None] * resolution - px) ** 2 + (min_y + row[:, None] * resolution - py) ** 2
+            exact = dist2 == 0
+            weights = 1.0 / (np.where(exact, 1.0, dist2) if power == 2 else np.where(exact, 1.0, dist2) ** (power / 2))
+            if max_distance is not None:
+                weights[dist2 > max_distance ** 2] = 0.0
+            hit = exact.any(axis=1)
+            weights[hit] = exact[hit]
+            total = weights.sum(axis=1)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                grid[row * nx + col] = np.where(total > 0, weights @ pv / total, np.nan)
+            done += len(index)
+            if on_progress is not None:
+                on_progress(done / (nx * ny))
+    return min_x, min_y, nx, ny, grid.reshape(ny, nx)
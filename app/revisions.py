@@ -0,0 +1,31 @@
+# app/revisions.py
+
+import hashlib
+
+from sqlalchemy.orm import Session
+
+from . import models
+
+
+def bump_revision(db: Session, project_id: int) -> int:
+    """
+    Incrementa la revisión del proyecto dentro de la transacción actual y
+    devuelve la nueva. El UPDATE bloquea la fila hasta el commit, así que dos
+    mutaciones concurrentes nunca comparten revisión.
+    """
+    db.query(models.Project).filter(models.Project.id == project_id)\
+        .update({models.Project.revision: models.Project.revision + 1}, synchronize_session=False)
+    return db.query(models.Project.revision).filter(models.Project.id == project_id).scalar()
+
+
+def revision_etag(project_id: int, revision: int, variant: str = "") -> str:
+    """ETag débil de un recurso derivado del proyecto; 'variant' distingue parámetros de la consulta."""
+    digest = hashlib.sha1(variant.encode()).hexdigest()[:10] if variant else "0"
+    return f'W/"p{project_id}-r{revision}-{digest}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
@@ -1,8 +1,10 @@
 # app/schemas.py (VERSIÓN CON REBUILD)
 
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 import datetime
-from typing import List, Optional
+from typing import List, Literal, Optional
+from .vibration import DEFAULT_SITE_K, DEFAULT_SITE_BETA
+from .patterns import PATTERN_MAX_HOLES
 
 # --- Schemas Base (sin relaciones) ---
 class SequenceLinkBase(BaseModel):
@@ -33,6 +35,7 @@ class UserCreate(UserBase):
 # --- Schemas Completos (con relaciones) ---
 class SequenceLink(SequenceLinkBase):
     id: int
+    delay_ms: Optional[int] = None
     class Config:
         from_attributes = True
 
@@ -47,10 +50,21 @@ class Project(ProjectBase):
     id: int
     owner_id: int
     created_at: datetime.datetime
+    revision: int = 0 # Para pedir luego solo los cambios (since_revision)
     drills: List[Drill] = []
     class Config:
         from_attributes = True
 
+class ProjectSummary(ProjectBase):
+    """Fila del listado de proyectos: solo agregados, sin taladros."""
+    id: int
+    created_at: Optional[datetime.datetime] = None
+    hole_count: int
+    link_count: int
+    initiator_count: int
+    min_time: Optional[int] = None # None si el proyecto no tiene taladros
+    max_time: Optional[int] = None
+
 class User(UserBase):
     id: int
     projects: List[Project] = []
@@ -74,6 +88,78 @@ class TimingApplication(BaseModel):
     delay_ms: int
     mode: str
 
+class InitiatorAssignment(BaseModel):
+    drill_id: int
+    delay_ms: int # Negativo para quitar el iniciador, como en set-initiator
+
+class SequenceLinkCreate(SequenceLinkBase):
+    delay_ms: int
+
+class SequenceBatch(BaseModel):
+    initiators: List[InitiatorAssignment] = []
+    links: List[SequenceLinkCreate] = []
+
+class DrillTime(BaseModel):
+    id: int
+    tiempo: int
+
+class SequenceBatchResult(BaseModel):
+    initiators: int
+    links: int
+    drills: List[DrillTime]
+
+class AutoSequenceRequest(BaseModel):
+    initiators: List[InitiatorAssignment]
+    pattern: str = "row" # row | echelon | v
+    inter_hole_ms: int
+    inter_row_ms: int
+    row_azimuth_deg: Optional[float] = None # Si no se indica, se deduce de las coordenadas
+    dry_run: bool = False
+
+class AutoSequenceResult(BaseModel):
+    pattern: str
+    row_azimuth_deg: float
+    spacing: float
+    burden: float
+    rows: int
+    saved: bool
+    max_link_m: float = 0.0
+    max_simultaneous_holes: int = 0
+    unsequenced_drill_ids: List[int] = [] # Bloques a los que no llega ningún iniciador sin un enlace demasiado largo
+    warnings: List[str] = []
+    links: List[SequenceLinkCreate]
+    drills: List[DrillTime]
+
+class InboundLink(BaseModel):
+    from_drill_id: int
+    delay_ms: Optional[int] = None
+
+class DrillDelta(BaseModel):
+    id: int
+    label: str
+    x: float
+    y: float
+    z: Optional[float] = None
+    tiempo: int
+    is_initiator: bool
+    inbound: Optional[InboundLink] = None
+
+class HistoryEntry(BaseModel):
+    id: int
+    parent_id: Optional[int] = None
+    depth: int
+    op: str
+    created_at: Optional[datetime.datetime] = None
+    has_snapshot: bool
+    is_head: bool
+
+class HistoryStepResult(BaseModel):
+    entry_id: Optional[int] = None # Operación deshecha, rehecha o restaurada
+    op: Optional[str] = None
+    head: Optional[int] = None # Operación que refleja el estado actual
+    revision: int
+    drills: List[DrillDelta] # Solo los taladros que cambiaron
+
 class TimingAnalysisPoint(BaseModel):
     time: float
     energy: float
@@ -89,6 +175,42 @@ class ReliefPoint(BaseModel):
 class ReliefAnalysisResponse(BaseModel):
     data: List[ReliefPoint]
 
+class ReliefGridResponse(BaseModel):
+    min_x: float # Centro de la primera celda
+    min_y: float
+    resolution: float
+    nx: int
+    ny: int
+    values: List[List[Optional[float]]] # ny filas de nx valores; None fuera del alcance de los puntos
+
+class VibrationMapResponse(BaseModel):
+    min_x: float # Centros de las celdas extremas
+    min_y: float
+    max_x: float
+    max_y: float
+    nx: int
+    ny: int
+    window_ms: float
+    max_charge_per_window: float
+    max_ppv: float
+    ppv_limit: Optional[float] = None
+    cells_over_limit: Optional[int] = None
+    values: List[List[float]] # ny filas de nx valores de PPV (mm/s)
+
+class ChargeWindow(BaseModel):
+    start: float # La ventana es [start, end)
+    end: float
+    holes: int
+    charge: float
+
+class ChargeWindowResponse(BaseModel):
+    window_ms: float
+    max_holes: int
+    max_charge: float
+    worst_window: Optional[ChargeWindow] = None
+    offending_drill_ids: List[int] # Taladros de la peor ventana
+    data: List[ChargeWindow] # Una ventana por cada tiempo de disparo distinto
+
 class HistogramBin(BaseModel):
     time: int
     frequency: int
@@ -97,6 +219,103 @@ class HistogramBin(BaseModel):
 class TimingHistogramResponse(BaseModel):
     data: List[HistogramBin]
 
+class NearbyDrill(BaseModel):
+    id: int
+    label: str
+    x: float
+    y: float
+    distance: Optional[float] = None
+
+class NearbyDrillsResponse(BaseModel):
+    data: List[NearbyDrill]
+
+class AnalysisCacheStats(BaseModel):
+    hits: int
+    shared_hits: int
+    misses: int
+    hit_ratio: float
+    evictions: int
+    entries: int
+    bytes: int
+    max_entries: int
+    max_bytes: int
+    shared_backend: Optional[str] = None
+
+class IngestReport(BaseModel):
+    rows: int
+    seconds: float
+    rows_per_second: float
+
+class PatternRequest(BaseModel):
+    burden: float = Field(gt=0, allow_inf_nan=False) # Distancia entre filas (m)
+    spacing: float = Field(gt=0, allow_inf_nan=False) # Distancia entre taladros de una fila (m)
+    azimuth_deg: float = 0.0 # Dirección de las filas, en grados desde el eje x
+    stagger: float = 0.0 # Desplazamiento de las filas impares, en fracción del espaciamiento (0.5 = tresbolillo)
+    polygon: Optional[List[List[float]]] = None # Vértices [x, y] del banco
+    origin: Optional[List[float]] = None # [x, y] del primer taladro, si no hay polígono
+    rows: Optional[int] = Field(None, ge=1, le=PATTERN_MAX_HOLES)
+    holes_per_row: Optional[int] = Field(None, ge=1, le=PATTERN_MAX_HOLES)
+    z: float = 0.0
+    label_scheme: str = "numeric" # numeric | row_letter
+    label_prefix: str = ""
+    label_start: int = 1
+    replace: bool = True # False agrega la malla a los taladros existentes
+
+class PatternResult(IngestReport):
+    revision: int
+
+# --- Trabajos en segundo plano ---
+# Parámetros de los análisis pedidos como trabajo; mismos límites que en los endpoints GET
+class TimingAnalysisParams(BaseModel):
+    samples: int = Field(500, ge=2, le=200000)
+    std_dev: float = Field(5.0, gt=0)
+    charge_per_hole: float = Field(1.0, gt=0)
+    resolution_ms: Optional[float] = Field(None, gt=0) # el eje resultante también se limita a 200000 puntos
+    method: Literal["exact", "direct", "fft"] = "exact" # timing.TIMING_METHODS
+
+class ReliefAnalysisParams(BaseModel):
+    include_z: bool = False
+
+class ReliefGridParams(BaseModel):
+    resolution: float = Field(1.0, gt=0)
+    power: float = Field(2.0, gt=0)
+    max_distance: Optional[float] = Field(None, gt=0)
+    include_z: bool = False
+
+class VibrationMapParams(BaseModel):
+    charge_per_hole: float = Field(..., gt=0)
+    k: float = Field(DEFAULT_SITE_K, gt=0)
+    beta: float = Field(DEFAULT_SITE_BETA, gt=0)
+    window_ms: float = Field(8.0, gt=0)
+    nx: int = Field(200, ge=2, le=2000)
+    ny: int = Field(200, ge=2, le=2000)
+    margin: float = Field(100.0, ge=0)
+    min_distance: float = Field(1.0, gt=0)
+    ppv_limit: Optional[float] = Field(None, gt=0)
+
+class ChargeWindowParams(BaseModel):
+    window_ms: float = Field(8.0, gt=0)
+    charge_per_hole: float = Field(1.0, gt=0)
+
+class HistogramParams(BaseModel):
+    pass
+
+class Job(BaseModel):
+    id: int
+    project_id: int
+    kind: str
+    status: str # queued, running, succeeded, failed, cancelled
+    progress: float
+    message: Optional[str] = None
+    error: Optional[str] = None
+    cancel_requested: bool
+    created_at: Optional[datetime.datetime] = None
+    started_at: Optional[datetime.datetime] = None
+    finished_at: Optional[datetime.datetime] = None
+
+    class Config:
+        from_attributes = True
+
 # --- ¡LÍNEA CLAVE! ---
 # Esto le dice a Pydantic que resuelva las referencias circulares
 Drill.model_rebuild()
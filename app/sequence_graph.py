@@ -0,0 +1,160 @@
+# app/sequence_graph.py
+
+from collections import defaultdict, deque
+
+from sqlalchemy import bindparam, text, update
+from sqlalchemy.orm import Session
+
+from . import models
+
+
+class SequenceCycleError(ValueError):
+    """El enlace propuesto cerraría un ciclo en la secuencia."""
+
+
+# Descendientes de un conjunto de taladros, siguiendo las flechas de salida.
+# UNION (no UNION ALL) para que la recursión termine aunque existan ciclos heredados.
+_SUBTREE_SQL = text("""
+    WITH RECURSIVE subtree(drill_id, parent_id, delay_ms) AS (
+        SELECT to_drill_id, from_drill_id, delay_ms FROM sequence_links WHERE from_drill_id IN :roots
+        UNION
+        SELECT l.to_drill_id, l.from_drill_id, l.delay_ms
+        FROM sequence_links l JOIN subtree s ON l.from_drill_id = s.drill_id
+    )
+    SELECT s.drill_id, s.parent_id, s.delay_ms, d.tiempo, d.is_initiator
+    FROM subtree s JOIN drills d ON d.id = s.drill_id
+""").bindparams(bindparam("roots", expanding=True))
+
+# Cadena de ancestros de un taladro (cada taladro recibe a lo sumo una flecha)
+_ANCESTORS_SQL = text("""
+    WITH RECURSIVE ancestors(drill_id) AS (
+        SELECT from_drill_id FROM sequence_links WHERE to_drill_id = :drill_id
+        UNION
+        SELECT l.from_drill_id FROM sequence_links l JOIN ancestors a ON l.to_drill_id = a.drill_id
+    )
+    SELECT drill_id FROM ancestors
+""")
+
+# Estado actual de un conjunto de taladros junto con su flecha de entrada
+_ROOTS_SQL = text("""
+    SELECT d.id, d.tiempo, d.is_initiator, l.delay_ms, p.tiempo
+    FROM drills d
+    LEFT JOIN sequence_links l ON l.to_drill_id = d.id
+    LEFT JOIN drills p ON p.id = l.from_drill_id
+    WHERE d.id IN :ids
+""").bindparams(bindparam("ids", expanding=True))
+
+# Rellena el retardo de los enlaces creados antes de que se guardara por enlace
+_BACKFILL_DELAYS_SQL = text("""
+    UPDATE sequence_links SET delay_ms = (
+        (SELECT t.tiempo FROM drills t WHERE t.id = sequence_links.to_drill_id) -
+        (SELECT f.tiempo FROM drills f WHERE f.id = sequence_links.from_drill_id)
+    )
+    WHERE delay_ms IS NULL
+""")
+
+_BULK_TIME_UPDATE = (
+    update(models.Drill.__table__)
+    .where(models.Drill.__table__.c.id == bindparam("b_id"))
+    .values(tiempo=bindparam("b_tiempo"), revision=bindparam("b_revision"))
+)
+
+_TOUCH_DRILLS = (
+    update(models.Drill.__table__)
+    .where(models.Drill.__table__.c.id.in_(bindparam("ids", expanding=True)))
+    .values(revision=bindparam("revision"))
+)
+
+
+def backfill_link_delays(db: Session):
+    db.execute(_BACKFILL_DELAYS_SQL)
+    db.commit()
+
+
+def ancestors(db: Session, drill_id: int) -> set:
+    return {row[0] for row in db.execute(_ANCESTORS_SQL, {"drill_id": drill_id})}
+
+
+def check_new_link(db: Session, from_id: int, to_id: int):
+    """Lanza SequenceCycleError si el enlace from -> to cerraría un ciclo."""
+    if from_id == to_id or to_id in ancestors(db, from_id):
+        raise SequenceCycleError(f"El enlace {from_id} -> {to_id} crearía un ciclo en la secuencia.")
+
+
+def resolve_time(is_initiator: bool, tiempo: int, parent_time=None, delay_ms=None) -> int:
+    """
+    Tiempo de un taladro según su estado: los iniciadores conservan su retardo,
+    los que reciben una flecha toman el de su padre más el retardo del enlace
+    y los huérfanos vuelven a 0.
+    """
+    if is_initiator:
+        return tiempo
+    if parent_time is not None:
+        return parent_time + (delay_ms or 0)
+    return 0
+
+
+def recompute(db: Session, drill_ids, revision: int) -> dict:
+    """
+    Recalcula el tiempo de los taladros indicados y de todos sus descendientes
+    en orden topológico, y persiste los cambios con un único UPDATE masivo.
+    Los taladros indicados y los que cambian quedan marcados con 'revision'.
+    Solo toca el subárbol afectado; no hace commit (el llamador debe haber
+    hecho flush de sus cambios). Devuelve {drill_id: tiempo} de lo que cambió.
+    """
+    drill_ids = list(drill_ids)
+    if not drill_ids:
+        return {}
+    db.execute(_TOUCH_DRILLS, {"ids": drill_ids, "revision": revision})
+
+    times = {}
+    changed = {}
+    for drill_id, tiempo, is_initiator, delay_ms, parent_time in db.execute(_ROOTS_SQL, {"ids": drill_ids}):
+        times[drill_id] = resolve_time(is_initiator, tiempo, parent_time, delay_ms)
+        if times[drill_id] != tiempo:
+            changed[drill_id] = times[drill_id]
+
+    children = defaultdict(list)
+    current = {}
+    for drill_id, parent_id, delay_ms, tiempo, is_initiator in db.execute(_SUBTREE_SQL, {"roots": list(times)}):
+        children[parent_id].append((drill_id, delay_ms or 0, is_initiator))
+        current[drill_id] = tiempo
+
+    # Un taladro pedido que además desciende de otro pedido se resuelve al recorrer el subárbol
+    queue = deque(drill_id for drill_id in times if drill_id not in current)
+    times = {drill_id: times[drill_id] for drill_id in queue}
+    while queue:
+        parent_id = queue.popleft()
+        for drill_id, delay_ms, is_initiator in children.pop(parent_id, ()):
+            if drill_id in times:
+                raise SequenceCycleError(f"Se detectó un ciclo en la secuencia en el taladro {drill_id}.")
+            times[drill_id] = current[drill_id] if is_initiator else times[parent_id] + delay_ms
+            if times[drill_id] != current[drill_id]:
+                changed[drill_id] = times[drill_id]
+            else:
+                changed.pop(drill_id, None)
+            queue.append(drill_id)
+
+    if children:
+        # Nodos alcanzables que nunca se visitaron: solo ocurre si hay un ciclo
+        raise SequenceCycleError("Se detectó un ciclo en la secuencia.")
+
+    if changed:
+        db.execute(_BULK_TIME_UPDATE, [{"b_id": k, "b_tiempo": v, "b_revision": revision} for k, v in changed.items()])
+    return changed
+
+
+def find_cycle(parents: dict):
+    """
+    Busca un ciclo en un mapa {to_id: from_id} (cada taladro tiene a lo sumo
+    un padre). Devuelve un taladro del ciclo o None. O(n) en total.
+    """
+    state = {}
+    for start in parents:
+        node = start
+        while node is not None and node not in state:
+            state[node] = start
+            node = parents.get(node)
+        if node is not None and state[node] == start:
+            return node
+    return None
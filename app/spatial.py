@@ -0,0 +1,167 @@
+# app/spatial.py
+
+import math
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from . import models
+
+# Número máximo de proyectos con índice espacial en memoria (LRU)
+SPATIAL_INDEX_CACHE_SIZE = int(os.getenv("SPATIAL_INDEX_CACHE_SIZE", 32))
+
+# Taladros por celda que se buscan al elegir el tamaño de la grilla
+_POINTS_PER_CELL = 2.0
+
+
+class DrillGrid:
+    """
+    Índice espacial de grilla uniforme sobre las coordenadas x/y de los
+    taladros de un proyecto. Los taladros se ordenan por celda, de modo que
+    cada celda es un rango contiguo que se encuentra con una búsqueda binaria.
+    """
+
+    def __init__(self, ids, labels, x, y):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.labels = np.asarray(labels, dtype=object)
+        self.xy = np.column_stack([np.asarray(x, dtype=float), np.asarray(y, dtype=float)]) if len(self.ids) else np.empty((0, 2))
+        if not len(self.ids):
+            self.origin, self.cell_size, self.shape = np.zeros(2), 1.0, (1, 1)
+            self.order, self.sorted_keys = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+            return
+
+        lo, hi = self.xy.min(axis=0), self.xy.max(axis=0)
+        extent = np.maximum(hi - lo, 1e-9)
+        area = extent[0] * extent[1]
+        self.cell_size = max(math.sqrt(area * _POINTS_PER_CELL / len(self.ids)), float(extent.max()) / 4096, 1e-6)
+        self.origin = lo
+        self.shape = tuple((extent // self.cell_size).astype(int) + 1)
+
+        keys = self._keys(*self._cells(self.xy).T)
+        self.order = np.argsort(keys, kind="stable")
+        self.sorted_keys = keys[self.order]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _cells(self, xy):
+        cells = np.floor((np.atleast_2d(xy) - self.origin) / self.cell_size).astype(np.int64)
+        return np.clip(cells, 0, np.array(self.shape) - 1)
+
+    def _keys(self, cx, cy):
+        return cx * self.shape[1] + cy
+
+    def _candidates(self, cx0, cy0, cx1, cy1) -> np.ndarray:
+        """Índices de los taladros en el rectángulo de celdas [cx0..cx1] x [cy0..cy1]."""
+        cx0, cy0 = max(cx0, 0), max(cy0, 0)
+        cx1, cy1 = min(cx1, self.shape[0] - 1), min(cy1, self.shape[1] - 1)
+        if cx0 > cx1 or cy0 > cy1:
+            return np.empty(0, dtype=np.int64)
+        # Cada columna de celdas es un rango contiguo de claves
+        columns = np.arange(cx0, cx1 + 1)
+        starts = np.searchsorted(self.sorted_keys, self._keys(columns, cy0), side="left")
+        ends = np.searchsorted(self.sorted_keys, self._keys(columns, cy1), side="right")
+        if not len(starts):
+            return np.empty(0, dtype=np.int64)
+        return self.order[np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)])]
+
+    def _result(self, idx, dist=None):
+        return [
+            {"id": int(self.ids[i]), "label": self.labels[i], "x": float(self.xy[i, 0]), "y": float(self.xy[i, 1]),
+             "distance": None if dist is None else float(d)}
+            for i, d in zip(idx, dist if dist is not None else [None] * len(idx))
+        ]
+
+    def nearest(self, x: float, y: float, k: int = 1, exclude_id: int = None):
+        """Los k taladros más cercanos a (x, y), ordenados por distancia."""
+        if not len(self):
+            return []
+        k = min(k, len(self) - (1 if exclude_id is not None else 0))
+        if k <= 0:
+            return []
+        point = np.array([x, y], dtype=float)
+        cx, cy = self._cells(point)[0]
+        ring = 0
+        max_ring = max(self.shape)
+        while True:
+            idx = self._candidates(cx - ring, cy - ring, cx + ring, cy + ring)
+            if exclude_id is not None:
+                idx = idx[self.ids[idx] != exclude_id]
+            if len(idx) >= k or ring >= max_ring:
+                dist = np.hypot(*(self.xy[idx] - point).T)
+                kth = np.partition(dist, k - 1)[k - 1]
+                # Solo es exacto si el anillo cubre el círculo de radio kth
+                needed = int(math.ceil(kth / self.cell_size))
+                if needed <= ring or ring >= max_ring:
+                    best = np.argsort(dist, kind="stable")[:k]
+                    return self._result(idx[best], dist[best])
+                ring = needed
+            else:
+                ring = ring * 2 + 1
+
+    def within(self, x: float, y: float, radius: float):
+        """Taladros a distancia <= radius de (x, y), ordenados por distancia."""
+        if not len(self):
+            return []
+        point = np.array([x, y], dtype=float)
+        (cx0, cy0), (cx1, cy1) = self._cells(point - radius)[0], self._cells(point + radius)[0]
+        idx = self._candidates(cx0, cy0, cx1, cy1)
+        dist = np.hypot(*(self.xy[idx] - point).T)
+        keep = dist <= radius
+        idx, dist = idx[keep], dist[keep]
+        best = np.argsort(dist, kind="stable")
+        return self._result(idx[best], dist[best])
+
+    def in_box(self, min_x: float, min_y: float, max_x: float, max_y: float):
+        """Taladros dentro del rectángulo [min_x, max_x] x [min_y, max_y]."""
+        if not len(self) or min_x > max_x or min_y > max_y:
+            return []
+        (cx0, cy0), (cx1, cy1) = self._cells(np.array([min_x, min_y]))[0], self._cells(np.array([max_x, max_y]))[0]
+        idx = np.sort(self._candidates(cx0, cy0, cx1, cy1))
+        px, py = self.xy[idx].T
+        keep = (px >= min_x) & (px <= max_x) & (py >= min_y) & (py <= max_y)
+        return self._result(idx[keep])
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _signature(db: Session, project_id: int):
+    """
+    Revisión de las posiciones del proyecto, para detectar índices obsoletos
+    con una sola lectura por clave primaria (también si otro proceso cargó
+    taladros). Las ediciones de secuencia no la cambian.
+    """
+    return db.query(models.Project.positions_revision).filter(models.Project.id == project_id).scalar()
+
+
+def get_index(db: Session, project_id: int) -> DrillGrid:
+    """Devuelve el índice del proyecto, construyéndolo solo si no existe o quedó obsoleto."""
+    signature = _signature(db, project_id)
+    with _cache_lock:
+        cached = _cache.get(project_id)
+        if cached and cached[0] == signature:
+            _cache.move_to_end(project_id)
+            return cached[1]
+
+    rows = db.query(models.Drill.id, models.Drill.label, models.Drill.x, models.Drill.y)\
+        .filter(models.Drill.project_id == project_id).all()
+    ids, labels, xs, ys = zip(*rows) if rows else ((), (), (), ())
+    grid = DrillGrid(ids, labels, xs, ys)
+
+    with _cache_lock:
+        _cache[project_id] = (signature, grid)
+        _cache.move_to_end(project_id)
+        while len(_cache) > SPATIAL_INDEX_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return grid
+
+
+def invalidate(project_id: int):
+    """Descarta el índice del proyecto; se reconstruye en la próxima consulta."""
+    with _cache_lock:
+        _cache.pop(project_id, None)
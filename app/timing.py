@@ -0,0 +1,170 @@
+# app/timing.py
+
+import math
+
+import numpy as np
+
+TIMING_METHODS = ("exact", "direct", "fft")
+
+# Máximo de puntos del eje de tiempo, se pidan con 'samples' o salgan de resolution_ms
+MAX_SAMPLES = 200_000
+
+# Filas de la matriz de núcleo que se evalúan a la vez en el método exacto
+_EXACT_BLOCK = 256
+
+
+def axis_start(min_time: float = 0.0, padding_ms: float = 50.0) -> float:
+    """
+    Inicio del eje de tiempo: 0, salvo que haya tiempos negativos (enlaces
+    con retardo negativo); entonces se adelanta con el mismo margen del final.
+    """
+    return 0.0 if min_time >= 0 else min_time - padding_ms
+
+
+def sample_count(max_time: float, samples: int = 500, padding_ms: float = 50.0, resolution_ms: float = None,
+                 min_time: float = 0.0) -> int:
+    """
+    Número de puntos del eje de tiempo. Con resolution_ms crece con la
+    duración de la voladura; si pasa de MAX_SAMPLES lanza ValueError antes
+    de reservar memoria.
+    """
+    if not resolution_ms:
+        return samples
+    steps = (max_time + padding_ms - axis_start(min_time, padding_ms)) / resolution_ms
+    if not steps <= MAX_SAMPLES - 1:
+        raise ValueError(f"Con resolution_ms={resolution_ms} el eje tendría más de {MAX_SAMPLES} puntos; aumenta la resolución.")
+    return max(2, int(math.ceil(steps)) + 1)
+
+
+def time_axis(max_time: float, samples: int = 500, padding_ms: float = 50.0, resolution_ms: float = None,
+              min_time: float = 0.0) -> np.ndarray:
+    """
+    Eje de tiempo de la curva de energía. Por defecto son 'samples' puntos
+    entre axis_start (0 si no hay tiempos negativos) y max_time + padding_ms;
+    con resolution_ms el número de puntos crece con la duración de la
+    voladura (ver sample_count).
+    """
+    num = sample_count(max_time, samples, padding_ms, resolution_ms, min_time)
+    return np.linspace(axis_start(min_time, padding_ms), max_time + padding_ms, num=num)
+
+
+def _histogram(times: np.ndarray, weights: np.ndarray):
+    """Agrupa los tiempos de disparo (enteros, en ms) y suma sus pesos."""
+    unique_times, inverse = np.unique(times, return_inverse=True)
+    return unique_times.astype(float), np.bincount(inverse, weights=weights)
+
+
+def _linear_binning(times: np.ndarray, weights: np.ndarray, axis: np.ndarray) -> np.ndarray:
+    """
+    Reparte el peso de cada tiempo entre las dos muestras vecinas del eje.
+    Las posiciones se miden desde el inicio del eje, que puede ser negativo.
+    """
+    step = axis[1] - axis[0]
+    pos = (times - axis[0]) / step
+    left = np.clip(np.floor(pos).astype(np.int64), 0, len(axis) - 1)
+    frac = np.clip(pos - left, 0.0, 1.0)
+    right = np.minimum(left + 1, len(axis) - 1)
+    hist = np.bincount(left, weights=weights * (1.0 - frac), minlength=len(axis))
+    hist += np.bincount(right, weights=weights * frac, minlength=len(axis))
+    return hist
+
+
+def _fft_convolve(signal: np.ndarray, kernel: np.ndarray) -> np.ndarray:
+    n = len(signal) + len(kernel) - 1
+    size = 1 << (n - 1).bit_length()
+    full = np.fft.irfft(np.fft.rfft(signal, size) * np.fft.rfft(kernel, size), size)[:n]
+    return full
+
+
+def energy_curve(times, std_dev: float = 5.0, samples: int = 500, padding_ms: float = 50.0,
+                 weights=None, method: str = "exact", resolution_ms: float = None, truncate: float = 8.0,
+                 on_progress=None):
+    """
+    Curva de energía: suma de una gaussiana por taladro centrada en su tiempo.
+
+    - exact: agrupa los tiempos en un histograma y evalúa la convolución en
+      cada punto del eje (mismo resultado que sumar taladro por taladro).
+    - direct / fft: bina los tiempos sobre el propio eje y lo convoluciona una
+      sola vez con el núcleo muestreado, truncado a 'truncate' desviaciones.
+
+    on_progress(fracción) se llama tras cada bloque del método exacto, el
+    único que recorre el eje por partes.
+
+    Devuelve (eje, energía) como arrays de NumPy.
+    """
+    if method not in TIMING_METHODS:
+        raise ValueError(f"Método desconocido '{method}'. Opciones: {', '.join(TIMING_METHODS)}")
+
+    times = np.asarray(times, dtype=float)
+    weights = np.ones_like(times) if weights is None else np.broadcast_to(np.asarray(weights, dtype=float), times.shape)
+    axis = time_axis(times.max() if times.size else 0.0, samples, padding_ms, resolution_ms,
+                     min_time=times.min() if times.size else 0.0)
+    if times.size == 0:
+        return axis, np.zeros_like(axis)
+
+    if method == "exact":
+        centers, hist = _histogram(times, weights)
+        energy = np.empty_like(axis)
+        for start in range(0, len(axis), _EXACT_BLOCK):
+            block = axis[start:start + _EXACT_BLOCK, None]
+            energy[start:start + _EXACT_BLOCK] = np.exp(-0.5 * ((block - centers) / std_dev) ** 2) @ hist
+            if on_progress is not None:
+                on_progress(min(start + _EXACT_BLOCK, len(axis)) / len(axis))
+        return axis, energy
+
+    step = axis[1] - axis[0]
+    half_width = min(len(axis) - 1, int(math.ceil(truncate * std_dev / step)))
+    offsets = np.arange(-half_width, half_width + 1) * step
+    kernel = np.exp(-0.5 * (offsets / std_dev) ** 2)
+    hist = _linear_binning(times, weights, axis)
+    full = np.convolve(hist, kernel) if method == "direct" else _fft_convolve(hist, kernel)
+    return axis, full[half_width:half_width + len(axis)]
+
+
+# --- Ventanas de Tiempo ---
+
+def sliding_windows(times, weights, window_ms: float):
+    """
+    Ventanas [t, t + window_ms) que empiezan en cada tiempo de disparo
+    distinto. Ordena los tiempos una sola vez y ubica el final de cada ventana
+    con búsqueda binaria (O(n log n)); las sumas salen de una suma acumulada.
+    Devuelve (orden de los taladros, inicio de cada ventana, posiciones
+    [lo, hi) de la ventana en el orden, suma de pesos, número de taladros).
+    """
+    times = np.asarray(times, dtype=float)
+    weights = np.broadcast_to(np.asarray(weights, dtype=float), times.shape)
+    order = np.argsort(times, kind="stable")
+    sorted_times = times[order]
+    starts = np.unique(sorted_times)
+    lo = np.searchsorted(sorted_times, starts, side="left")
+    hi = np.searchsorted(sorted_times, starts + window_ms, side="left")
+    cumulative = np.concatenate([[0.0], np.cumsum(weights[order])])
+    return order, starts, lo, hi, cumulative[hi] - cumulative[lo], hi - lo
+
+
+def _range_max(values: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    """Máximo de values[lo:hi] para cada par (hi > lo) con una tabla dispersa."""
+    table = [values]
+    while (1 << len(table)) <= len(values):
+        prev, half = table[-1], 1 << (len(table) - 1)
+        table.append(np.maximum(prev[:-half], prev[half:]))
+    level = np.floor(np.log2(np.maximum(hi - lo, 1))).astype(np.int64)
+    result = np.empty(len(lo))
+    for k in np.unique(level).tolist():
+        mask = level == k
+        result[mask] = np.maximum(table[k][lo[mask]], table[k][hi[mask] - (1 << k)])
+    return result
+
+
+def max_window_weight(times, weights, window_ms: float) -> np.ndarray:
+    """
+    Para cada taladro, la mayor suma de pesos (carga) entre todas las ventanas
+    de window_ms que lo contienen: las que empiezan en (t - window_ms, t].
+    """
+    times = np.asarray(times, dtype=float)
+    if times.size == 0:
+        return np.empty(0)
+    _, starts, _, _, sums, _ = sliding_windows(times, weights, window_ms)
+    lo = np.searchsorted(starts, times - window_ms, side="right")
+    hi = np.searchsorted(starts, times, side="right")
+    return _range_max(sums, lo, hi)
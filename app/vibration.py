@@ -0,0 +1,101 @@
+# app/vibration.py
+
+import os
+
+import numpy as np
+
+from .timing import max_window_weight
+
+# Constantes de sitio por defecto (ley de atenuación USBM, PPV en mm/s, distancia en m, carga en kg)
+DEFAULT_SITE_K = 1140.0
+DEFAULT_SITE_BETA = 1.6
+# Elementos (celdas x taladros) que se evalúan a la vez: acota la memoria de cada tarea
+VIBRATION_CHUNK_ELEMENTS = int(os.getenv("VIBRATION_CHUNK_ELEMENTS", 4_000_000))
+# Lado (en celdas) de los bloques de la grilla; cada bloque descarta los taladros que no pueden dominar
+VIBRATION_TILE_CELLS = int(os.getenv("VIBRATION_TILE_CELLS", 64))
+# Por debajo de este tamaño (celdas x taladros) el mapa se calcula en el propio proceso
+VIBRATION_INLINE_ELEMENTS = int(os.getenv("VIBRATION_INLINE_ELEMENTS", 20_000_000))
+
+
+def _tile_min_ratio(x, y, charge, tile_x, tile_y, min_distance):
+    """
+    Mínimo de D^2 / W por celda de un bloque. Primero se acota el resultado
+    con el mejor taladro para el centro del bloque y se descartan los taladros
+    que ni en el mejor caso pueden bajar de esa cota; con el resto, D^2 / W es
+    lineal en [|c|^2, cx, cy, 1] y se evalúa como un producto de matrices.
+    """
+    cx0, cy0 = (tile_x[0] + tile_x[-1]) / 2, (tile_y[0] + tile_y[-1]) / 2
+    half_diagonal = np.hypot(tile_x[-1] - tile_x[0], tile_y[-1] - tile_y[0]) / 2
+    to_center = np.hypot(x - cx0, y - cy0)
+    best = int((np.maximum(to_center, min_distance) ** 2 / charge).argmin())
+    bound = (max(to_center[best], min_distance) + half_diagonal) ** 2 / charge[best]
+    keep = np.maximum(to_center - half_diagonal, 0.0) ** 2 / charge <= bound
+    x, y, charge = x[keep], y[keep], charge[keep]
+
+    cx = np.tile(tile_x, len(tile_y))
+    cy = np.repeat(tile_y, len(tile_x))
+    cells = np.column_stack([cx * cx + cy * cy, cx, cy, np.ones_like(cx)])
+    holes = np.vstack([1.0 / charge, -2.0 * x / charge, -2.0 * y / charge, (x * x + y * y) / charge])
+    step = max(1, VIBRATION_CHUNK_ELEMENTS // len(x))
+    result = np.concatenate([(cells[i:i + step] @ holes).min(axis=1) for i in range(0, len(cells), step)])
+
+    # Celdas a menos de min_distance de algún taladro: se recalculan con la distancia acotada
+    near = np.nonzero(result < min_distance ** 2 / charge.min())[0]
+    for i in range(0, len(near), step):
+        idx = near[i:i + step]
+        dist2 = np.maximum((cx[idx, None] - x) ** 2 + (cy[idx, None] - y) ** 2, min_distance ** 2)
+        result[idx] = (dist2 / charge).min(axis=1)
+    return result.reshape(len(tile_y), len(tile_x))
+
+
+def _band_min_ratio(x, y, charge, grid_x, band_y, min_distance, tile: int = VIBRATION_TILE_CELLS):
+    """Una franja de filas de la grilla, bloque a bloque. Es la unidad de trabajo del pool de procesos."""
+    return np.hstack([_tile_min_ratio(x, y, charge, grid_x[i:i + tile], band_y, min_distance)
+                      for i in range(0, len(grid_x), tile)])
+
+
+def ppv_map(x, y, times, charge_per_hole, grid_x, grid_y, window_ms: float = 8.0,
+            k: float = DEFAULT_SITE_K, beta: float = DEFAULT_SITE_BETA, min_distance: float = 1.0, pool=None,
+            on_progress=None):
+    """
+    PPV máximo esperado en cada punto de la grilla: PPV = K * (D / sqrt(W))^-beta,
+    donde W es la carga que detona dentro de una misma ventana de window_ms.
+
+    Para una ventana, el peor taladro es el más cercano; el peor caso sobre
+    todas las ventanas equivale entonces a usar, para cada taladro, la mayor
+    carga de las ventanas que lo contienen. Así el mapa se reduce al mínimo de
+    D^2 / W por celda, vectorizado sobre celdas x taladros y calculado por
+    franjas de filas (en el pool de procesos, si se da uno). on_progress(fracción)
+    se llama tras cada franja; si lanza una excepción, las franjas pendientes
+    se cancelan.
+    Devuelve (matriz ny x nx de PPV, carga máxima por ventana).
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    charges = np.broadcast_to(np.asarray(charge_per_hole, dtype=float), x.shape)
+    window_charge = max_window_weight(times, charges, window_ms)
+
+    # Coordenadas relativas al centro de la malla para no perder precisión con UTM
+    x0, y0 = float(x.mean()), float(y.mean())
+    x, y = x - x0, y - y0
+    grid_x, grid_y = np.asarray(grid_x, dtype=float) - x0, np.asarray(grid_y, dtype=float) - y0
+
+    bands = [grid_y[start:start + VIBRATION_TILE_CELLS] for start in range(0, len(grid_y), VIBRATION_TILE_CELLS)]
+    parts = []
+    if pool is None or len(grid_x) * len(grid_y) * len(x) <= VIBRATION_INLINE_ELEMENTS:
+        for band in bands:
+            parts.append(_band_min_ratio(x, y, window_charge, grid_x, band, min_distance))
+            if on_progress is not None:
+                on_progress(len(parts) / len(bands))
+    else:
+        futures = [pool.submit(_band_min_ratio, x, y, window_charge, grid_x, band, min_distance) for band in bands]
+        try:
+            for future in futures:
+                parts.append(future.result())
+                if on_progress is not None:
+                    on_progress(len(parts) / len(bands))
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    scaled2 = np.vstack(parts)
+    return k * scaled2 ** (-beta / 2), float(window_charge.max())
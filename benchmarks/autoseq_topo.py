@@ -0,0 +1,81 @@
+# benchmarks/autoseq_topo.py
+"""
+Chequeo de regresión de la secuenciación automática con el TOPO real del
+repositorio (dos sub-mallas, filas que siguen el contorno y una línea de
+precorte a 3 m).
+
+    python -m benchmarks.autoseq_topo
+    python -m benchmarks.autoseq_topo --initiators 1,289 --csv otro.csv
+
+Para cada patrón y cada iniciador revisa que las filas deducidas sean filas
+(pocos taladros sueltos), que ningún enlace sea mucho más largo que el
+espaciamiento, que no salgan demasiados taladros en el mismo milisegundo y
+que se secuencie toda la malla. Termina con código 1 si algo falla.
+"""
+
+import argparse
+import math
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           "PY-150-F4B-3084-6.50X7.50_6.76X7.80 - TOPO.csv")
+
+# Umbrales del chequeo
+MAX_SINGLE_ROW_FRACTION = 0.05 # Filas de un solo taladro sobre el total de taladros
+MAX_LINK_SPACINGS = 2.0 # Enlace más largo, en espaciamientos de fila
+MAX_SIMULTANEOUS_HOLES = 20
+
+
+def check(ids, x, y, initiator: int, pattern: str) -> list:
+    from app import autoseq
+
+    links, times, layout = autoseq.build_sequence(ids, x, y, {initiator: 0}, pattern, 17, 42)
+    position = {int(drill_id): i for i, drill_id in enumerate(ids)}
+    lengths = [math.hypot(x[position[t]] - x[position[f]], y[position[t]] - y[position[f]]) for f, t, _ in links]
+    singles = sum(len(row) == 1 for row in layout["row_list"])
+
+    print(f"  {pattern:<8} iniciador {initiator:<5} filas {layout['rows']:<4} sueltos {singles:<4} "
+          f"espaciamiento {layout['spacing']:5.2f}  burden {layout['burden']:5.2f}  "
+          f"enlace máx {max(lengths, default=0.0):5.1f} m  simultáneos {layout['max_simultaneous_holes']}")
+    failures = []
+    if singles > MAX_SINGLE_ROW_FRACTION * len(ids):
+        failures.append(f"{singles} filas de un solo taladro")
+    if max(lengths, default=0.0) > MAX_LINK_SPACINGS * layout["spacing"]:
+        failures.append(f"enlace de {max(lengths):.1f} m con espaciamiento {layout['spacing']:.2f} m")
+    if layout["max_simultaneous_holes"] > MAX_SIMULTANEOUS_HOLES:
+        failures.append(f"{layout['max_simultaneous_holes']} taladros en el mismo milisegundo")
+    if layout["unsequenced"] or len(links) != len(ids) - 1:
+        failures.append(f"{len(layout['unsequenced'])} taladros sin secuenciar")
+    failures.extend(layout["warnings"])
+    return [f"{pattern} desde {initiator}: {failure}" for failure in failures]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chequeo de la secuenciación automática con un TOPO real.")
+    parser.add_argument("--csv", default=DEFAULT_CSV, help="CSV sin encabezado: id,x,y,z")
+    parser.add_argument("--initiators", default="1,289,200", help="Iniciadores a probar, uno por corrida")
+    args = parser.parse_args(argv)
+
+    # La app lee la configuración al importarse; el chequeo no usa la base de datos
+    os.environ.setdefault("DATABASE_URL", "sqlite://")
+    from app import autoseq
+
+    df = pd.read_csv(args.csv, header=None, names=["id", "x", "y", "z"])
+    ids, x, y = df["id"].to_numpy(dtype=np.int64), df["x"].to_numpy(dtype=float), df["y"].to_numpy(dtype=float)
+    print(f"{os.path.basename(args.csv)}: {len(ids)} taladros")
+
+    failures = []
+    for initiator in (int(value) for value in args.initiators.split(",")):
+        for pattern in autoseq.PATTERNS:
+            failures.extend(check(ids, x, y, initiator, pattern))
+    for failure in failures:
+        print(f"FALLA {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+# benchmarks/run.py
+"""
+Benchmarks de los endpoints reales con mallas sintéticas.
+
+    python -m benchmarks.run --sizes 100,1000,10000 --output benchmarks/results/actual.json
+    python -m benchmarks.run --compare benchmarks/results/anterior.json
+
+Cada caso (patrón x número de taladros) crea un proyecto nuevo y mide, con
+el TestClient de FastAPI: la carga del CSV, read_project, set_initiator, una
+cadena de apply_sequence, un árbol de secuencia aleatorio (sequence-batch) y
+los tres análisis (en frío y ya cacheados). Por defecto usa una base SQLite
+temporal; con --database-url se puede apuntar a un PostgreSQL de pruebas.
+El resultado es un JSON con la mediana, mínimo y máximo de cada operación.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from .synthetic import PATTERNS, blast_pattern, random_tree, to_csv_bytes
+
+DEFAULT_SIZES = "100,1000,10000,100000"
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _configure_environment(database_url: str):
+    """La app lee la configuración al importarse: hay que fijarla antes."""
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+    os.environ.setdefault("ALGORITHM", "HS256")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+
+class Bench:
+    def __init__(self, client, headers, view_query: str):
+        self.client = client
+        self.headers = headers
+        self.view_query = view_query
+        self.results = []
+
+    def timed(self, case: dict, operation: str, method: str, url: str, runs: int = 1, **kwargs):
+        """Ejecuta la petición 'runs' veces y guarda los tiempos; falla si no responde 2xx."""
+        seconds = []
+        response = None
+        for _ in range(runs):
+            start = time.perf_counter()
+            response = self.client.request(method, url, headers=self.headers, **kwargs)
+            seconds.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{operation}: {response.status_code} {response.text[:200]}")
+        self.record(case, operation, seconds, len(response.content))
+        return response
+
+    def record(self, case: dict, operation: str, seconds: list, response_bytes: int = None):
+        self.results.append({
+            **case,
+            "operation": operation,
+            "runs": len(seconds),
+            "median_s": round(statistics.median(seconds), 6),
+            "min_s": round(min(seconds), 6),
+            "max_s": round(max(seconds), 6),
+            "response_bytes": response_bytes,
+        })
+        print(f"  {operation:<28} {statistics.median(seconds) * 1000:10.1f} ms  (n={len(seconds)})", flush=True)
+
+
+def run_case(bench: Bench, pattern: str, holes: int, chain_length: int, repeat: int, seed: int):
+    case = {"pattern": pattern, "holes": holes}
+    client, headers, view = bench.client, bench.headers, bench.view_query
+    print(f"{pattern} {holes} taladros", flush=True)
+
+    project_id = client.post("/api/projects/", json={"name": f"bench-{pattern}-{holes}"}, headers=headers).json()["id"]
+    base = f"/api/projects/{project_id}"
+    csv_bytes = to_csv_bytes(blast_pattern(holes, pattern, seed=seed))
+    bench.timed(case, "upload_csv", "POST", f"{base}/upload-csv/{view}",
+                files={"file": ("pattern.csv", csv_bytes, "text/csv")})
+
+    columnar = client.get(f"{base}?format=columnar", headers=headers).json()
+    drill_ids = columnar["drills"]["id"]
+    bench.timed(case, "read_project", "GET", base, runs=repeat)
+    bench.timed(case, "read_project_columnar", "GET", f"{base}?format=columnar", runs=repeat)
+
+    # Cadena manual desde un iniciador, un clic por enlace
+    chain = drill_ids[:min(chain_length + 1, len(drill_ids))]
+    bench.timed(case, "set_initiator", "POST", f"{base}/set-initiator/{chain[0]}{view}",
+                json={"delay_ms": 0, "mode": "manual"})
+    seconds = []
+    for from_id, to_id in zip(chain, chain[1:]):
+        start = time.perf_counter()
+        response = client.post(f"{base}/apply-sequence/{from_id}/{to_id}{view}", json={"delay_ms": 17, "mode": "manual"}, headers=headers)
+        seconds.append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            raise RuntimeError(f"apply_sequence: {response.status_code} {response.text[:200]}")
+    if seconds:
+        bench.record(case, "apply_sequence", seconds, len(response.content))
+
+    # El resto de la malla se secuencia con un árbol aleatorio colgado del final de la cadena
+    links = random_tree(drill_ids[len(chain):], chain[-1], seed=seed)
+    bench.timed(case, "sequence_batch_random_tree", "POST", f"{base}/sequence-batch",
+                json={"links": [{"from_drill_id": f, "to_drill_id": t, "delay_ms": d} for f, t, d in links]})
+    # Cambiar el iniciador repropaga toda la malla
+    bench.timed(case, "set_initiator_full_propagation", "POST", f"{base}/set-initiator/{chain[0]}{view}",
+                json={"delay_ms": 5, "mode": "manual"})
+
+    for name in ("timing-analysis", "relief-analysis", "timing-histogram"):
+        operation = name.replace("-", "_")
+        bench.timed(case, f"{operation}_cold", "GET", f"{base}/{name}")
+        bench.timed(case, f"{operation}_cached", "GET", f"{base}/{name}", runs=repeat)
+
+
+def compare(current: list, previous_path: str, threshold: float) -> list:
+    """Operaciones cuya mediana empeoró más que 'threshold' respecto de un resultado anterior."""
+    with open(previous_path) as f:
+        previous = {(r["pattern"], r["holes"], r["operation"]): r for r in json.load(f)["results"]}
+    regressions = []
+    for result in current:
+        before = previous.get((result["pattern"], result["holes"], result["operation"]))
+        if before and before["median_s"] > 0 and result["median_s"] / before["median_s"] > threshold:
+            regressions.append({**result, "previous_median_s": before["median_s"],
+                                "ratio": round(result["median_s"] / before["median_s"], 3)})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de la API con mallas sintéticas.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Números de taladros separados por comas")
+    parser.add_argument("--patterns", default=",".join(PATTERNS))
+    parser.add_argument("--chain-length", type=int, default=20, help="Enlaces creados uno a uno con apply-sequence")
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones de las lecturas")
+    parser.add_argument("--view", choices=("nested", "columnar"), default="columnar",
+                        help="Representación que piden las mutaciones (la anidada es lenta en mallas grandes)")
+    parser.add_argument("--database-url", default=None, help="Por defecto, una base SQLite temporal")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--compare", default=None, help="JSON de una ejecución anterior")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Razón de medianas que cuenta como regresión")
+    args = parser.parse_args(argv)
+
+    tmpdir = tempfile.mkdtemp(prefix="blasting-bench-")
+    database_url = args.database_url or f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    _configure_environment(database_url)
+
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    client = TestClient(app)
+    client.post("/api/users/", json={"email": "bench@example.com", "password": "bench"})
+    token = client.post("/api/login", data={"username": "bench@example.com", "password": "bench"}).json()["access_token"]
+    bench = Bench(client, {"Authorization": f"Bearer {token}"}, "?format=columnar" if args.view == "columnar" else "")
+
+    for pattern in args.patterns.split(","):
+        for holes in (int(size) for size in args.sizes.split(",")):
+            run_case(bench, pattern, holes, args.chain_length, args.repeat, args.seed)
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "database": database_url.split(":", 1)[0],
+            "args": vars(args),
+        },
+        "results": bench.results,
+    }
+    if args.compare:
+        report["regressions"] = compare(bench.results, args.compare, args.threshold)
+        for r in report["regressions"]:
+            print(f"REGRESIÓN {r['pattern']} {r['holes']} {r['operation']}: x{r['ratio']}")
+
+    output = args.output or os.path.join("benchmarks", "results", f"{report['meta']['commit']}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Resultados en {output}")
+    return 1 if args.compare and report["regressions"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+# benchmarks/synthetic.py
+
+import io
+import math
+
+import numpy as np
+import pandas as pd
+
+PATTERNS = ("grid", "staggered")
+DELAYS_MS = (17, 25, 42, 67)
+
+
+def blast_pattern(holes: int, pattern: str = "grid", spacing: float = 7.5, burden: float = 6.5,
+                  azimuth_deg: float = 12.0, origin=(806339.69, 9158140.0), z: float = 3083.5,
+                  jitter: float = 0.15, seed: int = 0) -> pd.DataFrame:
+    """
+    Malla sintética con la forma de los CSV de ejemplo: filas de taladros a
+    'spacing' metros, separadas por 'burden', rotadas 'azimuth_deg' y en
+    coordenadas UTM. 'staggered' desplaza media separación las filas impares
+    (tresbolillo). Las etiquetas son números correlativos, como en el TOPO.
+    Devuelve un DataFrame con label, x, y, z.
+    """
+    if pattern not in PATTERNS:
+        raise ValueError(f"Patrón desconocido '{pattern}'. Opciones: {', '.join(PATTERNS)}")
+    rng = np.random.default_rng(seed)
+    per_row = max(1, int(round(math.sqrt(holes * burden / spacing))))
+    index = np.arange(holes)
+    row, col = index // per_row, index % per_row
+    u = col * spacing + (np.where(row % 2 == 1, spacing / 2, 0.0) if pattern == "staggered" else 0.0)
+    v = row * burden
+    u = u + rng.normal(0, jitter, holes)
+    v = v + rng.normal(0, jitter, holes)
+    angle = math.radians(azimuth_deg)
+    return pd.DataFrame({
+        "label": (index + 1).astype(str),
+        "x": np.round(origin[0] + u * math.cos(angle) - v * math.sin(angle), 2),
+        "y": np.round(origin[1] + u * math.sin(angle) + v * math.cos(angle), 2),
+        "z": np.round(z + rng.normal(0, 0.3, holes), 1),
+    })
+
+
+def to_csv_bytes(pattern: pd.DataFrame) -> bytes:
+    """CSV sin encabezado (label,x,y,z), el layout que detecta la carga por defecto."""
+    buffer = io.StringIO()
+    pattern[["label", "x", "y", "z"]].to_csv(buffer, index=False, header=False)
+    return buffer.getvalue().encode()
+
+
+def random_tree(nodes, root_parent, seed: int = 0, window: int = 8):
+    """
+    Árbol de secuencia aleatorio sobre 'nodes' (en orden): cada nodo cuelga de
+    uno de los 'window' nodos anteriores, y el primero de 'root_parent'. Así
+    hay ramas y profundidades variadas, pero los enlaces unen taladros
+    cercanos, como al secuenciar a mano.
+    Devuelve [(from, to, delay_ms)].
+    """
+    rng = np.random.default_rng(seed)
+    nodes = list(nodes)
+    links = []
+    for i, node in enumerate(nodes):
+        parent = root_parent if i == 0 else nodes[int(rng.integers(max(0, i - window), i))]
+        links.append((parent, node, int(rng.choice(DELAYS_MS))))
+    return links
@@ -0,0 +1,40 @@
+# tests/conftest.py
+
+import os
+
+# app.database crea el engine al importarse: las pruebas usan SQLite en memoria
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+
+import pytest
+
+from app import models
+from app.database import Base, SessionLocal, engine
+
+
+@pytest.fixture
+def db():
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def owner(db):
+    user = models.User(email="owner@example.com", hashed_password="x")
+    db.add(user)
+    db.commit()
+    return user
+
+
+@pytest.fixture
+def project(db, owner):
+    project = models.Project(name="Malla", owner_id=owner.id)
+    db.add(project)
+    db.commit()
+    return project
@@ -0,0 +1,47 @@
+# tests/test_export.py
+
+import io
+
+import pytest
+
+from app import export, ingest, models
+from app.database import SessionLocal
+
+
+@pytest.fixture
+def sequenced_project(db, project):
+    drills = [
+        models.Drill(label="A1", x=100.0, y=200.0, z=10.0, tiempo=0, is_initiator=True, project_id=project.id),
+        models.Drill(label="A2", x=103.5, y=200.0, z=10.5, tiempo=25, project_id=project.id),
+        models.Drill(label="B1", x=100.0, y=204.0, z=9.75, tiempo=67, project_id=project.id),
+    ]
+    db.add_all(drills)
+    db.flush()
+    db.add_all([
+        models.SequenceLink(from_drill_id=drills[0].id, to_drill_id=drills[1].id, delay_ms=25),
+        models.SequenceLink(from_drill_id=drills[1].id, to_drill_id=drills[2].id, delay_ms=42),
+    ])
+    db.commit()
+    return project
+
+
+@pytest.mark.parametrize("header", [True, False])
+def test_csv_export_reimports_with_default_mapping(db, owner, sequenced_project, header):
+    body = "".join(export.iter_csv(SessionLocal, sequenced_project.id, header=header)).encode()
+
+    copy = models.Project(name="Copia", owner_id=owner.id)
+    db.add(copy)
+    db.commit()
+    report = ingest.bulk_load_drills(db, copy.id, ingest.iter_drill_chunks(io.BytesIO(body), {}))
+
+    assert report["rows"] == 3
+    original = db.query(models.Drill.label, models.Drill.x, models.Drill.y, models.Drill.z)\
+        .filter(models.Drill.project_id == sequenced_project.id).order_by(models.Drill.id).all()
+    reimported = db.query(models.Drill.label, models.Drill.x, models.Drill.y, models.Drill.z)\
+        .filter(models.Drill.project_id == copy.id).order_by(models.Drill.id).all()
+    assert reimported == original
+
+
+def test_header_without_mapping_uses_named_columns():
+    first_row = ["label", "x", "y", "z", "tiempo", "is_initiator", "from_label", "delay_ms"]
+    assert ingest.resolve_usecols(first_row, {}, has_header=True) == {"label": "label", "x": "x", "y": "y", "z": "z"}
@@ -0,0 +1,34 @@
+# tests/test_project_view.py
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from app.main import project_view
+
+
+def _request(accept: str = "application/json") -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/", "query_string": b"",
+                    "headers": [(b"accept", accept.encode())]})
+
+
+def test_full_bbox_is_passed_through():
+    view = project_view(_request(), format="columnar", min_x=0.0, min_y=1.0, max_x=10.0, max_y=11.0, since_revision=None)
+    assert view["bbox"] == (0.0, 1.0, 10.0, 11.0)
+
+
+def test_no_bbox_returns_whole_project():
+    view = project_view(_request(), format="columnar", min_x=None, min_y=None, max_x=None, max_y=None, since_revision=None)
+    assert view["bbox"] is None
+
+
+@pytest.mark.parametrize("bounds", [
+    (0.0, None, None, None),
+    (0.0, 1.0, 10.0, None),
+    (None, None, 10.0, 11.0),
+])
+def test_partial_bbox_is_rejected(bounds):
+    min_x, min_y, max_x, max_y = bounds
+    with pytest.raises(HTTPException) as exc:
+        project_view(_request(), format="columnar", min_x=min_x, min_y=min_y, max_x=max_x, max_y=max_y, since_revision=None)
+    assert exc.value.status_code == 400
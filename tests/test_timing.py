@@ -0,0 +1,38 @@
+# tests/test_timing.py
+
+import numpy as np
+import pytest
+
+from app import sequence_graph, timing
+
+
+@pytest.fixture
+def times_with_negative_delay():
+    # Iniciador en 0 ms, un taladro enlazado con retardo negativo y otro con retardo normal
+    initiator = sequence_graph.resolve_time(True, 0)
+    early = sequence_graph.resolve_time(False, 0, parent_time=initiator, delay_ms=-12)
+    late = sequence_graph.resolve_time(False, 0, parent_time=initiator, delay_ms=17)
+    assert early < 0
+    return [initiator, early, late]
+
+
+def test_axis_starts_before_negative_times(times_with_negative_delay):
+    axis, _ = timing.energy_curve(times_with_negative_delay, resolution_ms=1.0)
+    assert axis[0] == pytest.approx(-12 - 50.0)
+    assert axis[-1] == pytest.approx(17 + 50.0)
+
+
+def test_linear_binning_keeps_negative_times_in_place(times_with_negative_delay):
+    times = np.asarray(times_with_negative_delay, dtype=float)
+    axis = timing.time_axis(times.max(), resolution_ms=1.0, min_time=times.min())
+    hist = timing._linear_binning(times, np.ones_like(times), axis)
+    assert hist.sum() == pytest.approx(len(times))
+    for t in times:
+        assert hist[int(np.argmin(np.abs(axis - t)))] == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize("method", ["direct", "fft"])
+def test_binned_methods_match_exact_with_negative_delay(times_with_negative_delay, method):
+    _, exact = timing.energy_curve(times_with_negative_delay, resolution_ms=0.5, method="exact")
+    _, binned = timing.energy_curve(times_with_negative_delay, resolution_ms=0.5, method=method)
+    np.testing.assert_allclose(binned, exact, atol=1e-6)